@@ -13,7 +13,15 @@ if not SUPABASE_URL or not SUPABASE_KEY:
 
 supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
 
+# Service-role key for server-side access that isn't done as a user, such
+# as the private run GIF bucket or replaying saves after the caller's token
+# expired. Bypasses RLS; never sent to clients.
+SUPABASE_SERVICE_ROLE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+service_supabase = create_client(
+    SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY) if SUPABASE_SERVICE_ROLE_KEY else None
+
 # Table names
 HISTORY_TABLE = "run_history"
 GIF_TABLE = "run_gifs"
 DOCUMENT_TABLE = "run_documents"
+EVENTS_TABLE = "run_events"
@@ -1,6 +1,6 @@
 from fastapi import FastAPI, HTTPException, Request, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel, SecretStr
 from langchain_openai import ChatOpenAI
@@ -9,17 +9,31 @@ import asyncio
 from dotenv import load_dotenv
 import os
 import logging
-import requests
 import uuid
-from typing import Dict, Optional, List, Any, Set
-from app.services.history_service import save_run_history, get_run_history, get_run_details, delete_run_history, update_history_with_document
-from app.utils.auth import get_user_id, get_user_id_and_tokens, AuthTokens
+from typing import Dict, Optional, List, Any, Tuple
+from app.services.history_service import build_history_record, get_run_history, get_run_details, get_run_fields, delete_run_history, update_history_with_document, build_detail_select, decode_history_cursor, COUNT_MODES
+from app.services.cache_service import response_cache, LIST_TAG
+from app.services.storage_service import object_store, gif_key, StoredObject
+from app.services.anchor_client import anchor_client
+from app.services.browser_pool import browser_pool, BrowserSession
+from app.services.scheduler import (
+    run_scheduler, RunTicket, QueueFullError, RUN_QUEUE_KEEPALIVE, RUN_QUEUE_RETRY_AFTER)
+from app.services.run_log import run_logs, RunEventLog, EventId, RUN_LOG_RETENTION, format_event_id, parse_event_id
+from app.services.worker_pool import worker_pool, RUN_WORKER_DRAIN_TIMEOUT
+from app.services.recording_service import render_history_gif
+from app.utils.executors import gif_executor
+from app.services.event_store import RunEventWriter, iter_run_events, follow_run_events, has_run_events
+from app.services.history_writer import history_writer
+from app.services.document_cache import document_cache, document_key, agent_fingerprint, CachedDocument
+from app.services.progress_service import AgentProgressTracker, ProgressBatcher, ProgressDeduplicator, next_update
+from app.utils.auth import get_user_id, get_user_id_and_tokens, token_verifier, AuthTokens
+from app.utils.db import shutdown_db_executor
+from app.utils.metrics import counter, gauge, histogram, metrics_snapshot
 import base64
+import hashlib
 from pathlib import Path
 import orjson  # Faster JSON serialization/deserialization
 import time
-import io
-from concurrent.futures import ThreadPoolExecutor
 from lmnr import Laminar, observe
 # Import OpenAI Agents SDK
 from agents import Agent as OpenAIAgent, Runner, handoff
@@ -36,9 +50,6 @@ logging.basicConfig(
     datefmt='%Y-%m-%d %H:%M:%S'
 )
 
-# Thread pool for concurrent operations
-thread_pool = ThreadPoolExecutor(max_workers=4)
-
 app = FastAPI()
 
 origins = [
@@ -59,9 +70,6 @@ app.add_middleware(
 # Mount static files directory
 app.mount("/static", StaticFiles(directory="."), name="static")
 
-# Initialize browser configuration
-ANCHOR_API_KEY = os.getenv("ANCHOR_API_KEY")
-
 # Create temporary directory with improved efficiency
 TEMP_DIR = Path("/tmp/digest_ai_gifs")
 TEMP_DIR.mkdir(parents=True, exist_ok=True)
@@ -72,6 +80,19 @@ DOCS_DIR = Path("/tmp/digest_ai_docs")
 DOCS_DIR.mkdir(parents=True, exist_ok=True)
 os.chmod(DOCS_DIR, 0o777)
 
+# GIF execution-time budget; time spent waiting for a worker doesn't count
+GIF_RENDER_TIMEOUT = float(os.getenv("GIF_RENDER_TIMEOUT", "30"))
+# Document generation is cancelled after this long without new output
+DOCUMENT_IDLE_TIMEOUT = float(os.getenv("DOCUMENT_IDLE_TIMEOUT", "30"))
+
+# Document generations (LLM calls) in flight at once per worker
+DOCUMENT_MAX_CONCURRENCY = int(os.getenv("DOCUMENT_MAX_CONCURRENCY", "4"))
+document_slots = asyncio.Semaphore(DOCUMENT_MAX_CONCURRENCY)
+documents_in_flight = gauge("documents_in_flight", "Document generations running")
+document_wait_seconds = histogram("document_wait_seconds", "Time a document generation waited for a slot")
+document_run_seconds = histogram("document_run_seconds", "Time a document generation ran")
+document_timeouts = counter("document_timeouts_total", "Document generations cancelled for going idle")
+
 # Browser configuration settings
 browser_configuration = {
     "adblock_config": {"active": True},
@@ -80,33 +101,6 @@ browser_configuration = {
     "headless": False
 }
 
-# Memory-efficient response cache with TTL
-RESPONSE_CACHE = {}
-CACHE_TTL = 300  # 5 minutes
-MAX_CACHE_ITEMS = 100
-
-# Cache invalidation function
-
-
-def clean_cache():
-    """Remove expired cache items"""
-    if not RESPONSE_CACHE:
-        return
-
-    current_time = time.time()
-    expired_keys = [k for k, v in RESPONSE_CACHE.items()
-                    if current_time - v['timestamp'] > CACHE_TTL]
-
-    for key in expired_keys:
-        del RESPONSE_CACHE[key]
-
-    # If cache is too large, remove oldest items
-    if len(RESPONSE_CACHE) > MAX_CACHE_ITEMS:
-        sorted_items = sorted(RESPONSE_CACHE.items(),
-                              key=lambda x: x[1]['timestamp'])
-        for k, _ in sorted_items[:len(RESPONSE_CACHE) - MAX_CACHE_ITEMS]:
-            del RESPONSE_CACHE[k]
-
 # Initialize document generation agents
 
 
@@ -186,69 +180,91 @@ document_selector_agent.handoff_config = handoff(
     document_agent, research_agent, summary_agent
 )
 
+# Part of every document cache key, so changing any agent invalidates it
+DOCUMENT_AGENT_FINGERPRINT = agent_fingerprint(
+    [document_selector_agent, document_agent, research_agent, summary_agent])
+
 
 @app.get("/")
 def read_root():
     return {"message": "Welcome to the Digest AI API"}
 
 
-def create_browser_session():
-    """Create a new browser session with Anchor Browser."""
-    try:
-        response = requests.post(
-            "https://api.anchorbrowser.io/api/sessions",
-            headers={
-                "anchor-api-key": ANCHOR_API_KEY,
-                "Content-Type": "application/json",
-            },
-            json=browser_configuration,
-        )
-        response.raise_for_status()
-        response_data = response.json()
-        logging.info(
-            f"Anchor Browser session created with response: {response_data}")
-        return response_data
-    except Exception as e:
-        logging.error(f"Failed to create browser session: {e}")
-        raise HTTPException(
-            status_code=500, detail="Failed to create browser session")
+@app.on_event("startup")
+async def check_auth_configuration():
+    """Report missing token verification settings before requests fail."""
+    await token_verifier.check_configuration()
 
 
-def get_browser():
-    """Get a configured browser instance with session management and live view URL."""
-    try:
-        session_data = create_browser_session()
-        session_id = session_data["id"]
-        live_view_url = session_data.get("live_view_url")
+@app.on_event("startup")
+async def start_history_writer():
+    """Start writing journaled run saves, including any left from a restart."""
+    await history_writer.start()
 
-        if live_view_url:
-            logging.info(f"Live view URL found: {live_view_url}")
-        else:
-            # Check if the URL might be under a different key name
-            all_keys = session_data.keys()
-            logging.info(f"No live_view_url found. Available keys: {all_keys}")
-
-            # Check if there's a key that contains 'url' or 'view'
-            url_keys = [k for k in all_keys if 'url' in k.lower()
-                        or 'view' in k.lower()]
-            if url_keys:
-                logging.info(f"Potential URL keys found: {url_keys}")
-                for key in url_keys:
-                    logging.info(f"Key {key} value: {session_data.get(key)}")
-
-            # Construct the URL based on documentation
-            host = "connect.anchorbrowser.io"
-            constructed_url = f"https://live.anchorbrowser.io/inspector.html?host={host}&sessionId={session_id}"
-            logging.info(f"Constructed live view URL: {constructed_url}")
-            live_view_url = constructed_url
+
+@app.on_event("startup")
+async def start_browser_pool():
+    """Start pre-creating browser sessions for the default configuration."""
+    if worker_pool.enabled:
+        # Sessions are pooled by the worker processes that use them
+        await worker_pool.start()
+    else:
+        await browser_pool.start([browser_configuration])
+
+
+@app.on_event("shutdown")
+async def drain_runs():
+    """Let in-flight runs finish (and save their history) before exiting."""
+    if worker_pool.enabled:
+        await worker_pool.drain()
+    else:
+        await run_logs.drain(RUN_WORKER_DRAIN_TIMEOUT)
+
+
+@app.on_event("shutdown")
+async def drain_history_writes():
+    """Give journaled run saves a last chance to reach the database."""
+    await history_writer.drain()
+
+
+@app.on_event("shutdown")
+async def stop_browser_pool():
+    # Ends the warm sessions on Anchor, then closes the shared connections
+    await browser_pool.stop()
+    await anchor_client.close()
+
+
+@app.on_event("shutdown")
+def shutdown_executors():
+    """Let in-flight database calls finish before the worker exits."""
+    shutdown_db_executor()
+    gif_executor.shutdown()
+
+
+@app.get("/api/metrics")
+def get_metrics():
+    """Return in-process counters, gauges and latency histograms."""
+    return metrics_snapshot()
+
+
+async def get_browser():
+    """Get a configured browser on a (preferably warm) pooled session.
+
+    Returns the browser, its live view URL and the pooled session, which the
+    caller must hand back with `browser_pool.release` once the run is over.
+    """
+    try:
+        session = await browser_pool.acquire(browser_configuration)
 
         browser = Browser(
             config=BrowserConfig(
-                cdp_url=f"wss://connect.anchorbrowser.io?apiKey={ANCHOR_API_KEY}&sessionId={session_id}",
+                cdp_url=session.cdp_url,
             )
         )
 
-        return browser, live_view_url
+        return browser, session.live_view_url, session
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Failed to initialize browser: {e}")
         raise HTTPException(
@@ -290,126 +306,311 @@ def safe_serialize(obj: Any) -> str:
 
 
 @app.get("/api/history")
-async def get_history(request: Request, limit: int = 10, offset: int = 0):
-    """Get run history with pagination and caching."""
-    cache_key = f"history_{limit}_{offset}"
-
-    # Check cache first
-    if cache_key in RESPONSE_CACHE:
-        cache_entry = RESPONSE_CACHE[cache_key]
-        # If cache is still valid
-        if time.time() - cache_entry['timestamp'] < CACHE_TTL:
-            return cache_entry['data']
-
-    # Cache miss, get data from source
+async def get_history(
+    request: Request,
+    limit: int = 10,
+    offset: int = 0,
+    summary: bool = False,
+    cursor: Optional[str] = None,
+    count: str = "exact"
+):
+    """Get run history with pagination and per-user caching.
+
+    Parameters:
+    - limit / offset: Page size and offset-based position
+    - summary: Return only summary columns (no progress events)
+    - cursor: `next_cursor` from a previous page; uses keyset pagination
+      and ignores offset
+    - count: "exact" (default), "planned", "estimated" or "none" for the total
+    """
+    if count not in COUNT_MODES:
+        raise HTTPException(status_code=400, detail=f"Invalid count mode: {count}")
+    if cursor:
+        try:
+            decode_history_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
     user_id, tokens = await get_user_id_and_tokens(request)
-    result = await get_run_history(user_id, limit, offset, auth_tokens=tokens)
 
-    # Update cache
-    RESPONSE_CACHE[cache_key] = {
-        'data': result,
-        'timestamp': time.time()
-    }
+    return await response_cache.get_or_load(
+        user_id,
+        f"history:{limit}:{offset}:{int(summary)}:{cursor or ''}:{count}",
+        lambda: get_run_history(
+            user_id, limit, offset, auth_tokens=tokens,
+            summary=summary, cursor=cursor, count=count),
+        tags=(LIST_TAG,)
+    )
 
-    # Clean cache in background
-    clean_cache()
 
-    return result
+def split_query_list(value: Optional[str]) -> Optional[List[str]]:
+    """Parse a comma-separated query parameter; None means "not given"."""
+    if value is None:
+        return None
+    return [item.strip() for item in value.split(",") if item.strip()]
 
 
 @app.get("/api/history/{history_id}")
-async def get_history_detail(request: Request, history_id: str, format: str = "json"):
-    """Get detailed run information including GIF with caching.
+async def get_history_detail(
+    request: Request,
+    history_id: str,
+    format: str = "json",
+    fields: Optional[str] = None,
+    include: Optional[str] = None
+):
+    """Get detailed run information including GIF with per-user caching.
 
     Parameters:
     - history_id: The ID of the history entry to retrieve
-    - format: Response format, either "json" (default) or "chunked" for large responses
+    - format: Response format: "json" (default), "chunked"/"ndjson" to stream
+      metadata and GIF chunks as NDJSON, or "binary" for the raw GIF bytes
+    - fields: Comma-separated run_history columns to return (default: all),
+      e.g. "task,result,created_at"
+    - include: Comma-separated related payloads to embed, any of "gif" and
+      "document" (default: both); pass an empty value to embed neither
     """
-    cache_key = f"history_detail_{history_id}_{format}"
-
-    # Check cache first
-    if cache_key in RESPONSE_CACHE:
-        cache_entry = RESPONSE_CACHE[cache_key]
-        # If cache is still valid
-        if time.time() - cache_entry['timestamp'] < CACHE_TTL:
-            # For chunked responses, we need to recreate the generator
-            if format == "chunked" and isinstance(cache_entry['data'], dict):
-                return StreamingResponse(
-                    stream_chunked_response(cache_entry['data']),
-                    media_type="application/json"
-                )
-            return cache_entry['data']
+    if format == "binary":
+        return await get_history_gif(request, history_id)
+
+    field_list = split_query_list(fields)
+    include_list = split_query_list(include)
+    try:
+        build_detail_select(field_list, include_list)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Whether progress lives in run_events decides where it is read from
+    wants_progress = field_list is None or "progress" in field_list
+    shows_flag = field_list is None or "events_persisted" in field_list
+    if field_list is not None and wants_progress and "events_persisted" not in field_list:
+        field_list = field_list + ["events_persisted"]
+
+    projection = ":".join(
+        ",".join(sorted(items)) if items is not None else "*"
+        for items in (field_list, include_list)
+    )
 
     try:
         user_id, tokens = await get_user_id_and_tokens(request)
-        result = await get_run_details(user_id, history_id, auth_tokens=tokens)
+        result = await response_cache.get_or_load(
+            user_id,
+            f"history_detail:{history_id}:{projection}",
+            lambda: get_run_details(
+                user_id, history_id, auth_tokens=tokens,
+                fields=field_list, include=include_list),
+            tags=(history_id,)
+        )
 
         if not result:
             raise HTTPException(
                 status_code=404, detail="History entry not found")
 
-        # Check for large GIF content that might cause HTTP/2 stream issues
-        gif_content_size = len(result.get("gif_content", "")) if result.get(
-            "gif_content") else 0
+        # Stored GIFs are also served by GET /api/history/{id}/gif
+        result = dict(result)
+        gif_object = result.pop("gif_object", None)
+        if gif_object:
+            result["gif_url"] = f"/api/history/{history_id}/gif"
+            gif_content_size = (gif_object["size"] + 2) // 3 * 4
+        else:
+            gif_content_size = len(result.get("gif_content") or "")
+
+        # Progress saved in chunks during the run is read back page by page
+        progress_chunks = None
+        events_persisted = result.get("events_persisted") if shows_flag \
+            else result.pop("events_persisted", None)
+        if wants_progress and events_persisted:
+            progress_chunks = iter_run_events(user_id, history_id, auth_tokens=tokens)
 
         # If chunked format requested or GIF is very large, use streaming response
-        if format == "chunked" or gif_content_size > 1_000_000:  # > 1MB
-            # Update cache with the raw data
-            RESPONSE_CACHE[cache_key] = {
-                'data': result,
-                'timestamp': time.time()
-            }
-
-            # Return as streaming response
+        if format in ("chunked", "ndjson") or gif_content_size > 1_000_000:  # > 1MB
             return StreamingResponse(
-                stream_chunked_response(result),
-                media_type="application/json"
+                stream_chunked_response(result, gif_object, progress_chunks),
+                media_type="application/x-ndjson" if format == "ndjson" else "application/json"
             )
-        else:
-            # Update cache with regular response
-            RESPONSE_CACHE[cache_key] = {
-                'data': result,
-                'timestamp': time.time()
-            }
 
-            return result
+        if progress_chunks is not None:
+            result["progress"] = [
+                event async for chunk in progress_chunks for event in chunk]
+
+        # Plain JSON needs the whole GIF inline as base64
+        if gif_object:
+            try:
+                result["gif_content"] = base64.b64encode(
+                    await object_store.read(gif_object["key"])).decode('ascii')
+            except Exception as e:
+                logging.error(f"Error reading GIF object: {str(e)}")
+                result["gif_content"] = None
+
+        return result
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(
             f"Error fetching history detail: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
 
-async def stream_chunked_response(data: dict):
-    """Stream a large JSON response in chunks to avoid HTTP/2 stream reset issues."""
-    # Helper function to break down large data into manageable chunks
-    try:
-        # First yield the metadata without large binary content
-        metadata = {k: v for k, v in data.items() if k not in [
-            "gif_content", "document_content"]}
-        yield orjson.dumps(metadata).decode('utf-8') + "\n"
+async def iter_bytes(data: bytes, start: int = 0, end: Optional[int] = None, chunk_size: int = 256 * 1024):
+    """Yield [start, end] of an in-memory buffer as zero-copy memoryview slices."""
+    view = memoryview(data)
+    end = len(data) - 1 if end is None else end
+    for offset in range(start, end + 1, chunk_size):
+        yield view[offset:min(offset + chunk_size, end + 1)]
+
+
+# Raw GIF bytes per NDJSON chunk; a multiple of 3 so each base64 chunk is
+# self-contained and the chunks concatenate to the full base64 string
+GIF_STREAM_CHUNK_SIZE = 3 * 128 * 1024
+
 
-        # Stream GIF content in smaller chunks if present
-        if "gif_content" in data and data["gif_content"]:
-            gif_content = data["gif_content"]
-            # Stream in chunks of ~500KB
-            chunk_size = 500_000
+async def base64_chunks(chunks, chunk_size: int = GIF_STREAM_CHUNK_SIZE):
+    """Base64-encode a stream of byte chunks into independently valid pieces."""
+    pending = bytearray()
+    async for chunk in chunks:
+        pending += chunk
+        usable = len(pending) - len(pending) % 3
+        if usable >= chunk_size:
+            yield base64.b64encode(memoryview(pending)[:usable])
+            del pending[:usable]
+    if pending:
+        yield base64.b64encode(pending)
 
-            for i in range(0, len(gif_content), chunk_size):
-                chunk = gif_content[i:i+chunk_size]
-                yield orjson.dumps({"gif_content_chunk": chunk, "chunk_index": i // chunk_size}).decode('utf-8') + "\n"
-                await asyncio.sleep(0.01)  # Small delay between chunks
+
+async def stream_chunked_response(data: dict, gif_object: Optional[Dict] = None, progress_chunks=None):
+    """Stream a large JSON response as NDJSON to avoid HTTP/2 stream reset issues.
+
+    GIF chunks are written straight from the object store (or from a view
+    over a legacy inline base64 string) without re-serializing them, and the
+    response applies backpressure through the ASGI send instead of sleeping.
+    Progress persisted in run_events (`progress_chunks`) follows the
+    metadata as `progress_events` lines, one per stored chunk.
+    """
+    try:
+        # First yield the metadata without large binary content
+        excluded = ["gif_content", "document_content"]
+        if progress_chunks is not None:
+            excluded.append("progress")
+        metadata = {k: v for k, v in data.items() if k not in excluded}
+        yield orjson.dumps(metadata) + b"\n"
+
+        if progress_chunks is not None:
+            async for events in progress_chunks:
+                yield orjson.dumps({"progress_events": events}) + b"\n"
+            yield orjson.dumps({"progress_complete": True}) + b"\n"
+
+        if gif_object:
+            chunks = base64_chunks(object_store.iter_range(
+                gif_object["key"], 0, gif_object["size"] - 1,
+                chunk_size=GIF_STREAM_CHUNK_SIZE))
+        elif data.get("gif_content"):
+            chunks = iter_bytes(data["gif_content"].encode('ascii'),
+                                chunk_size=GIF_STREAM_CHUNK_SIZE // 3 * 4)
+        else:
+            chunks = None
+
+        if chunks is not None:
+            # Base64 needs no JSON escaping, so the line is assembled around
+            # the chunk instead of copying it through a JSON encoder
+            chunk_index = 0
+            async for chunk in chunks:
+                yield b'{"gif_content_chunk":"'
+                yield chunk
+                yield b'","chunk_index":%d}\n' % chunk_index
+                chunk_index += 1
 
             # Signal end of GIF content
-            yield orjson.dumps({"gif_content_complete": True}).decode('utf-8') + "\n"
+            yield orjson.dumps({"gif_content_complete": True}) + b"\n"
 
         # Stream document content separately if present
         if "document_content" in data and data["document_content"]:
-            yield orjson.dumps({"document_content": data["document_content"]}).decode('utf-8') + "\n"
+            yield orjson.dumps({"document_content": data["document_content"]}) + b"\n"
 
     except Exception as e:
         logging.error(
             f"Error streaming chunked response: {str(e)}", exc_info=True)
-        yield orjson.dumps({"error": str(e)}).decode('utf-8') + "\n"
+        yield orjson.dumps({"error": str(e)}) + b"\n"
+
+
+def parse_byte_range(range_header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Parse a single-range "bytes=start-end" header into inclusive offsets.
+
+    Returns None when the header is absent or not a byte range we handle
+    (the whole object is then served) and raises HTTPException(416) when
+    the range can't be satisfied.
+    """
+    if not range_header or not range_header.startswith("bytes=") or "," in range_header:
+        return None
+
+    start_text, _, end_text = range_header[len("bytes="):].strip().partition("-")
+    try:
+        if start_text:
+            start = int(start_text)
+            end = int(end_text) if end_text else size - 1
+        else:
+            # Suffix range: the last N bytes
+            start = max(0, size - int(end_text))
+            end = size - 1
+    except ValueError:
+        return None
+
+    end = min(end, size - 1)
+    if start > end or start >= size:
+        raise HTTPException(
+            status_code=416,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"}
+        )
+    return start, end
+
+
+@app.get("/api/history/{history_id}/gif")
+async def get_history_gif(request: Request, history_id: str):
+    """Serve a run's GIF recording as binary with ETag and Range support."""
+    user_id, tokens = await get_user_id_and_tokens(request)
+    result = await response_cache.get_or_load(
+        user_id,
+        f"history_detail:{history_id}:id:gif",
+        lambda: get_run_details(
+            user_id, history_id, auth_tokens=tokens,
+            fields=["id"], include=["gif"]),
+        tags=(history_id,)
+    )
+    if not result or not (result.get("gif_object") or result.get("gif_content")):
+        raise HTTPException(status_code=404, detail="Recording not found")
+
+    gif_object = result.get("gif_object")
+    if gif_object:
+        size, etag, data = gif_object["size"], gif_object["etag"], None
+    else:
+        # Legacy rows keep the GIF inline as base64
+        data = base64.b64decode(result["gif_content"])
+        size, etag = len(data), hashlib.sha256(data).hexdigest()
+
+    headers = {
+        "ETag": f'"{etag}"',
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "private, max-age=3600",
+    }
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+
+    byte_range = None
+    if request.headers.get("if-range", headers["ETag"]) == headers["ETag"]:
+        byte_range = parse_byte_range(request.headers.get("range"), size)
+    start, end = byte_range or (0, size - 1)
+
+    headers["Content-Length"] = str(end - start + 1)
+    if byte_range:
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+
+    body = iter_bytes(data, start, end) if data is not None else \
+        object_store.iter_range(gif_object["key"], start, end)
+    return StreamingResponse(
+        body,
+        status_code=206 if byte_range else 200,
+        media_type="image/gif",
+        headers=headers
+    )
 
 
 @app.delete("/api/history/{history_id}")
@@ -421,56 +622,148 @@ async def delete_history(request: Request, history_id: str, background_tasks: Ba
     if not success:
         raise HTTPException(status_code=404, detail="History entry not found")
 
-    # Clear related cache entries in background
-    background_tasks.add_task(
-        lambda: [RESPONSE_CACHE.pop(k) for k in list(RESPONSE_CACHE.keys())
-                 if history_id in k]
-    )
+    # Drop exactly the cached entries this deletion affects
+    await response_cache.invalidate(user_id, history_id, LIST_TAG)
+
+    # The run_gifs row is removed by ON DELETE CASCADE; drop its object too
+    try:
+        await object_store.delete(gif_key(history_id))
+    except Exception as e:
+        logging.warning(f"Error deleting GIF object for {history_id}: {str(e)}")
 
     return {"status": "success"}
 
 
-async def create_gif_from_history(agent: Agent, run_id: str) -> Optional[str]:
-    """Create GIF from agent history with optimized memory usage."""
+def remove_temp_file(path: Path) -> None:
+    try:
+        path.unlink(missing_ok=True)
+    except Exception as e:
+        logging.warning(f"Error cleaning up {path}: {str(e)}")
+
+
+async def create_gif_from_history(agent: Agent, run_id: str) -> Optional[StoredObject]:
+    """Create GIF from agent history and move it into the object store."""
     temp_gif_path = TEMP_DIR / f"agent_history_{run_id}.gif"
 
     try:
         # Create GIF using a more efficient approach
         logging.info(f"Creating GIF at path: {temp_gif_path}")
 
-        # Use thread pool for CPU-bound GIF creation
-        loop = asyncio.get_event_loop()
-        await loop.run_in_executor(
-            thread_pool,
-            lambda: agent.create_history_gif(output_path=str(temp_gif_path))
+        # CPU-bound, so it gets its own executor (optionally processes)
+        # instead of queueing behind document generation. A render we stop
+        # waiting for still writes its file later; it is removed then
+        await gif_executor.run(
+            render_history_gif, agent.task, agent.history, str(temp_gif_path),
+            timeout=GIF_RENDER_TIMEOUT,
+            abandoned_cleanup=lambda: remove_temp_file(temp_gif_path)
         )
 
         if not temp_gif_path.exists():
             logging.warning(f"GIF file was not created at {temp_gif_path}")
             return None
 
-        # Read using memory-efficient buffered IO
-        with open(temp_gif_path, 'rb') as gif_file:
-            buffer = io.BytesIO(gif_file.read())
-            gif_content = base64.b64encode(buffer.getvalue()).decode('utf-8')
+        # Stream the file to the object store; no in-memory copy or base64 encoding
+        gif_object = await object_store.put_file(
+            gif_key(run_id), temp_gif_path, "image/gif")
 
-        logging.info(f"Successfully created GIF with size: {len(gif_content)}")
-        return gif_content
+        logging.info(f"Successfully created GIF with size: {gif_object.size}")
+        return gif_object
 
     except Exception as e:
         logging.error(f"Error creating GIF: {str(e)}")
         return None
     finally:
-        # Clean up in a way that's more tolerant of failures
+        remove_temp_file(temp_gif_path)
+
+
+async def stream_document_agent(agent: OpenAIAgent, message: str):
+    """Run a document agent natively on the event loop, streaming its text.
+
+    Yields ("delta", text) as the model writes and finally ("final",
+    result) with the finished streamed run.
+    At most DOCUMENT_MAX_CONCURRENCY generations run at once. The run is
+    cancelled when it produces nothing for DOCUMENT_IDLE_TIMEOUT seconds,
+    so long documents that keep writing never time out.
+    """
+    waited_since = time.monotonic()
+    async with document_slots:
+        document_wait_seconds.observe(time.monotonic() - waited_since)
+        documents_in_flight.inc()
+        started = time.monotonic()
+        result = Runner.run_streamed(agent, message)
+        deltas: asyncio.Queue = asyncio.Queue()
+
+        async def pump():
+            # stream_events() ends once the run is complete; cancelling its
+            # consumer makes the SDK stop the run (and its LLM request)
+            try:
+                async for event in result.stream_events():
+                    if event.type == "raw_response_event" and getattr(event.data, "type", None) == "response.output_text.delta":
+                        deltas.put_nowait(event.data.delta)
+            finally:
+                deltas.put_nowait(None)
+
+        pump_task = asyncio.create_task(pump())
         try:
-            if temp_gif_path.exists():
-                os.unlink(temp_gif_path)
-        except Exception as e:
-            logging.warning(f"Error cleaning up GIF file: {str(e)}")
+            while True:
+                delta = await asyncio.wait_for(deltas.get(), timeout=DOCUMENT_IDLE_TIMEOUT)
+                if delta is None:
+                    break
+                yield "delta", delta
+            # Raises what the run failed with, if anything
+            await pump_task
+            yield "final", result
+        except asyncio.TimeoutError:
+            document_timeouts.inc()
+            logging.warning(
+                f"Document generation cancelled after {DOCUMENT_IDLE_TIMEOUT}s without output")
+            raise
+        finally:
+            if not pump_task.done():
+                pump_task.cancel()
+                await asyncio.gather(pump_task, return_exceptions=True)
+            documents_in_flight.dec()
+            document_run_seconds.observe(time.monotonic() - started)
 
 
-async def generate_document_from_results(browser_results, task, run_id, is_done=True):
-    """Generate document from browser results using OpenAI Agents.
+# Separates a run's browser result from the document appended to it
+GENERATED_DOCUMENT_HEADING = "\n\n## Generated Document\n\n"
+
+
+def browser_result_of(result: Optional[str]) -> str:
+    """A stored run result without the generated document appended to it."""
+    return (result or "").split(GENERATED_DOCUMENT_HEADING, 1)[0]
+
+
+def split_document_type(output: str) -> Tuple[str, str]:
+    """Split the selector's "DOCUMENT TYPE: ..." line off its output."""
+    if not output.startswith("DOCUMENT TYPE:"):
+        return "report", output
+
+    doc_type_line, _, content = output.partition("\n")
+    if "summary" in doc_type_line.lower():
+        selected_doc_type = "summary"
+    elif "analysis" in doc_type_line.lower():
+        selected_doc_type = "analysis"
+    else:
+        selected_doc_type = "report"
+    return selected_doc_type, content.strip()
+
+
+def document_header(doc_type: str, task: str) -> str:
+    return f"# {doc_type.title()} Document\n\n**Task:** {task}\n\n"
+
+
+async def stream_document_from_results(browser_results, task, run_id, is_done=True):
+    """Generate a document from browser results, streaming it as it is written.
+
+    Yields ("delta", text) chunks of the formatted document, appending each
+    to the document file as it arrives, and finally ("document", text) with
+    the complete document, or ("document", None) if generation failed.
+    When the finished document isn't what was streamed (or generation
+    failed after streaming), ("reset", text) comes first with the text that
+    replaces everything streamed so far. A document cached for the same
+    inputs is returned in one delta.
 
     Parameters:
     - browser_results: Results from the browser task
@@ -479,6 +772,7 @@ async def generate_document_from_results(browser_results, task, run_id, is_done=
     - is_done: Whether the task completed successfully or timed out
     """
     document_path = DOCS_DIR / f"document_{run_id}.md"
+    streamed = []
 
     try:
         # Format browser results for the agent
@@ -491,19 +785,6 @@ async def generate_document_from_results(browser_results, task, run_id, is_done=
         {"Note: The browser task did not complete within the maximum allowed steps. These are partial results." if not is_done else ""}
         """
 
-        # Define a synchronous function to run the agent
-        def run_agent_sync(agent, message):
-            # Create a new event loop in this thread
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            try:
-                return Runner.run_sync(agent, message)
-            finally:
-                # Clean up to prevent memory leaks
-                loop.close()
-
-        loop = asyncio.get_event_loop()
-
         # Use the selector agent to determine document type
         selector_message = f"""
         {formatted_results}
@@ -513,174 +794,203 @@ async def generate_document_from_results(browser_results, task, run_id, is_done=
         {'' if is_done else 'IMPORTANT: These results are PARTIAL as the task did not complete within the maximum steps.'}
         """
 
-        # Run the selector agent to determine document type and generate content
-        result = await loop.run_in_executor(
-            thread_pool,
-            run_agent_sync,
-            document_selector_agent,
-            selector_message
-        )
+        # Identical inputs give the same document, so reuse it without
+        # calling the LLM at all
+        cache_key = document_key(
+            task, browser_results, is_done, DOCUMENT_AGENT_FINGERPRINT)
+        cached = await document_cache.get(cache_key)
+        if cached is not None:
+            logging.info(f"Document for run {run_id} served from cache")
+            with open(document_path, 'w') as doc_file:
+                doc_file.write(cached.content)
+            yield "delta", cached.content
+            yield "document", cached.content
+            return
 
-        # Extract the document type from the output
-        document_content = result.final_output
-
-        # Parse the document type from the output
-        if document_content.startswith("DOCUMENT TYPE:"):
-            doc_type_line = document_content.split("\n")[0]
-            if "summary" in doc_type_line.lower():
-                selected_doc_type = "summary"
-            elif "analysis" in doc_type_line.lower():
-                selected_doc_type = "analysis"
-            else:
-                selected_doc_type = "report"
-
-            # Remove the document type line from the content
-            document_content = "\n".join(
-                document_content.split("\n")[1:]).strip()
-        else:
+        started = time.monotonic()
+        # Output is held back until the document type line is complete,
+        # since it decides the header
+        pending = ""
+        final_output = None
+        usage = []
+        with open(document_path, 'w') as doc_file:
+            def write(text):
+                doc_file.write(text)
+                doc_file.flush()
+                streamed.append(text)
+                return text
+
+            async for kind, value in stream_document_agent(document_selector_agent, selector_message):
+                if kind == "final":
+                    final_output = value.final_output
+                    usage = [getattr(response, "usage", None) for response in value.raw_responses]
+                elif streamed:
+                    yield "delta", write(value)
+                else:
+                    pending += value
+                    typed = pending.startswith("DOCUMENT TYPE:") or "DOCUMENT TYPE:".startswith(pending)
+                    if typed and "\n" not in pending:
+                        continue
+                    doc_type, content = split_document_type(pending)
+                    yield "delta", write(document_header(doc_type, task))
+                    if content:
+                        yield "delta", write(content)
+
+        final_output = final_output or ""
+        doc_type, document_content = split_document_type(final_output)
+        if not final_output.startswith("DOCUMENT TYPE:"):
             # Default to report if format not followed
-            selected_doc_type = "report"
             logging.warning(
                 "Document type not specified in output, defaulting to report")
-
-        # Add document type header and format the content
-        formatted_document = f"# {selected_doc_type.title()} Document\n\n"
-
-        # Add task information
-        formatted_document += f"**Task:** {task}\n\n"
-
-        # Add the main document content
-        formatted_document += document_content
-
-        # Write document to file with formatting
-        with open(document_path, 'w') as doc_file:
-            doc_file.write(formatted_document)
-
-        # Return base64 encoded document content with formatting
-        return base64.b64encode(formatted_document.encode('utf-8')).decode('utf-8')
+        formatted_document = document_header(doc_type, task) + document_content
+
+        if formatted_document != "".join(streamed):
+            # The final agent's output is authoritative, e.g. when text was
+            # streamed before a handoff to a specialist agent
+            with open(document_path, 'w') as doc_file:
+                doc_file.write(formatted_document)
+            yield "reset", formatted_document
+
+        # A header-only document (empty output) is not worth reusing
+        if document_content.strip():
+            await document_cache.put(cache_key, CachedDocument(
+                formatted_document,
+                sum(getattr(u, "input_tokens", 0) for u in usage if u),
+                sum(getattr(u, "output_tokens", 0) for u in usage if u),
+                time.monotonic() - started
+            ))
+        yield "document", formatted_document
 
     except Exception as e:
         logging.error(f"Error generating document: {str(e)}")
         # Add stack trace for debugging
         import traceback
         logging.error(traceback.format_exc())
+        if streamed:
+            yield "reset", ""
+        yield "document", None
+
+
+async def generate_document_from_results(browser_results, task, run_id, is_done=True):
+    """Generate document from browser results using OpenAI Agents.
+
+    Returns the formatted document base64 encoded, or None on failure.
+    """
+    document = None
+    async for kind, value in stream_document_from_results(browser_results, task, run_id, is_done):
+        if kind == "document":
+            document = value
+    if document is None:
         return None
+    return base64.b64encode(document.encode('utf-8')).decode('utf-8')
+
 
+async def persist_run_history(events_writer: Optional[RunEventWriter] = None, **kwargs) -> str:
+    """Queue a run to be saved; returns once the save is durable on local disk.
 
-async def stream_agent_progress(agent: Agent, task: str, user_id: str, auth_tokens: AuthTokens, browser_task: BrowserTask, live_view_url: Optional[str] = None):
+    When every progress event already reached run_events through
+    `events_writer`, the row is saved without its inline `progress`;
+    otherwise the in-memory events are saved as before.
+    """
+    auth_tokens = kwargs.pop("auth_tokens", None)
+    if events_writer is not None and await events_writer.close():
+        kwargs["progress_events"] = []
+        kwargs["events_persisted"] = True
+    # Journaled locally and written by history_writer, which also drops the
+    # user's cached history pages once the run is in the database
+    return await history_writer.enqueue(build_history_record(**kwargs), auth_tokens)
+
+
+async def stream_agent_progress(agent: Agent, tracker: AgentProgressTracker, task: str, user_id: str, auth_tokens: AuthTokens, browser_task: BrowserTask, live_view_url: Optional[str] = None, browser_session: Optional[BrowserSession] = None, run_id: Optional[str] = None):
     """Stream the agent's progress as JSON events with optimized performance."""
     progress_events = []
     final_result = None
     error_message = None
-    gif_content = None
+    gif_object = None
     document_content = None
     history_saved = False
-    run_id = str(uuid.uuid4())
-
-    # More efficient batch size and polling interval
-    BATCH_SIZE = 10
-    POLLING_INTERVAL = 0.25  # 250ms instead of 100ms to reduce CPU usage
-
-    # Use orjson for faster serialization
-    def serialize_event(event):
-        return orjson.dumps(event).decode('utf-8') + "\n"
+    run_id = run_id or str(uuid.uuid4())
+    session_released = False
+    # Events are written to run_events in chunks as they happen; the list
+    # is only the fallback for when that fails
+    events_writer = RunEventWriter(run_id, user_id, auth_tokens)
+
+    def record(event: Dict) -> None:
+        progress_events.append(event)
+        events_writer.add(event)
+
+    async def release_browser_session():
+        # The recording and document only need the history, so the browser
+        # session goes back as soon as the agent is finished with it
+        nonlocal session_released
+        if browser_session is not None and not session_released:
+            session_released = True
+            await browser_pool.release(browser_session)
 
     try:
         # Start event
         start_event = {"type": "start", "message": f"Starting task: {task}"}
-        progress_events.append(start_event)
-        yield serialize_event(start_event)
+        record(start_event)
+        yield start_event
 
         # Send run ID event
         run_id_event = {"type": "run_id", "message": run_id}
-        progress_events.append(run_id_event)
-        yield serialize_event(run_id_event)
+        record(run_id_event)
+        yield run_id_event
 
         # Send live view URL if available
         if live_view_url:
             live_view_event = {"type": "live_view_url", "url": live_view_url}
-            progress_events.append(live_view_event)
-            yield serialize_event(live_view_event)
+            record(live_view_event)
+            yield live_view_event
 
-        # Run the agent in a background task
+        # Run the agent in a background task; the tracker's hooks push
+        # progress onto its queue and it is closed once the run finishes
         agent_task = asyncio.create_task(agent.run(max_steps=50))
+        agent_task.add_done_callback(tracker.close)
+
+        # Track already sent items (by digest) for deduplication
+        dedup = ProgressDeduplicator()
+        batcher = ProgressBatcher()
+        pending_get = None
+
+        while True:
+            # Wake either for the next update or when the pending batch is due
+            received, update, pending_get = await next_update(
+                tracker, pending_get, batcher.timeout())
+            if not received:
+                for event in batcher.flush():
+                    yield event
+                continue
 
-        # Track previous state more efficiently
-        prev_state_lengths = {
-            "urls": 0,
-            "actions": 0,
-            "thoughts": 0,
-            "errors": 0,
-            "results": 0,
-            "content": 0
-        }
-
-        # Set to track already sent items for deduplication
-        sent_items: Set[str] = set()
-
-        # Optimized polling loop
-        last_poll_time = time.time()
-        buffered_events = []
+            if update is None:
+                break
 
-        while not agent_task.done():
-            current_time = time.time()
+            key, item, produced_at = update
 
-            # Only poll at specified interval to reduce CPU usage
-            if current_time - last_poll_time < POLLING_INTERVAL:
-                await asyncio.sleep(0.05)
+            # Deduplicate items
+            serialized = safe_serialize(item)
+            if not dedup.is_new(key, serialized):
                 continue
 
-            last_poll_time = current_time
-
-            # Get all updates in a single pass to reduce method calls
-            updates = {
-                "urls": agent.history.urls(),
-                "actions": agent.history.action_names(),
-                "thoughts": agent.history.model_thoughts(),
-                "errors": agent.history.errors(),
-                "results": agent.history.action_results(),
-                "content": agent.history.extracted_content()
+            event = {
+                "type": key[:-1],  # Remove 's' from plural
+                "message": f"{key.title()}: {serialized}"
             }
-
-            # Process updates in batches
-            for key, current_items in updates.items():
-                prev_length = prev_state_lengths[key]
-                new_items = current_items[prev_length:]
-
-                if new_items:
-                    for item in new_items:
-                        # Deduplicate items
-                        item_hash = f"{key}:{safe_serialize(item)}"
-                        if item_hash in sent_items:
-                            continue
-
-                        sent_items.add(item_hash)
-
-                        event = {
-                            "type": key[:-1],  # Remove 's' from plural
-                            "message": f"{key.title()}: {safe_serialize(item)}"
-                        }
-                        progress_events.append(event)
-                        buffered_events.append(event)
-
-                    prev_state_lengths[key] = len(current_items)
+            record(event)
 
             # Send events in batches to reduce network overhead
-            if buffered_events:
-                if len(buffered_events) >= BATCH_SIZE:
-                    for event in buffered_events:
-                        yield serialize_event(event)
-                    buffered_events = []
-
-            # Adaptive sleep to reduce CPU usage
-            await asyncio.sleep(0.05)
+            if batcher.add(event, produced_at):
+                for event in batcher.flush():
+                    yield event
 
         # Send any remaining buffered events
-        for event in buffered_events:
-            yield serialize_event(event)
+        for event in batcher.flush():
+            yield event
 
         # Get the agent's history after completion
         history = await agent_task
+        await release_browser_session()
 
         # Process summary sections more efficiently
         summary_sections = [
@@ -698,8 +1008,8 @@ async def stream_agent_progress(agent: Agent, task: str, user_id: str, auth_toke
                     "title": title,
                     "items": [safe_serialize(item) for item in items]
                 }
-                progress_events.append(section)
-                yield serialize_event(section)
+                record(section)
+                yield section
 
         # Create GIF asynchronously for better performance
         gif_task = asyncio.create_task(create_gif_from_history(agent, run_id))
@@ -714,56 +1024,49 @@ async def stream_agent_progress(agent: Agent, task: str, user_id: str, auth_toke
                 "type": "status",
                 "message": "Generating document from browser results..."
             }
-            progress_events.append(doc_event)
-            yield serialize_event(doc_event)
-
-            # Generate document asynchronously
-            document_task = asyncio.create_task(
-                generate_document_from_results(
-                    final_result,
-                    task,
-                    run_id,
-                    is_done
-                )
-            )
-
-            # Wait for document generation with a timeout
-            try:
-                document_content = await asyncio.wait_for(document_task, timeout=30.0)
-                if document_content:
-                    # Decode the base64 content
-                    decoded_content = base64.b64decode(
-                        document_content).decode('utf-8')
-                    doc_event = {
-                        "type": "document",
-                        "message": "Document generated successfully"
-                    }
-                    progress_events.append(doc_event)
-                    yield serialize_event(doc_event)
-
-                    # Enhance the final result with the document
-                    if final_result:
-                        # Add a note if task didn't complete fully
-                        if not is_done:
-                            completion_note = "\n\n> **Note:** This document was generated from partial results as the task didn't complete within the maximum allowed steps.\n\n"
-                            decoded_content = completion_note + decoded_content
-
-                        final_result = f"{final_result}\n\n## Generated Document\n\n{decoded_content}"
-            except asyncio.TimeoutError:
-                logging.warning("Document generation timed out")
-
-        # Wait for GIF with timeout to avoid blocking
-        try:
-            gif_content = await asyncio.wait_for(gif_task, timeout=10.0)
-            if gif_content:
-                gif_event = {
-                    "type": "gif",
-                    "message": "Task recording created"
+            record(doc_event)
+            yield doc_event
+
+            # Stream the document as it is written; deltas go to viewers
+            # only, the finished document is saved with the run
+            decoded_content = None
+            async for kind, value in stream_document_from_results(final_result, task, run_id, is_done):
+                if kind == "delta":
+                    yield {"type": "document_delta", "delta": value}
+                elif kind == "reset":
+                    # Viewers replace what they have accumulated with this
+                    yield {"type": "document_reset", "content": value}
+                else:
+                    decoded_content = value
+
+            if decoded_content:
+                document_content = base64.b64encode(
+                    decoded_content.encode('utf-8')).decode('utf-8')
+                doc_event = {
+                    "type": "document",
+                    "message": "Document generated successfully"
                 }
-                progress_events.append(gif_event)
-                yield serialize_event(gif_event)
-        except asyncio.TimeoutError:
-            logging.warning("GIF creation timed out")
+                record(doc_event)
+                yield doc_event
+
+                # Enhance the final result with the document
+                if final_result:
+                    # Add a note if task didn't complete fully
+                    if not is_done:
+                        completion_note = "\n\n> **Note:** This document was generated from partial results as the task didn't complete within the maximum allowed steps.\n\n"
+                        decoded_content = completion_note + decoded_content
+
+                    final_result = f"{final_result}{GENERATED_DOCUMENT_HEADING}{decoded_content}"
+
+        # Rendering is bounded by GIF_RENDER_TIMEOUT of execution time
+        gif_object = await gif_task
+        if gif_object:
+            gif_event = {
+                "type": "gif",
+                "message": "Task recording created"
+            }
+            record(gif_event)
+            yield gif_event
 
         # Complete event with sources and references
         complete_event = {
@@ -771,27 +1074,26 @@ async def stream_agent_progress(agent: Agent, task: str, user_id: str, auth_toke
             "message": safe_serialize(final_result),
             "success": bool(is_done),
         }
-        progress_events.append(complete_event)
-        yield serialize_event(complete_event)
+        record(complete_event)
+        yield complete_event
 
-        # Save history in background task to avoid blocking response
+        # Every event has been sent; this waits for the last progress chunks
+        # and the local journal write, the run row is written in the background
         if not history_saved:
-            # Create a background task for saving history
-            asyncio.create_task(
-                save_run_history(
-                    user_id=user_id,
-                    task=task,
-                    progress_events=progress_events,
-                    result=final_result,
-                    error=error_message,
-                    gif_content=gif_content,
-                    document_content=document_content,
-                    auth_tokens=auth_tokens,
-                    run_id=run_id,
-                    live_view_url=live_view_url
-                )
-            )
             history_saved = True
+            await persist_run_history(
+                events_writer=events_writer,
+                user_id=user_id,
+                task=task,
+                progress_events=progress_events,
+                result=final_result,
+                error=error_message,
+                gif_object=gif_object,
+                document_content=document_content,
+                auth_tokens=auth_tokens,
+                run_id=run_id,
+                live_view_url=live_view_url
+            )
 
     except Exception as e:
         error_message = f"Error: {str(e)}"
@@ -799,21 +1101,161 @@ async def stream_agent_progress(agent: Agent, task: str, user_id: str, auth_toke
             "type": "error",
             "message": error_message
         }
-        progress_events.append(error_event)
-        yield serialize_event(error_event)
+        record(error_event)
+        yield error_event
 
-        # Save failed run in background
+        # Save failed run
         if not history_saved:
-            asyncio.create_task(
-                save_run_history(
-                    user_id=user_id,
-                    task=task,
-                    progress_events=progress_events,
-                    error=error_message,
-                    auth_tokens=auth_tokens,
-                    run_id=run_id
-                )
+            await persist_run_history(
+                events_writer=events_writer,
+                user_id=user_id,
+                task=task,
+                progress_events=progress_events,
+                error=error_message,
+                auth_tokens=auth_tokens,
+                run_id=run_id
+            )
+    finally:
+        await release_browser_session()
+
+
+async def start_agent(browser_task: BrowserTask):
+    """Acquire a browser and build the agent for a task.
+
+    Returns (agent, tracker, live_view_url, browser_session); failures are
+    raised as HTTPException.
+    """
+    # Initialize browser with error handling
+    try:
+        browser, live_view_url, browser_session = await get_browser()
+        logging.info("Browser initialized successfully")
+    except HTTPException:
+        raise
+    except Exception as browser_error:
+        logging.error(
+            f"Failed to initialize browser: {str(browser_error)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Browser initialization failed: {str(browser_error)}"
+        )
+
+    # planner_llm = ChatOpenAI(
+    #     base_url='https://api.deepseek.com/v1',
+    #     model="deepseek-reasoner",
+    #     api_key=SecretStr(os.getenv("DEEPSEEK_API_KEY")),
+    # )
+
+    # Initialize agent with error handling
+    try:
+        tracker = AgentProgressTracker()
+        agent = Agent(
+            task=browser_task.task,
+            browser=browser,
+            llm=ChatOpenAI(
+            base_url='https://api.deepseek.com/v1',
+            model="deepseek-chat",
+            api_key=SecretStr(os.getenv("DEEPSEEK_API_KEY")),
+        ),
+            sensitive_data=browser_task.sensitive_data or {},
+            use_vision=False,
+            register_new_step_callback=tracker.on_step,
+            register_done_callback=tracker.on_done
+        )
+        tracker.bind(agent)
+        logging.info("Agent initialized successfully")
+    except Exception as agent_error:
+        logging.error(f"Failed to initialize agent: {str(agent_error)}")
+        await browser_pool.release(browser_session)
+        raise HTTPException(
+            status_code=500,
+            detail=f"Agent initialization failed: {str(agent_error)}"
+        )
+
+    return agent, tracker, live_view_url, browser_session
+
+
+async def execute_run(user_id: str, auth_tokens: AuthTokens, browser_task: BrowserTask, run_id: str, prepared=None):
+    """Set up (unless already `prepared`) and execute an admitted run, yielding its events.
+
+    Runs in the API process, or in a worker process in RUN_WORKER_MODE=process.
+    """
+    if prepared is None:
+        try:
+            prepared = await start_agent(browser_task)
+        except Exception as e:
+            # Runs that were queued set up here; save the failure like any
+            # other failed run, numbered the same way in run_events
+            error_message = f"Error: {e.detail if isinstance(e, HTTPException) else str(e)}"
+            error_event = {"type": "error", "message": error_message}
+            events_writer = RunEventWriter(run_id, user_id, auth_tokens)
+            events_writer.add(error_event)
+            yield error_event
+            await persist_run_history(
+                events_writer=events_writer,
+                user_id=user_id,
+                task=browser_task.task,
+                progress_events=[error_event],
+                error=error_message,
+                auth_tokens=auth_tokens,
+                run_id=run_id
             )
+            return
+
+    agent, tracker, live_view_url, browser_session = prepared
+    async for event in stream_agent_progress(agent, tracker, browser_task.task,
+                                             user_id, auth_tokens, browser_task,
+                                             live_view_url, browser_session, run_id):
+        yield event
+
+
+async def stream_scheduled_run(ticket: RunTicket, prepared, user_id: str, auth_tokens: AuthTokens, browser_task: BrowserTask, run_id: str):
+    """Yield queue position updates until the run gets a slot, then the run's events.
+
+    The ticket is released when the run finishes, which frees the slot (or
+    the queue place) for the next run.
+    """
+    try:
+        last_position, last_sent = None, 0.0
+        while not ticket.granted:
+            position = run_scheduler.position(ticket)
+            # Resend periodically too, so idle proxies don't drop the stream
+            if position != last_position or time.monotonic() - last_sent >= RUN_QUEUE_KEEPALIVE:
+                last_position, last_sent = position, time.monotonic()
+                yield {
+                    "type": "queued",
+                    "position": position,
+                    "message": f"Waiting for a free slot (position {position} in queue)"
+                }
+            await ticket.wait_for_change(timeout=RUN_QUEUE_KEEPALIVE)
+
+        if worker_pool.enabled:
+            events = worker_pool.run(run_id, user_id, auth_tokens, browser_task)
+        else:
+            events = execute_run(user_id, auth_tokens, browser_task, run_id, prepared)
+        async for event in events:
+            yield event
+    finally:
+        run_scheduler.release(ticket)
+
+
+async def follow_run_ndjson(run_log: RunEventLog):
+    async for _, data in run_logs.follow(run_log):
+        yield data + b"\n"
+
+
+async def follow_run_sse(run_log: RunEventLog, after: EventId):
+    async for event_id, data in run_logs.follow(run_log, after):
+        yield b"id: %s\ndata: %s\n\n" % (format_event_id(event_id).encode(), data)
+
+
+async def follow_saved_run_sse(user_id: str, run_id: str, auth_tokens: AuthTokens, after: EventId):
+    """Follow a run executing in another worker through run_events."""
+    async def finished() -> bool:
+        return await get_run_fields(user_id, run_id, ("id",), auth_tokens) is not None
+
+    async for index, event in follow_run_events(
+            user_id, run_id, finished, auth_tokens, after[0], idle_timeout=RUN_LOG_RETENTION):
+        yield b"id: %d\ndata: %s\n\n" % (index, orjson.dumps(event))
 
 
 @app.post("/api/browse")
@@ -854,52 +1296,36 @@ async def browse(request: Request, browser_task: BrowserTask, background_tasks:
 
         logging.info(f"Starting browse task for user {user_id}")
 
-        # Initialize browser with error handling
-        try:
-            browser, live_view_url = get_browser()
-            logging.info("Browser initialized successfully")
-        except Exception as browser_error:
-            logging.error(
-                f"Failed to initialize browser: {str(browser_error)}")
-            raise HTTPException(
-                status_code=500,
-                detail=f"Browser initialization failed: {str(browser_error)}"
-            )
-
-        # planner_llm = ChatOpenAI(
-        #     base_url='https://api.deepseek.com/v1',
-        #     model="deepseek-reasoner",
-        #     api_key=SecretStr(os.getenv("DEEPSEEK_API_KEY")),
-        # )
-
-        # Initialize agent with error handling
+        # Admission control: wait for a run slot, or 429 if the queue is full
         try:
-            agent = Agent(
-                task=browser_task.task,
-                browser=browser,
-                llm=ChatOpenAI(
-                base_url='https://api.deepseek.com/v1',
-                model="deepseek-chat",
-                api_key=SecretStr(os.getenv("DEEPSEEK_API_KEY")),
-            ),
-                sensitive_data=browser_task.sensitive_data or {},
-                use_vision=False
-            )
-            logging.info("Agent initialized successfully")
-        except Exception as agent_error:
-            logging.error(f"Failed to initialize agent: {str(agent_error)}")
+            ticket = run_scheduler.submit(user_id)
+        except QueueFullError:
+            logging.warning(f"Run queue full, rejecting browse task for user {user_id}")
             raise HTTPException(
-                status_code=500,
-                detail=f"Agent initialization failed: {str(agent_error)}"
+                status_code=429,
+                detail="Too many tasks are running, please try again shortly",
+                headers={"Retry-After": str(RUN_QUEUE_RETRY_AFTER)}
             )
 
-        # Use background tasks to manage cleanup operations
-        background_tasks.add_task(clean_cache)
+        # Runs admitted right away start here, so setup failures are still
+        # reported as HTTP errors; queued runs start inside the stream
+        prepared = None
+        if ticket.granted and not worker_pool.enabled:
+            try:
+                prepared = await start_agent(browser_task)
+            except Exception:
+                run_scheduler.release(ticket)
+                raise
 
         try:
+            # The run executes in the background and survives this client
+            # disconnecting; this response is just its first viewer
+            run_id = str(uuid.uuid4())
+            run_log = run_logs.create(run_id, user_id)
+            run_logs.start(run_log, stream_scheduled_run(
+                ticket, prepared, user_id, tokens, browser_task, run_id))
             return StreamingResponse(
-                stream_agent_progress(agent, browser_task.task,
-                                      user_id, tokens, browser_task, live_view_url),
+                follow_run_ndjson(run_log),
                 # stream_agent_progress(agent, browser_task.task,
                 #                       user_id, tokens, browser_task),
                 media_type="text/event-stream"
@@ -922,14 +1348,15 @@ async def browse(request: Request, browser_task: BrowserTask, background_tasks:
             f"Unexpected error in browse endpoint: {str(e)}", exc_info=True)
 
         # Save failed run in background
-        background_tasks.add_task(
-            save_run_history,
-            user_id=user_id if 'user_id' in locals() else None,
-            task=browser_task.task,
-            progress_events=[{"type": "error", "message": str(e)}],
-            error=str(e),
-            auth_tokens=tokens if 'tokens' in locals() else None
-        )
+        if 'user_id' in locals():
+            background_tasks.add_task(
+                persist_run_history,
+                user_id=user_id,
+                task=browser_task.task,
+                progress_events=[{"type": "error", "message": str(e)}],
+                error=str(e),
+                auth_tokens=tokens if 'tokens' in locals() else None
+            )
 
         # Clear metadata before raising exception
         # Laminar.clear_metadata()
@@ -939,6 +1366,47 @@ async def browse(request: Request, browser_task: BrowserTask, background_tasks:
         )
 
 
+@app.get("/api/runs/{run_id}/events")
+async def get_run_events(request: Request, run_id: str):
+    """Attach to a run's event log as Server-Sent Events.
+
+    Each event carries its index in the run's saved events as the SSE id,
+    so a client that reconnects with `Last-Event-ID` resumes right after
+    the last event it saw. Logs are kept in the worker that runs them for
+    RUN_LOG_RETENTION seconds after the run ends. A run executing in
+    another worker is followed from run_events instead, which only has
+    saved events (no document deltas) and lags by up to
+    RUN_EVENTS_FLUSH_INTERVAL; a run that hasn't saved its first events
+    yet is not found.
+    """
+    user_id, tokens = await get_user_id_and_tokens(request)
+
+    last_event_id = request.headers.get("last-event-id")
+    try:
+        after = parse_event_id(last_event_id) if last_event_id else (-1, 0)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid Last-Event-ID")
+
+    try:
+        uuid.UUID(run_id)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Run not found")
+
+    run_log = run_logs.get(run_id)
+    if run_log is not None and run_log.user_id == user_id:
+        events = follow_run_sse(run_log, after)
+    elif run_log is None and await has_run_events(user_id, run_id, tokens):
+        events = follow_saved_run_sse(user_id, run_id, tokens, after)
+    else:
+        raise HTTPException(status_code=404, detail="Run not found")
+
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @app.post("/api/generate-document")
 async def generate_document(request: Request, background_tasks: BackgroundTasks):
     """Generate document from an existing browser task result."""
@@ -952,8 +1420,9 @@ async def generate_document(request: Request, background_tasks: BackgroundTasks)
         # Get user credentials
         user_id, tokens = await get_user_id_and_tokens(request)
 
-        # Get history details
-        history = await get_run_details(user_id, history_id, auth_tokens=tokens)
+        # Only what generation needs; the GIF and document stay in the database
+        history = await get_run_fields(
+            user_id, history_id, ("task", "result"), auth_tokens=tokens)
         if not history:
             raise HTTPException(status_code=404, detail="History not found")
 
@@ -985,28 +1454,18 @@ async def generate_document(request: Request, background_tasks: BackgroundTasks)
 
 
 async def generate_and_save_document(user_id, history_id, result, task, run_id, auth_tokens):
-    """Generate document from result and save it to history."""
+    """Generate document from result and save it to history.
+
+    `result` is the run's result as read by the caller; it is extended with
+    the document rather than fetched again. A document generated before is
+    replaced, so regenerating starts from (and is cached by) the original
+    browser result.
+    """
     try:
-        # Create an event loop for this thread if there isn't one
-        try:
-            loop = asyncio.get_running_loop()
-        except RuntimeError:
-            # No event loop exists in this thread, so create one
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-
-        # Generate document - use loop.run_until_complete for async calls if we created a new loop
-        if asyncio.get_event_loop_policy().get_event_loop() == loop:
-            # We're in the original event loop
-            document_content = await generate_document_from_results(
-                result, task, run_id
-            )
-        else:
-            # We're in a new loop we created
-            document_content = loop.run_until_complete(
-                generate_document_from_results(
-                    result, task, run_id)
-            )
+        result = browser_result_of(result)
+        document_content = await generate_document_from_results(
+            result, task, run_id
+        )
 
         if not document_content:
             logging.error("Failed to generate document content")
@@ -1015,38 +1474,23 @@ async def generate_and_save_document(user_id, history_id, result, task, run_id,
         # Decode document for updating history result
         decoded_content = base64.b64decode(document_content).decode('utf-8')
 
-        # Fetch existing result to append document
-        history_details = await get_run_details(user_id, history_id, auth_tokens=auth_tokens)
-        existing_result = history_details.get("result", "")
-
         # Create combined result with original result and document
-        if existing_result:
-            combined_result = f"{existing_result}\n\n## Generated Document\n\n{decoded_content}"
+        if result:
+            combined_result = f"{result}{GENERATED_DOCUMENT_HEADING}{decoded_content}"
         else:
             combined_result = decoded_content
 
         # Update both the result and document content
-        # Update history with document - same logic for event loop
-        if asyncio.get_event_loop_policy().get_event_loop() == loop:
-            success = await update_history_with_document(
-                user_id=user_id,
-                history_id=history_id,
-                document_content=document_content,
-                result=combined_result,  # Update result to include document
-                auth_tokens=auth_tokens
-            )
-        else:
-            success = loop.run_until_complete(
-                update_history_with_document(
-                    user_id=user_id,
-                    history_id=history_id,
-                    document_content=document_content,
-                    result=combined_result,  # Update result to include document
-                    auth_tokens=auth_tokens
-                )
-            )
+        success = await update_history_with_document(
+            user_id=user_id,
+            history_id=history_id,
+            document_content=document_content,
+            result=combined_result,  # Update result to include document
+            auth_tokens=auth_tokens
+        )
 
         if success:
+            await response_cache.invalidate(user_id, history_id, LIST_TAG)
             logging.info(
                 f"Document generated and saved successfully for history {history_id}")
         else:
@@ -0,0 +1,31 @@
+-- Let run saves be retried safely: GIF and document rows are upserted on
+-- history_id, so each run has at most one of each.
+
+-- Keep the newest row where earlier non-idempotent saves left duplicates
+DELETE FROM run_gifs a
+    USING run_gifs b
+    WHERE a.history_id = b.history_id
+    AND (a.created_at, a.id) < (b.created_at, b.id);
+
+DELETE FROM run_documents a
+    USING run_documents b
+    WHERE a.history_id = b.history_id
+    AND (a.created_at, a.id) < (b.created_at, b.id);
+
+CREATE UNIQUE INDEX IF NOT EXISTS run_gifs_history_id_key ON run_gifs(history_id);
+CREATE UNIQUE INDEX IF NOT EXISTS run_documents_history_id_key ON run_documents(history_id);
+
+-- Superseded by the unique index above
+DROP INDEX IF EXISTS idx_run_documents_history_id;
+
+-- An upsert that hits an existing row is an update
+DROP POLICY IF EXISTS "Users can update their own run gifs." ON run_gifs;
+CREATE POLICY "Users can update their own run gifs."
+  ON run_gifs FOR UPDATE
+  USING (
+    exists (
+      select 1 from run_history
+      where run_history.id = run_gifs.history_id
+      and run_history.user_id = auth.uid()
+    )
+  );
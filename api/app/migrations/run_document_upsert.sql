@@ -0,0 +1,41 @@
+-- Save a run's document (and optionally its result) in one statement.
+-- Replaces select-then-insert/update from the API, which took up to three
+-- round trips and could insert duplicates when two generations overlapped.
+-- Requires the unique run_documents(history_id) index from
+-- history_write_idempotency.sql. Runs as the caller, so RLS still applies.
+-- Returns false when the run doesn't exist or doesn't belong to the user.
+create or replace function save_run_document(
+  p_history_id uuid,
+  p_user_id uuid,
+  p_document_content text,
+  p_result text default null
+)
+returns boolean
+language plpgsql
+security invoker
+as $$
+begin
+  -- Locks the run row, so concurrent saves for one run apply in turn
+  if p_result is not null then
+    update run_history set result = p_result
+      where id = p_history_id and user_id = p_user_id;
+  else
+    perform 1 from run_history
+      where id = p_history_id and user_id = p_user_id
+      for update;
+  end if;
+
+  if not found then
+    return false;
+  end if;
+
+  insert into run_documents (history_id, document_content)
+    values (p_history_id, p_document_content)
+    on conflict (history_id)
+    do update set document_content = excluded.document_content;
+
+  return true;
+end;
+$$;
+
+grant execute on function save_run_document(uuid, uuid, text, text) to authenticated;
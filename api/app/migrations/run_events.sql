@@ -0,0 +1,32 @@
+-- Progress events of a run, appended in small chunks while it runs instead
+-- of one large `progress` value at the end. `payload` is an orjson-encoded
+-- array of events, zlib-compressed and base64-encoded when `encoding` is
+-- 'orjson+zlib'. `run_id` is the id of the run_history row once saved.
+create table if not exists run_events (
+  run_id uuid not null,
+  seq integer not null,
+  user_id uuid references auth.users not null,
+  first_event integer not null,
+  event_count integer not null,
+  encoding text not null,
+  payload text not null,
+  created_at timestamp with time zone default timezone('utc'::text, now()) not null,
+  primary key (run_id, seq)
+);
+
+-- Set when a run's progress lives in run_events (its `progress` is then empty)
+alter table run_history add column if not exists events_persisted boolean not null default false;
+
+alter table run_events enable row level security;
+
+create policy "Users can view their own run events."
+  on run_events for select
+  using (auth.uid() = user_id);
+
+create policy "Users can insert their own run events."
+  on run_events for insert
+  with check (auth.uid() = user_id);
+
+create policy "Users can delete their own run events."
+  on run_events for delete
+  using (auth.uid() = user_id);
@@ -0,0 +1,29 @@
+-- Store run GIFs as binary objects (local disk, Supabase Storage or S3)
+-- and keep only a reference in run_gifs. Existing rows keep their inline
+-- base64 gif_content and are still served.
+ALTER TABLE run_gifs ALTER COLUMN gif_content DROP NOT NULL;
+ALTER TABLE run_gifs ADD COLUMN IF NOT EXISTS gif_path TEXT;
+ALTER TABLE run_gifs ADD COLUMN IF NOT EXISTS gif_size BIGINT;
+ALTER TABLE run_gifs ADD COLUMN IF NOT EXISTS gif_etag TEXT;
+
+ALTER TABLE run_gifs DROP CONSTRAINT IF EXISTS run_gifs_content_or_path;
+ALTER TABLE run_gifs ADD CONSTRAINT run_gifs_content_or_path
+    CHECK (gif_content IS NOT NULL OR gif_path IS NOT NULL);
+
+-- Private bucket used when OBJECT_STORE_BACKEND=supabase
+INSERT INTO storage.buckets (id, name, public)
+VALUES ('run-gifs', 'run-gifs', false)
+ON CONFLICT (id) DO NOTHING;
+
+-- The API reads and writes this bucket with SUPABASE_SERVICE_ROLE_KEY,
+-- which bypasses storage policies, so none are needed. Deployments that
+-- can't give the API that key must instead let the key in SUPABASE_KEY
+-- (the anon role) manage objects in the bucket, e.g.:
+--
+-- CREATE POLICY "API manages run GIFs" ON storage.objects
+--     FOR ALL TO anon
+--     USING (bucket_id = 'run-gifs')
+--     WITH CHECK (bucket_id = 'run-gifs');
+--
+-- Objects are only ever served through the API, after the owning run_gifs
+-- row was read with the caller's JWT; never make the bucket public.
@@ -0,0 +1,3 @@
+-- Support keyset pagination of a user's run history on (created_at, id)
+CREATE INDEX IF NOT EXISTS idx_run_history_user_created_id
+    ON run_history (user_id, created_at DESC, id DESC);
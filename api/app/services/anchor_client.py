@@ -0,0 +1,210 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, Optional
+
+import httpx
+
+from app.utils.metrics import counter, gauge, histogram
+from app.utils.retry import backoff_delay
+
+ANCHOR_API_KEY = os.getenv("ANCHOR_API_KEY")
+ANCHOR_API_URL = os.getenv("ANCHOR_API_URL", "https://api.anchorbrowser.io")
+
+# Per-request timeouts (seconds) and size of the shared keep-alive pool
+ANCHOR_CONNECT_TIMEOUT = float(os.getenv("ANCHOR_CONNECT_TIMEOUT", "5"))
+ANCHOR_REQUEST_TIMEOUT = float(os.getenv("ANCHOR_REQUEST_TIMEOUT", "30"))
+ANCHOR_MAX_CONNECTIONS = int(os.getenv("ANCHOR_MAX_CONNECTIONS", "20"))
+
+# Attempts per call and the full-jitter exponential backoff between them
+ANCHOR_RETRY_ATTEMPTS = int(os.getenv("ANCHOR_RETRY_ATTEMPTS", "3"))
+ANCHOR_RETRY_BASE_DELAY = float(os.getenv("ANCHOR_RETRY_BASE_DELAY", "0.25"))
+ANCHOR_RETRY_MAX_DELAY = float(os.getenv("ANCHOR_RETRY_MAX_DELAY", "4"))
+
+# Consecutive failed calls that open the circuit, and how long it stays open
+ANCHOR_BREAKER_THRESHOLD = int(os.getenv("ANCHOR_BREAKER_THRESHOLD", "5"))
+ANCHOR_BREAKER_RESET_TIMEOUT = float(
+    os.getenv("ANCHOR_BREAKER_RESET_TIMEOUT", "30"))
+
+# Responses worth retrying; anything else in 4xx is the caller's fault
+RETRYABLE_STATUS = frozenset({429, 502, 503, 504})
+# Errors raised before the request reached Anchor, so even a POST is safe to
+# retry without risking a second (leaked) session
+UNSENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+class AnchorError(Exception):
+    """An Anchor API call failed after all retries."""
+
+
+class CircuitOpenError(AnchorError):
+    """Anchor calls are short-circuited after repeated failures."""
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker.
+
+    After `threshold` consecutive failures the circuit opens and calls fail
+    fast for `reset_timeout` seconds. Then a single trial call is let
+    through (half-open); its outcome closes or re-opens the circuit.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, threshold: int = ANCHOR_BREAKER_THRESHOLD, reset_timeout: float = ANCHOR_BREAKER_RESET_TIMEOUT):
+        self.threshold = max(1, threshold)
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+
+    def allow(self) -> bool:
+        if self.state == self.OPEN:
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            self.state = self.HALF_OPEN
+            self._trial_in_flight = False
+        if self.state == self.HALF_OPEN:
+            if self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+        return True
+
+    def abandon_trial(self) -> None:
+        self._trial_in_flight = False
+
+    def record_success(self) -> None:
+        self.state = self.CLOSED
+        self._failures = 0
+        self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        self._trial_in_flight = False
+        if self.state == self.HALF_OPEN or self._failures >= self.threshold:
+            if self.state != self.OPEN:
+                logging.warning(
+                    f"Anchor circuit opened after {self._failures} failures")
+            self.state = self.OPEN
+            self._opened_at = time.monotonic()
+
+
+class AnchorClient:
+    """Async client for the Anchor Browser API.
+
+    All calls share one keep-alive connection pool, so provisioning a
+    session no longer pays a TCP/TLS handshake or blocks the event loop.
+    Transient failures are retried with jittered backoff and repeated
+    failures open a circuit breaker so a struggling Anchor fails fast
+    instead of tying up every request.
+    """
+
+    def __init__(
+        self,
+        base_url: str = ANCHOR_API_URL,
+        api_key: Optional[str] = ANCHOR_API_KEY,
+        attempts: int = ANCHOR_RETRY_ATTEMPTS,
+        breaker: Optional[CircuitBreaker] = None
+    ):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.attempts = max(1, attempts)
+        self.breaker = breaker or CircuitBreaker()
+        self._client: Optional[httpx.AsyncClient] = None
+
+        self.calls = counter("anchor_calls_total", "Anchor API calls")
+        self.failures = counter("anchor_call_failures_total", "Anchor API calls that failed after retries")
+        self.retries = counter("anchor_retries_total", "Anchor API call retries")
+        self.short_circuited = counter("anchor_short_circuited_total", "Anchor calls rejected by the open circuit")
+        self.circuit_open = gauge("anchor_circuit_open", "1 while the Anchor circuit is open")
+        self.call_seconds = histogram("anchor_call_seconds", "Anchor API call time including retries")
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers={"anchor-api-key": self.api_key or ""},
+                timeout=httpx.Timeout(ANCHOR_REQUEST_TIMEOUT, connect=ANCHOR_CONNECT_TIMEOUT),
+                limits=httpx.Limits(
+                    max_connections=ANCHOR_MAX_CONNECTIONS,
+                    max_keepalive_connections=ANCHOR_MAX_CONNECTIONS
+                )
+            )
+        return self._client
+
+    async def create_session(self, config: Dict) -> Dict:
+        """Provision a browser session; returns Anchor's session payload."""
+        response = await self._request("POST", "/api/sessions", idempotent=False, json=config)
+        return response.json()
+
+    async def get_session(self, session_id: str) -> Optional[Dict]:
+        """Anchor's payload for a session, or None if Anchor doesn't know it."""
+        response = await self._request("GET", f"/api/sessions/{session_id}", idempotent=True, ok_status=(404,))
+        if response.status_code == 404:
+            return None
+        return response.json()
+
+    async def end_session(self, session_id: str) -> None:
+        """End a session so it stops running (and billing) on Anchor's side."""
+        await self._request("DELETE", f"/api/sessions/{session_id}", idempotent=True, ok_status=(404,))
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _request(self, method: str, path: str, idempotent: bool, ok_status=(), **kwargs) -> httpx.Response:
+        if not self.breaker.allow():
+            self.short_circuited.inc()
+            raise CircuitOpenError("Anchor API circuit is open")
+
+        self.calls.inc()
+        start = time.monotonic()
+        settled = False
+        try:
+            for attempt in range(self.attempts):
+                try:
+                    response = await self.client.request(method, path, **kwargs)
+                    if response.status_code in ok_status or response.is_success:
+                        self.breaker.record_success()
+                        settled = True
+                        return response
+                    # Only server-side trouble counts against the circuit
+                    unhealthy = response.status_code >= 500 or response.status_code == 429
+                    retryable = response.status_code in RETRYABLE_STATUS
+                    error: Exception = httpx.HTTPStatusError(
+                        f"{method} {path} returned {response.status_code}",
+                        request=response.request, response=response)
+                except httpx.TransportError as e:
+                    unhealthy = True
+                    retryable = idempotent or isinstance(e, UNSENT_ERRORS)
+                    error = e
+
+                if not retryable or attempt + 1 >= self.attempts:
+                    break
+                self.retries.inc()
+                delay = backoff_delay(attempt, ANCHOR_RETRY_BASE_DELAY, ANCHOR_RETRY_MAX_DELAY)
+                logging.warning(
+                    f"Anchor {method} {path} failed ({error}), retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+
+            self.failures.inc()
+            if unhealthy:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            settled = True
+            raise AnchorError(f"Anchor {method} {path} failed: {error}") from error
+        finally:
+            if not settled:
+                # Cancelled mid-call: the outcome is unknown, so just let
+                # another call try again instead of leaving the trial hanging
+                self.breaker.abandon_trial()
+            self.call_seconds.observe(time.monotonic() - start)
+            self.circuit_open.set(1 if self.breaker.state == CircuitBreaker.OPEN else 0)
+
+
+anchor_client = AnchorClient()
@@ -0,0 +1,366 @@
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict, Iterable, Optional, Set
+
+from fastapi import HTTPException
+
+from app.services.anchor_client import AnchorClient, AnchorError, CircuitOpenError, anchor_client
+from app.utils.metrics import counter, gauge, histogram
+
+# "anchor" provisions real Anchor Browser sessions; "fake" hands out sessions
+# pointing at a local CDP endpoint (e.g. chromedp/headless-shell) for offline use
+BROWSER_SESSION_PROVIDER = os.getenv("BROWSER_SESSION_PROVIDER", "anchor")
+FAKE_BROWSER_CDP_URL = os.getenv("FAKE_BROWSER_CDP_URL", "http://localhost:9222")
+
+# Warm sessions kept ready per browser configuration, and the most kept
+BROWSER_POOL_MIN_SIZE = int(os.getenv("BROWSER_POOL_MIN_SIZE", "1"))
+BROWSER_POOL_MAX_SIZE = int(os.getenv("BROWSER_POOL_MAX_SIZE", "4"))
+# Warm sessions idle longer than this are released
+BROWSER_POOL_IDLE_TTL = float(os.getenv("BROWSER_POOL_IDLE_TTL", "120"))
+# A configuration is only kept warm for this long after its last acquire, so
+# an idle service stops paying for sessions nobody uses
+BROWSER_POOL_DEMAND_WINDOW = float(os.getenv("BROWSER_POOL_DEMAND_WINDOW", "300"))
+# How often the maintenance loop expires and health-checks warm sessions
+BROWSER_POOL_CHECK_INTERVAL = float(os.getenv("BROWSER_POOL_CHECK_INTERVAL", "15"))
+
+# Anchor session states in which a session can no longer be used
+ENDED_SESSION_STATES = frozenset({"ended", "closed", "stopped", "terminated", "failed", "timeout", "expired"})
+
+
+@dataclass
+class BrowserSession:
+    id: str
+    cdp_url: str
+    live_view_url: Optional[str]
+    config_key: str
+    created_at: float = field(default_factory=time.monotonic)
+    pooled_at: float = field(default_factory=time.monotonic)
+
+
+def config_key(config: Dict) -> str:
+    """Stable key for a browser configuration (adblock/captcha/proxy, ...)."""
+    return json.dumps(config, sort_keys=True, separators=(",", ":"))
+
+
+class SessionProvider:
+    """Creates, checks and releases remote browser sessions."""
+
+    async def create(self, config: Dict) -> BrowserSession:
+        raise NotImplementedError
+
+    async def is_healthy(self, session: BrowserSession) -> bool:
+        return True
+
+    async def release(self, session: BrowserSession) -> None:
+        pass
+
+
+class AnchorSessionProvider(SessionProvider):
+    """Sessions from the Anchor Browser API."""
+
+    def __init__(self, client: AnchorClient = anchor_client):
+        self.client = client
+
+    async def create(self, config: Dict) -> BrowserSession:
+        try:
+            session_data = await self.client.create_session(config)
+            logging.info(
+                f"Anchor Browser session created with response: {session_data}")
+        except CircuitOpenError:
+            logging.error("Anchor Browser is unavailable, not creating a session")
+            raise HTTPException(
+                status_code=503, detail="Browser provider temporarily unavailable")
+        except Exception as e:
+            logging.error(f"Failed to create browser session: {e}")
+            raise HTTPException(
+                status_code=500, detail="Failed to create browser session")
+
+        session_id = session_data["id"]
+        live_view_url = session_data.get("live_view_url")
+
+        if live_view_url:
+            logging.info(f"Live view URL found: {live_view_url}")
+        else:
+            # Construct the URL based on documentation
+            host = "connect.anchorbrowser.io"
+            live_view_url = f"https://live.anchorbrowser.io/inspector.html?host={host}&sessionId={session_id}"
+            logging.info(f"Constructed live view URL: {live_view_url}")
+
+        return BrowserSession(
+            id=session_id,
+            cdp_url=f"wss://connect.anchorbrowser.io?apiKey={self.client.api_key}&sessionId={session_id}",
+            live_view_url=live_view_url,
+            config_key=config_key(config)
+        )
+
+    async def is_healthy(self, session: BrowserSession) -> bool:
+        """False once Anchor no longer has the session or reports it ended."""
+        try:
+            session_data = await self.client.get_session(session.id)
+        except AnchorError as e:
+            # Can't tell; keep it rather than churn sessions during an outage
+            logging.warning(f"Could not check browser session {session.id}: {str(e)}")
+            return True
+        if session_data is None:
+            return False
+        # The session may be wrapped in a "data" envelope
+        status = session_data.get("status") or (session_data.get("data") or {}).get("status")
+        return str(status or "").lower() not in ENDED_SESSION_STATES
+
+    async def release(self, session: BrowserSession) -> None:
+        await self.client.end_session(session.id)
+
+
+class FakeSessionProvider(SessionProvider):
+    """Offline provider handing out sessions on a local CDP endpoint."""
+
+    def __init__(self, cdp_url: str = FAKE_BROWSER_CDP_URL):
+        self.cdp_url = cdp_url
+        self.created = 0
+        self.released = 0
+
+    async def create(self, config: Dict) -> BrowserSession:
+        self.created += 1
+        return BrowserSession(
+            id=f"fake-{uuid.uuid4()}",
+            cdp_url=self.cdp_url,
+            live_view_url=None,
+            config_key=config_key(config)
+        )
+
+    async def release(self, session: BrowserSession) -> None:
+        self.released += 1
+
+
+class BrowserSessionPool:
+    """Keeps warm browser sessions ready per configuration.
+
+    `acquire` pops a warm session in O(1) when one is available and only
+    falls back to provisioning on the request path when the pool is empty.
+    Sessions are single-use: `release` hands them back to the provider
+    rather than to the pool. A background task keeps each config acquired
+    within the last `demand_window` seconds topped up to `min_size` (never
+    above `max_size`), releases sessions idle longer than `idle_ttl` and
+    drops ones that fail the provider's health check. Without traffic no
+    sessions are created, so the pool drains to empty.
+    """
+
+    def __init__(
+        self,
+        provider: SessionProvider,
+        min_size: int = BROWSER_POOL_MIN_SIZE,
+        max_size: int = BROWSER_POOL_MAX_SIZE,
+        idle_ttl: float = BROWSER_POOL_IDLE_TTL,
+        check_interval: float = BROWSER_POOL_CHECK_INTERVAL,
+        demand_window: float = BROWSER_POOL_DEMAND_WINDOW
+    ):
+        self.provider = provider
+        self.min_size = max(0, min_size)
+        self.max_size = max(self.min_size, max_size)
+        self.idle_ttl = idle_ttl
+        self.check_interval = check_interval
+        self.demand_window = demand_window
+
+        self._warm: Dict[str, Deque[BrowserSession]] = {}
+        self._configs: Dict[str, Dict] = {}
+        self._creating: Dict[str, int] = {}
+        self._last_demand: Dict[str, float] = {}
+        self._in_use = 0
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        # Strong references so fire-and-forget tasks aren't garbage collected
+        self._background: Set[asyncio.Task] = set()
+        # The background tasks provisioning warm sessions, cancelled on stop
+        self._provisioning: Set[asyncio.Task] = set()
+
+        self.warm_hits = counter("browser_pool_warm_hits_total", "Sessions handed out warm")
+        self.cold_starts = counter("browser_pool_cold_starts_total", "Sessions provisioned on the request path")
+        self.expired = counter("browser_pool_expired_total", "Warm sessions released after idling")
+        self.unhealthy = counter("browser_pool_unhealthy_total", "Warm sessions dropped by health checks")
+        self.create_failures = counter("browser_pool_create_failures_total", "Failed background provisions")
+        self.warm_sessions = gauge("browser_pool_warm_sessions", "Warm sessions ready to hand out")
+        self.in_use_sessions = gauge("browser_pool_in_use_sessions", "Sessions handed out and not released")
+        self.acquire_seconds = histogram("browser_pool_acquire_seconds", "Time to acquire a browser session")
+
+    async def start(self, configs: Iterable[Dict] = ()) -> None:
+        for config in configs:
+            self._register(config)
+        if self._task is None:
+            self._task = asyncio.create_task(self._maintain())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        # Stop provisioning and wait for pending releases; a provision already
+        # under way finishes and hands back its session to be released
+        for task in self._provisioning:
+            task.cancel()
+        while self._background:
+            results = await asyncio.gather(*self._background, return_exceptions=True)
+            for result in results:
+                if isinstance(result, BrowserSession):
+                    await self._release_quietly(result)
+
+        for sessions in self._warm.values():
+            while sessions:
+                await self._release_quietly(sessions.popleft())
+        self._update_gauges()
+
+    async def acquire(self, config: Dict) -> BrowserSession:
+        start = time.monotonic()
+        key = self._register(config)
+        self._last_demand[key] = start
+        sessions = self._warm[key]
+        try:
+            while sessions:
+                session = sessions.popleft()
+                if time.monotonic() - session.pooled_at < self.idle_ttl:
+                    self.warm_hits.inc()
+                    self._in_use += 1
+                    return session
+                self.expired.inc()
+                self._spawn(self._release_quietly(session))
+
+            self.cold_starts.inc()
+            session = await self.provider.create(config)
+            self._in_use += 1
+            return session
+        finally:
+            self.acquire_seconds.observe(time.monotonic() - start)
+            self._update_gauges()
+            # Replenish in the background
+            self._wakeup.set()
+
+    async def release(self, session: BrowserSession) -> None:
+        """Return a used session; it is ended, never reused."""
+        self._in_use = max(0, self._in_use - 1)
+        self._update_gauges()
+        await self._release_quietly(session)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {
+            key: {
+                "warm": len(sessions),
+                "creating": self._creating.get(key, 0),
+            }
+            for key, sessions in self._warm.items()
+        }
+
+    def _register(self, config: Dict) -> str:
+        key = config_key(config)
+        if key not in self._configs:
+            self._configs[key] = dict(config)
+            self._warm[key] = deque()
+            self._creating[key] = 0
+        return key
+
+    async def _maintain(self) -> None:
+        while True:
+            try:
+                await self._expire_and_check()
+                self._replenish()
+            except Exception as e:
+                logging.error(f"Browser pool maintenance failed: {str(e)}")
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.check_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _expire_and_check(self) -> None:
+        now = time.monotonic()
+        for sessions in self._warm.values():
+            for session in list(sessions):
+                if now - session.pooled_at >= self.idle_ttl:
+                    reason = self.expired
+                elif not await self.provider.is_healthy(session):
+                    reason = self.unhealthy
+                else:
+                    continue
+                try:
+                    sessions.remove(session)
+                except ValueError:
+                    # Handed out while we were checking
+                    continue
+                reason.inc()
+                self._spawn(self._release_quietly(session))
+        self._update_gauges()
+
+    def _replenish(self) -> None:
+        now = time.monotonic()
+        for key, config in self._configs.items():
+            if now - self._last_demand.get(key, float("-inf")) >= self.demand_window:
+                continue
+            available = len(self._warm[key]) + self._creating[key]
+            missing = min(self.min_size, self.max_size) - available
+            for _ in range(max(0, missing)):
+                self._creating[key] += 1
+                task = self._spawn(self._create_warm(key, config))
+                self._provisioning.add(task)
+                task.add_done_callback(self._provisioning.discard)
+
+    async def _create_warm(self, key: str, config: Dict) -> Optional[BrowserSession]:
+        """Provision a warm session; when cancelled, return it unpooled instead."""
+        create = asyncio.ensure_future(self.provider.create(config))
+        try:
+            try:
+                session = await asyncio.shield(create)
+            except asyncio.CancelledError:
+                # The pool is stopping: the session may already exist, so wait
+                # for it and hand it to stop() to release
+                try:
+                    return await create
+                except Exception:
+                    return None
+            session.pooled_at = time.monotonic()
+            if len(self._warm[key]) < self.max_size:
+                self._warm[key].append(session)
+            else:
+                self._spawn(self._release_quietly(session))
+        except Exception as e:
+            self.create_failures.inc()
+            logging.error(f"Failed to pre-create browser session: {str(e)}")
+        finally:
+            self._creating[key] -= 1
+            self._update_gauges()
+
+    def _spawn(self, coro) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+        return task
+
+    async def _release_quietly(self, session: BrowserSession) -> None:
+        try:
+            await self.provider.release(session)
+        except Exception as e:
+            logging.warning(f"Failed to release browser session {session.id}: {str(e)}")
+
+    def _update_gauges(self) -> None:
+        self.warm_sessions.set(sum(len(s) for s in self._warm.values()))
+        self.in_use_sessions.set(self._in_use)
+
+
+def create_session_provider(kind: str = BROWSER_SESSION_PROVIDER) -> SessionProvider:
+    """Build the configured browser session provider."""
+    if kind == "fake":
+        return FakeSessionProvider()
+    if kind != "anchor":
+        logging.warning(f"Unknown session provider '{kind}', using Anchor")
+    return AnchorSessionProvider()
+
+
+browser_pool = BrowserSessionPool(create_session_provider())
@@ -0,0 +1,513 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Set, Tuple
+
+import orjson
+
+from app.utils.metrics import counter, gauge
+
+CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "300"))  # 5 minutes
+MAX_CACHE_ITEMS = int(os.getenv("RESPONSE_CACHE_MAX_ITEMS", "1000"))
+# Detail entries can carry multi-MB GIFs, so the cache is bounded by size too
+MAX_CACHE_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+# "memory" keeps a cache per process; "sqlite" shares one file between all
+# uvicorn workers on the host so hits and invalidations are shared too
+CACHE_BACKEND = os.getenv("RESPONSE_CACHE_BACKEND", "memory")
+CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", "/tmp/digest_ai_cache.sqlite3")
+# A SQLite hit only rewrites the entry's LRU timestamp when it is older than
+# this many seconds, so hot entries don't turn every read into a write
+CACHE_TOUCH_INTERVAL = float(os.getenv("RESPONSE_CACHE_TOUCH_INTERVAL", "30"))
+
+# Tag shared by every paginated history list entry of a user
+LIST_TAG = "history_list"
+
+HIT, MISS, EXPIRED = "hit", "miss", "expired"
+
+
+def estimate_size(value: Any) -> int:
+    """Cheaply estimate the payload size of a JSON-like value in bytes."""
+    if value is None:
+        return 0
+    if isinstance(value, (str, bytes, bytearray, memoryview)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(len(str(k)) + estimate_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(estimate_size(v) for v in value)
+    return 8
+
+
+class CacheBackend:
+    """Storage behind ResponseCache.
+
+    Methods are synchronous. Backends that do I/O set `blocking = True` and
+    ResponseCache calls them from a worker thread instead of the event loop.
+    Backends visible to every process on the host set `shared = True`.
+
+    Each user has an invalidation generation, bumped by `invalidate`. A
+    `set` given the generation read before loading is skipped when it has
+    moved since, so a load that raced with an invalidation isn't cached.
+    """
+
+    blocking = False
+    shared = False
+
+    def get(self, user_id: str, key: str) -> Tuple[str, Any]:
+        """Return (HIT, value), (MISS, None) or (EXPIRED, None)."""
+        raise NotImplementedError
+
+    def set(self, user_id: str, key: str, value: Any, tags: Tuple[str, ...], ttl: float,
+            generation: Optional[int] = None) -> int:
+        """Store a value; returns how many entries were evicted to make room."""
+        raise NotImplementedError
+
+    def generation(self, user_id: str) -> int:
+        """The user's current invalidation generation."""
+        raise NotImplementedError
+
+    def invalidate(self, user_id: str, tags: Tuple[str, ...]) -> int:
+        """Bump the user's generation and drop their entries carrying any of `tags`; returns the count."""
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, int]:
+        raise NotImplementedError
+
+
+class _Entry:
+    __slots__ = ("value", "size", "expires_at", "tags")
+
+    def __init__(self, value: Any, size: int, expires_at: float, tags: Tuple[str, ...]):
+        self.value = value
+        self.size = size
+        self.expires_at = expires_at
+        self.tags = tags
+
+
+class MemoryCacheBackend(CacheBackend):
+    """In-process LRU with O(1) lookups, inserts and evictions."""
+
+    def __init__(self, max_items: int = MAX_CACHE_ITEMS, max_bytes: int = MAX_CACHE_BYTES):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Tuple[str, str], _Entry]" = OrderedDict()
+        self._tags: Dict[Tuple[str, str], Set[Tuple[str, str]]] = {}
+        self._generations: Dict[str, int] = {}
+        self._bytes = 0
+
+    def get(self, user_id: str, key: str) -> Tuple[str, Any]:
+        cache_key = (user_id, key)
+        entry = self._entries.get(cache_key)
+        if entry is None:
+            return MISS, None
+        if entry.expires_at <= time.monotonic():
+            self._remove(cache_key)
+            return EXPIRED, None
+        self._entries.move_to_end(cache_key)
+        return HIT, entry.value
+
+    def set(self, user_id: str, key: str, value: Any, tags: Tuple[str, ...], ttl: float,
+            generation: Optional[int] = None) -> int:
+        if generation is not None and generation != self.generation(user_id):
+            return 0
+        cache_key = (user_id, key)
+        size = estimate_size(value)
+
+        self._remove(cache_key)
+        if size > self.max_bytes:
+            logging.info(f"Not caching {key}: {size} bytes exceeds cache limit")
+            return 0
+
+        entry = _Entry(value, size, time.monotonic() + ttl, tags)
+        self._entries[cache_key] = entry
+        self._bytes += size
+        for tag in tags:
+            self._tags.setdefault((user_id, tag), set()).add(cache_key)
+
+        evicted = 0
+        while self._entries and (len(self._entries) > self.max_items or self._bytes > self.max_bytes):
+            self._remove(next(iter(self._entries)))
+            evicted += 1
+        return evicted
+
+    def generation(self, user_id: str) -> int:
+        return self._generations.get(user_id, 0)
+
+    def invalidate(self, user_id: str, tags: Tuple[str, ...]) -> int:
+        self._generations[user_id] = self.generation(user_id) + 1
+        removed = 0
+        for tag in tags:
+            for cache_key in self._tags.pop((user_id, tag), set()):
+                if self._remove(cache_key):
+                    removed += 1
+        return removed
+
+    def stats(self) -> Dict[str, int]:
+        return {"items": len(self._entries), "bytes": self._bytes}
+
+    def _remove(self, cache_key: Tuple[str, str]) -> bool:
+        entry = self._entries.pop(cache_key, None)
+        if entry is None:
+            return False
+        self._bytes -= entry.size
+        user_id = cache_key[0]
+        for tag in entry.tags:
+            keys = self._tags.get((user_id, tag))
+            if keys is not None:
+                keys.discard(cache_key)
+                if not keys:
+                    del self._tags[(user_id, tag)]
+        return True
+
+
+class SQLiteCacheBackend(CacheBackend):
+    """Cache shared by every worker process on a host through one SQLite file.
+
+    Each payload is stored once for all workers, and an invalidation made by
+    one worker is immediately visible to the others. Running totals are kept
+    in a meta row so size checks never scan the table, and LRU eviction walks
+    the `accessed_at` index. `accessed_at` is only refreshed on a hit once it
+    is `touch_interval` seconds old, so LRU order is that coarse and most
+    hits are plain reads. Invalidation generations live in the file as well.
+    """
+
+    blocking = True
+    shared = True
+
+    def __init__(
+        self,
+        path: str = CACHE_PATH,
+        max_items: int = MAX_CACHE_ITEMS,
+        max_bytes: int = MAX_CACHE_BYTES,
+        touch_interval: float = CACHE_TOUCH_INTERVAL
+    ):
+        self.path = path
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.touch_interval = touch_interval
+        self._local = threading.local()
+        conn = self._connect()
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS cache_entries (
+                user_id TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                expires_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                PRIMARY KEY (user_id, key)
+            );
+            CREATE INDEX IF NOT EXISTS idx_cache_entries_accessed
+                ON cache_entries(accessed_at);
+            CREATE TABLE IF NOT EXISTS cache_tags (
+                user_id TEXT NOT NULL,
+                tag TEXT NOT NULL,
+                key TEXT NOT NULL,
+                PRIMARY KEY (user_id, tag, key)
+            );
+            CREATE INDEX IF NOT EXISTS idx_cache_tags_key
+                ON cache_tags(user_id, key);
+            CREATE TABLE IF NOT EXISTS cache_meta (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                items INTEGER NOT NULL,
+                bytes INTEGER NOT NULL
+            );
+            INSERT OR IGNORE INTO cache_meta (id, items, bytes) VALUES (1, 0, 0);
+            CREATE TABLE IF NOT EXISTS cache_generations (
+                user_id TEXT PRIMARY KEY,
+                generation INTEGER NOT NULL
+            );
+        """)
+
+    def _connect(self) -> sqlite3.Connection:
+        # sqlite3 connections must not be shared between threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, user_id: str, key: str) -> Tuple[str, Any]:
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT value, expires_at, accessed_at FROM cache_entries WHERE user_id = ? AND key = ?",
+            (user_id, key)
+        ).fetchone()
+        if row is None:
+            return MISS, None
+
+        now = time.time()
+        if row[1] <= now:
+            with self._transaction(conn):
+                self._delete(conn, user_id, key)
+            return EXPIRED, None
+
+        if now - row[2] >= self.touch_interval:
+            conn.execute(
+                "UPDATE cache_entries SET accessed_at = ? WHERE user_id = ? AND key = ?",
+                (now, user_id, key)
+            )
+        return HIT, orjson.loads(row[0])
+
+    def set(self, user_id: str, key: str, value: Any, tags: Tuple[str, ...], ttl: float,
+            generation: Optional[int] = None) -> int:
+        payload = orjson.dumps(value)
+        size = len(payload)
+        conn = self._connect()
+
+        with self._transaction(conn):
+            if generation is not None and generation != self._generation(conn, user_id):
+                return 0
+            self._delete(conn, user_id, key)
+            if size > self.max_bytes:
+                logging.info(f"Not caching {key}: {size} bytes exceeds cache limit")
+                return 0
+
+            now = time.time()
+            conn.execute(
+                "INSERT INTO cache_entries (user_id, key, value, size, expires_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (user_id, key, payload, size, now + ttl, now)
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO cache_tags (user_id, tag, key) VALUES (?, ?, ?)",
+                [(user_id, tag, key) for tag in tags]
+            )
+            conn.execute(
+                "UPDATE cache_meta SET items = items + 1, bytes = bytes + ? WHERE id = 1", (size,))
+
+            evicted = 0
+            while True:
+                items, total = conn.execute(
+                    "SELECT items, bytes FROM cache_meta WHERE id = 1").fetchone()
+                if items <= self.max_items and total <= self.max_bytes:
+                    break
+                oldest = conn.execute(
+                    "SELECT user_id, key FROM cache_entries ORDER BY accessed_at LIMIT 1").fetchone()
+                if oldest is None:
+                    break
+                self._delete(conn, *oldest)
+                evicted += 1
+            return evicted
+
+    def generation(self, user_id: str) -> int:
+        return self._generation(self._connect(), user_id)
+
+    def invalidate(self, user_id: str, tags: Tuple[str, ...]) -> int:
+        conn = self._connect()
+        removed = 0
+        with self._transaction(conn):
+            conn.execute(
+                "INSERT INTO cache_generations (user_id, generation) VALUES (?, 1) "
+                "ON CONFLICT (user_id) DO UPDATE SET generation = generation + 1",
+                (user_id,)
+            )
+            for tag in tags:
+                keys = conn.execute(
+                    "SELECT key FROM cache_tags WHERE user_id = ? AND tag = ?",
+                    (user_id, tag)
+                ).fetchall()
+                for (key,) in keys:
+                    if self._delete(conn, user_id, key):
+                        removed += 1
+        return removed
+
+    def stats(self) -> Dict[str, int]:
+        items, total = self._connect().execute(
+            "SELECT items, bytes FROM cache_meta WHERE id = 1").fetchone()
+        return {"items": items, "bytes": total}
+
+    @staticmethod
+    def _transaction(conn: sqlite3.Connection):
+        """Start a write transaction; the connection context commits or rolls back."""
+        conn.execute("BEGIN IMMEDIATE")
+        return conn
+
+    @staticmethod
+    def _generation(conn: sqlite3.Connection, user_id: str) -> int:
+        row = conn.execute(
+            "SELECT generation FROM cache_generations WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0] if row is not None else 0
+
+    def _delete(self, conn: sqlite3.Connection, user_id: str, key: str) -> bool:
+        row = conn.execute(
+            "SELECT size FROM cache_entries WHERE user_id = ? AND key = ?",
+            (user_id, key)
+        ).fetchone()
+        if row is None:
+            return False
+        conn.execute(
+            "DELETE FROM cache_entries WHERE user_id = ? AND key = ?", (user_id, key))
+        conn.execute(
+            "DELETE FROM cache_tags WHERE user_id = ? AND key = ?", (user_id, key))
+        conn.execute(
+            "UPDATE cache_meta SET items = items - 1, bytes = bytes - ? WHERE id = 1", (row[0],))
+        return True
+
+
+class ResponseCache:
+    """User-scoped response cache with single-flight loading.
+
+    Every entry is keyed by (user_id, key), so responses are never shared
+    between users. Entries can carry tags (for example a history id) so
+    writes can invalidate exactly the entries they affect. Concurrent misses
+    for the same key in this process share one load via `get_or_load`.
+    Storage, eviction and TTL handling are delegated to a CacheBackend.
+    """
+
+    def __init__(self, backend: CacheBackend, name: str = "response_cache", ttl: float = CACHE_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self._inflight: Dict[Tuple[str, str], asyncio.Future] = {}
+        # Called with (user_id, tags) after each invalidation when the backend
+        # isn't shared, so other processes can drop their copies too
+        self.on_invalidate: Optional[Callable[[str, Tuple[str, ...]], None]] = None
+
+        self.hits = counter(f"{name}_hits_total", "Cache lookups served from cache")
+        self.misses = counter(f"{name}_misses_total", "Cache lookups that had to load")
+        self.evictions = counter(f"{name}_evictions_total", "Entries evicted for size or count")
+        self.expirations = counter(f"{name}_expirations_total", "Entries dropped after their TTL")
+        self.invalidations = counter(f"{name}_invalidations_total", "Entries dropped by invalidation")
+        self.coalesced = counter(f"{name}_coalesced_total", "Misses that waited on an in-flight load")
+        self.size_bytes = gauge(f"{name}_bytes", "Estimated bytes held by the cache")
+        self.size_items = gauge(f"{name}_items", "Entries held by the cache")
+
+    async def _call(self, method: Callable, *args):
+        if self.backend.blocking:
+            return await asyncio.to_thread(method, *args)
+        return method(*args)
+
+    async def get(self, user_id: str, key: str) -> Optional[Any]:
+        """Return a live cached value or None, counting the hit or miss."""
+        try:
+            status, value = await self._call(self.backend.get, user_id, key)
+        except Exception as e:
+            logging.error(f"Cache read failed for {key}: {str(e)}")
+            status, value = MISS, None
+
+        if status == HIT:
+            self.hits.inc()
+            return value
+
+        self.misses.inc()
+        if status == EXPIRED:
+            self.expirations.inc()
+        return None
+
+    async def set(self, user_id: str, key: str, value: Any, tags: Iterable[str] = (),
+                  generation: Optional[int] = None) -> None:
+        """Cache a value, unless `generation` is given and the user was invalidated since."""
+        try:
+            evicted = await self._call(
+                self.backend.set, user_id, key, value, tuple(tags), self.ttl, generation)
+            self.evictions.inc(evicted)
+            await self._update_gauges()
+        except Exception as e:
+            # A cache write failure should never fail the request itself
+            logging.error(f"Cache write failed for {key}: {str(e)}")
+
+    async def get_or_load(
+        self,
+        user_id: str,
+        key: str,
+        loader: Callable[[], Awaitable[Any]],
+        tags: Iterable[str] = ()
+    ) -> Any:
+        """Return the cached value, or load it once for all concurrent callers.
+
+        `None` results are returned but not cached; exceptions propagate to
+        every waiting caller and nothing is cached.
+        """
+        cached = await self.get(user_id, key)
+        if cached is not None:
+            return cached
+
+        cache_key = (user_id, key)
+        inflight = self._inflight.get(cache_key)
+        if inflight is not None:
+            self.coalesced.inc()
+            try:
+                return await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                if not inflight.cancelled():
+                    raise
+                # The loading request went away (e.g. client disconnect); load ourselves
+                return await self.get_or_load(user_id, key, loader, tags)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[cache_key] = future
+        try:
+            try:
+                # Read from the backend, so invalidations by other workers count too
+                generation = await self._call(self.backend.generation, user_id)
+            except Exception as e:
+                logging.error(f"Cache read failed for {key}: {str(e)}")
+                generation = None
+            value = await loader()
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved when nobody else was waiting
+            future.exception()
+            raise
+        else:
+            future.set_result(value)
+            if value is not None and generation is not None:
+                await self.set(user_id, key, value, tags, generation)
+            return value
+        finally:
+            if self._inflight.get(cache_key) is future:
+                del self._inflight[cache_key]
+            if not future.done():
+                future.cancel()
+
+    async def invalidate(self, user_id: str, *tags: str) -> int:
+        """Drop every entry of `user_id` carrying any of the given tags."""
+        # Loads already in flight may return pre-invalidation data; don't let
+        # new callers join them (this only scans the handful of active loads)
+        for cache_key in [k for k in self._inflight if k[0] == user_id]:
+            del self._inflight[cache_key]
+        if self.on_invalidate is not None and not self.backend.shared:
+            self.on_invalidate(user_id, tags)
+
+        try:
+            removed = await self._call(self.backend.invalidate, user_id, tags)
+        except Exception as e:
+            logging.error(f"Cache invalidation failed for user {user_id}: {str(e)}")
+            return 0
+        self.invalidations.inc(removed)
+        await self._update_gauges()
+        return removed
+
+    async def stats(self) -> Dict[str, float]:
+        backend_stats = await self._call(self.backend.stats)
+        return {
+            **backend_stats,
+            "hits": self.hits.value,
+            "misses": self.misses.value,
+            "evictions": self.evictions.value,
+            "expirations": self.expirations.value,
+            "invalidations": self.invalidations.value,
+        }
+
+    async def _update_gauges(self) -> None:
+        backend_stats = await self._call(self.backend.stats)
+        self.size_bytes.set(backend_stats["bytes"])
+        self.size_items.set(backend_stats["items"])
+
+
+def create_cache_backend(kind: str = CACHE_BACKEND) -> CacheBackend:
+    """Build the configured cache backend."""
+    if kind == "sqlite":
+        return SQLiteCacheBackend()
+    if kind != "memory":
+        logging.warning(f"Unknown cache backend '{kind}', using in-process memory cache")
+    return MemoryCacheBackend()
+
+
+response_cache = ResponseCache(create_cache_backend())
@@ -0,0 +1,167 @@
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Iterable, NamedTuple, Optional
+
+import orjson
+
+from app.utils.metrics import counter, gauge
+
+DOCUMENT_CACHE_PATH = os.getenv(
+    "DOCUMENT_CACHE_PATH", "/tmp/digest_ai_documents.sqlite3")
+DOCUMENT_CACHE_MAX_BYTES = int(
+    os.getenv("DOCUMENT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Bump to drop every cached document, e.g. after changing the prompts
+DOCUMENT_CACHE_VERSION = "1"
+
+
+class CachedDocument(NamedTuple):
+    content: str
+    input_tokens: int
+    output_tokens: int
+    generation_seconds: float
+
+
+def agent_fingerprint(agents: Iterable) -> dict:
+    """What about the document agents changes their output: names, instructions, models."""
+    return {
+        getattr(agent, "name", ""): [
+            str(getattr(agent, "instructions", "")),
+            str(getattr(agent, "model", "")),
+        ]
+        for agent in agents
+    }
+
+
+def document_key(task: str, browser_results: str, is_done: bool, fingerprint: dict) -> str:
+    """Content address of a document: a hash of everything it is generated from."""
+    payload = orjson.dumps(
+        [DOCUMENT_CACHE_VERSION, task, str(browser_results), bool(is_done), fingerprint],
+        option=orjson.OPT_SORT_KEYS)
+    return hashlib.sha256(payload).hexdigest()
+
+
+class DocumentCache:
+    """Generated documents keyed by the hash of their inputs, in one SQLite file.
+
+    The file is shared by every worker process on the host. Total size is
+    kept under `max_bytes` by evicting the least recently used documents;
+    the total is kept in a meta row, so inserts never scan the table.
+    Hits also count the LLM tokens and generation time they avoided.
+    """
+
+    def __init__(self, path: str = DOCUMENT_CACHE_PATH, max_bytes: int = DOCUMENT_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        conn = self._connect()
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS documents (
+                key TEXT PRIMARY KEY,
+                content TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                input_tokens INTEGER NOT NULL,
+                output_tokens INTEGER NOT NULL,
+                generation_seconds REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_documents_accessed
+                ON documents(accessed_at);
+            CREATE TABLE IF NOT EXISTS documents_meta (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                bytes INTEGER NOT NULL
+            );
+            INSERT OR IGNORE INTO documents_meta (id, bytes)
+                SELECT 1, COALESCE(SUM(size), 0) FROM documents;
+        """)
+
+        self.hits = counter("document_cache_hits_total", "Documents served from the cache")
+        self.misses = counter("document_cache_misses_total", "Documents that had to be generated")
+        self.hit_ratio = gauge("document_cache_hit_ratio", "Share of document lookups served from the cache")
+        self.tokens_avoided = counter("document_cache_tokens_avoided_total", "LLM tokens not spent thanks to cache hits")
+        self.seconds_avoided = counter("document_cache_seconds_avoided_total", "Generation time not spent thanks to cache hits")
+        self.evictions = counter("document_cache_evictions_total", "Documents evicted to stay under the size limit")
+        self.cached_bytes = gauge("document_cache_bytes", "Size of the cached documents")
+
+    def _connect(self) -> sqlite3.Connection:
+        # sqlite3 connections must not be shared between threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    async def get(self, key: str) -> Optional[CachedDocument]:
+        try:
+            document = await asyncio.to_thread(self._get, key)
+        except sqlite3.Error as e:
+            logging.warning(f"Document cache lookup failed: {str(e)}")
+            document = None
+
+        if document is None:
+            self.misses.inc()
+        else:
+            self.hits.inc()
+            self.tokens_avoided.inc(document.input_tokens + document.output_tokens)
+            self.seconds_avoided.inc(document.generation_seconds)
+        lookups = self.hits.value + self.misses.value
+        self.hit_ratio.set(self.hits.value / lookups)
+        return document
+
+    async def put(self, key: str, document: CachedDocument) -> None:
+        try:
+            await asyncio.to_thread(self._put, key, document)
+        except sqlite3.Error as e:
+            logging.warning(f"Document cache write failed: {str(e)}")
+
+    def _get(self, key: str) -> Optional[CachedDocument]:
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT content, input_tokens, output_tokens, generation_seconds "
+            "FROM documents WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        conn.execute(
+            "UPDATE documents SET accessed_at = ? WHERE key = ?", (time.time(), key))
+        return CachedDocument(*row)
+
+    def _put(self, key: str, document: CachedDocument) -> None:
+        size = len(document.content.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        with conn:
+            replaced = conn.execute(
+                "SELECT size FROM documents WHERE key = ?", (key,)).fetchone()
+            conn.execute(
+                "INSERT OR REPLACE INTO documents (key, content, size, input_tokens, "
+                "output_tokens, generation_seconds, accessed_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, document.content, size, document.input_tokens,
+                 document.output_tokens, document.generation_seconds, time.time())
+            )
+            conn.execute(
+                "UPDATE documents_meta SET bytes = bytes + ? WHERE id = 1",
+                (size - (replaced[0] if replaced else 0),))
+            total = conn.execute("SELECT bytes FROM documents_meta WHERE id = 1").fetchone()[0]
+            while total > self.max_bytes:
+                oldest = conn.execute(
+                    "SELECT key, size FROM documents ORDER BY accessed_at LIMIT 1").fetchone()
+                if oldest is None:
+                    break
+                conn.execute("DELETE FROM documents WHERE key = ?", (oldest[0],))
+                total -= oldest[1]
+                self.evictions.inc()
+            conn.execute("UPDATE documents_meta SET bytes = ? WHERE id = 1", (total,))
+        self.cached_bytes.set(total)
+
+
+document_cache = DocumentCache()
@@ -0,0 +1,258 @@
+import asyncio
+import base64
+import logging
+import os
+import time
+import zlib
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import orjson
+
+from app.config.supabase import supabase, EVENTS_TABLE
+from app.utils.auth import AuthTokens
+from app.utils.db import execute
+from app.utils.metrics import counter, histogram
+
+# A chunk of progress events is written once it holds this many events...
+RUN_EVENTS_CHUNK_EVENTS = int(os.getenv("RUN_EVENTS_CHUNK_EVENTS", "25"))
+# ...or its first event has waited this many seconds
+RUN_EVENTS_FLUSH_INTERVAL = float(os.getenv("RUN_EVENTS_FLUSH_INTERVAL", "2"))
+# Chunks at least this large (encoded) are zlib-compressed
+RUN_EVENTS_COMPRESS_MIN_BYTES = int(os.getenv("RUN_EVENTS_COMPRESS_MIN_BYTES", "2048"))
+
+# Chunks fetched per request when reading a run's events back
+READ_PAGE_SIZE = 20
+
+ENCODING_ORJSON = "orjson"
+ENCODING_ORJSON_ZLIB = "orjson+zlib"
+
+chunks_written = counter("run_event_chunks_written_total", "Progress event chunks persisted")
+chunk_failures = counter("run_event_chunk_failures_total", "Progress event chunks that failed to persist")
+chunk_bytes = histogram(
+    "run_event_chunk_bytes", "Encoded size of persisted progress event chunks",
+    buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576))
+
+
+def encode_chunk(events: List[Dict]) -> Tuple[str, str]:
+    """Encode events as (encoding, payload) for a run_events row."""
+    data = orjson.dumps(events)
+    if len(data) >= RUN_EVENTS_COMPRESS_MIN_BYTES:
+        compressed = zlib.compress(data, 6)
+        if len(compressed) < len(data):
+            return ENCODING_ORJSON_ZLIB, base64.b64encode(compressed).decode('ascii')
+    return ENCODING_ORJSON, data.decode('utf-8')
+
+
+def decode_chunk(encoding: str, payload: str) -> List[Dict]:
+    if encoding == ENCODING_ORJSON_ZLIB:
+        return orjson.loads(zlib.decompress(base64.b64decode(payload)))
+    if encoding == ENCODING_ORJSON:
+        return orjson.loads(payload)
+    raise ValueError(f"Unknown run event encoding: {encoding}")
+
+
+class RunEventWriter:
+    """Persist a run's progress events in small chunks while it runs.
+
+    `add` never waits on the database: full (or old enough) batches are
+    written by background tasks, so a crash loses at most the last few
+    seconds of events and no single write carries the whole run. Each
+    write waits for the previous one, so chunks land in `seq` order.
+    """
+
+    def __init__(
+        self,
+        run_id: str,
+        user_id: str,
+        auth_tokens: Optional[AuthTokens] = None,
+        chunk_events: int = RUN_EVENTS_CHUNK_EVENTS,
+        flush_interval: float = RUN_EVENTS_FLUSH_INTERVAL
+    ):
+        self.run_id = run_id
+        self.user_id = user_id
+        self.auth_tokens = auth_tokens
+        self.chunk_events = max(1, chunk_events)
+        self.flush_interval = flush_interval
+        self.failed = False
+
+        self._pending: List[Dict] = []
+        self._seq = 0
+        self._written_events = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._last_write: Optional[asyncio.Task] = None
+
+    def add(self, event: Dict) -> None:
+        self._pending.append(event)
+        if len(self._pending) >= self.chunk_events:
+            self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(
+                self.flush_interval, self.flush)
+
+    def flush(self) -> None:
+        """Start writing the pending events as one chunk."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+
+        events, self._pending = self._pending, []
+        row = self._row(events)
+        self._last_write = asyncio.create_task(self._write_after(self._last_write, row))
+
+    async def close(self) -> bool:
+        """Write what is left; True if every event was persisted."""
+        self.flush()
+        if self._last_write is not None:
+            await asyncio.gather(self._last_write, return_exceptions=True)
+        return not self.failed
+
+    def _row(self, events: List[Dict]) -> Dict:
+        encoding, payload = encode_chunk(events)
+        row = {
+            'run_id': self.run_id,
+            'seq': self._seq,
+            'user_id': self.user_id,
+            'first_event': self._written_events,
+            'event_count': len(events),
+            'encoding': encoding,
+            'payload': payload
+        }
+        self._seq += 1
+        self._written_events += len(events)
+        return row
+
+    async def _write_after(self, previous: Optional[asyncio.Task], row: Dict) -> None:
+        if previous is not None:
+            await asyncio.gather(previous, return_exceptions=True)
+        await self._write(row)
+
+    async def _write(self, row: Dict) -> None:
+        try:
+            await execute(
+                supabase.table(EVENTS_TABLE).insert(row),
+                auth_tokens=self.auth_tokens
+            )
+            chunks_written.inc()
+            chunk_bytes.observe(len(row['payload']))
+        except Exception as e:
+            self.failed = True
+            chunk_failures.inc()
+            logging.error(
+                f"Failed to persist progress chunk {row['seq']} of run {self.run_id}: {str(e)}")
+
+
+async def _read_chunks(
+    user_id: str,
+    run_id: str,
+    auth_tokens: Optional[AuthTokens],
+    after_seq: int,
+    page_size: int
+) -> AsyncIterator[Dict]:
+    """Yield the run_events rows after `after_seq`, a page at a time."""
+    while True:
+        response = await execute(
+            supabase.table(EVENTS_TABLE)
+            .select('seq,first_event,encoding,payload')
+            .eq('run_id', run_id)
+            .eq('user_id', user_id)
+            .gt('seq', after_seq)
+            .order('seq')
+            .limit(page_size),
+            auth_tokens=auth_tokens
+        )
+        rows = response.data or []
+        for row in rows:
+            yield row
+            after_seq = row['seq']
+        if len(rows) < page_size:
+            return
+
+
+async def iter_run_events(
+    user_id: str,
+    run_id: str,
+    auth_tokens: Optional[AuthTokens] = None,
+    page_size: int = READ_PAGE_SIZE
+) -> AsyncIterator[List[Dict]]:
+    """Yield a run's persisted progress events in order, one chunk at a time.
+
+    Chunks are fetched a page at a time by sequence number, so a long run is
+    never loaded (or held) all at once.
+    """
+    async for row in _read_chunks(user_id, run_id, auth_tokens, -1, page_size):
+        yield decode_chunk(row['encoding'], row['payload'])
+
+
+async def follow_run_events(
+    user_id: str,
+    run_id: str,
+    finished: Callable[[], Awaitable[bool]],
+    auth_tokens: Optional[AuthTokens] = None,
+    after: int = -1,
+    poll_interval: float = RUN_EVENTS_FLUSH_INTERVAL,
+    idle_timeout: float = 600.0
+) -> AsyncIterator[Tuple[int, Dict]]:
+    """Yield (index, event) for a run's persisted events after `after`, live.
+
+    For following a run executing in another process: run_events is polled
+    every `poll_interval` seconds until the run has `finished` (its history
+    row exists, so every chunk has been written) or nothing new has shown
+    up for `idle_timeout` seconds. Reading stops at a gap in `seq` until
+    the next poll, so a chunk that commits late is never skipped; once the
+    run has finished, remaining gaps are chunks that failed to write.
+    """
+    last_seq = -1
+    last_change = time.monotonic()
+    done = False
+    while True:
+        gap = False
+        async for row in _read_chunks(user_id, run_id, auth_tokens, last_seq, READ_PAGE_SIZE):
+            gap = gap or (row['seq'] != last_seq + 1 and not done)
+            if gap:
+                continue
+            last_seq = row['seq']
+            last_change = time.monotonic()
+            for offset, event in enumerate(decode_chunk(row['encoding'], row['payload'])):
+                index = row['first_event'] + offset
+                if index > after:
+                    yield index, event
+
+        # Checked after reading, so the chunks written before it was saved
+        # are all read on the next (last) pass
+        if done or time.monotonic() - last_change >= idle_timeout:
+            return
+        done = await finished()
+        if not done:
+            await asyncio.sleep(poll_interval)
+
+
+async def has_run_events(
+    user_id: str,
+    run_id: str,
+    auth_tokens: Optional[AuthTokens] = None
+) -> bool:
+    response = await execute(
+        supabase.table(EVENTS_TABLE)
+        .select('seq')
+        .eq('run_id', run_id)
+        .eq('user_id', user_id)
+        .limit(1),
+        auth_tokens=auth_tokens
+    )
+    return bool(response.data)
+
+
+async def delete_run_events(
+    user_id: str,
+    run_id: str,
+    auth_tokens: Optional[AuthTokens] = None
+) -> None:
+    await execute(
+        supabase.table(EVENTS_TABLE)
+        .delete()
+        .eq('run_id', run_id)
+        .eq('user_id', user_id),
+        auth_tokens=auth_tokens
+    )
@@ -1,14 +1,19 @@
 from datetime import datetime
 import base64
 from app.config.supabase import supabase, HISTORY_TABLE, GIF_TABLE, DOCUMENT_TABLE
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Sequence, Tuple
+from supabase import Client
 import json
 import logging
+import re
 from app.utils.auth import AuthTokens
+from app.utils.db import execute
+from app.services.storage_service import StoredObject
+from app.services.event_store import delete_run_events
 import uuid
 
 
-async def save_run_history(
+def build_history_record(
     user_id: str,
     task: str,
     progress_events: List[Dict],
@@ -16,88 +21,129 @@ async def save_run_history(
     error: Optional[str] = None,
     gif_content: Optional[str] = None,
     document_content: Optional[str] = None,
-    auth_tokens: Optional[AuthTokens] = None,
     run_id: Optional[str] = None,
-    live_view_url: Optional[str] = None
-) -> str:
-    """Save run history and associated GIF content."""
-    try:
-        # Set auth context if tokens are provided
-        if auth_tokens:
-            try:
-                supabase.auth.set_session(
-                    access_token=auth_tokens.access_token,
-                    refresh_token=auth_tokens.refresh_token
-                )
-            except Exception as e:
-                logging.error(f"Error setting session: {str(e)}")
-                raise
-
-        # Prepare history data
-        history_id = run_id or str(uuid.uuid4())
-        history_data = {
+    live_view_url: Optional[str] = None,
+    gif_object: Optional[StoredObject] = None,
+    events_persisted: bool = False
+) -> Dict[str, Optional[Dict]]:
+    """Build the rows saving a run writes, as plain JSON-serializable dicts.
+
+    Returns {'history': ..., 'gif': ..., 'document': ...}; the GIF and
+    document rows are None when there is nothing to save. Timestamps are
+    fixed here so saving the same record again writes the same rows.
+    """
+    history_id = run_id or str(uuid.uuid4())
+    created_at = datetime.utcnow().isoformat()
+    record = {
+        'history': {
             'id': history_id,
             'user_id': user_id,
             'task': task,
             'progress': json.dumps(progress_events),
             'result': result,
             'error': error,
-            'created_at': datetime.utcnow().isoformat(),
-            'live_view_url': live_view_url
+            'created_at': created_at,
+            'live_view_url': live_view_url,
+            'events_persisted': events_persisted
+        },
+        'gif': None,
+        'document': None
+    }
+
+    # A GIF is normally a recording already written to the object store, and
+    # only its reference is saved; inline base64 is kept for older callers
+    if gif_object or gif_content:
+        record['gif'] = {
+            'history_id': history_id,
+            'gif_content': None if gif_object else gif_content,
+            'gif_path': gif_object.key if gif_object else None,
+            'gif_size': gif_object.size if gif_object else None,
+            'gif_etag': gif_object.etag if gif_object else None,
+            'created_at': created_at
         }
 
-        logging.info(f"Saving run history for user {user_id}")
-        logging.debug(f"History data: {history_data}")
+    if document_content:
+        record['document'] = {
+            'history_id': history_id,
+            'document_content': document_content,
+            'created_at': created_at
+        }
 
-        # Insert history
-        history_response = supabase.table(
-            HISTORY_TABLE).insert(history_data).execute()
+    return record
 
-        if not history_response.data:
-            raise Exception("No data returned from history insert")
-
-        history_id = history_response.data[0]['id']
-
-        # If there's a GIF, save it
-        if gif_content:
-            logging.info(f"GIF content length: {len(gif_content)}")
-            gif_data = {
-                'history_id': history_id,
-                'gif_content': gif_content,
-                'created_at': datetime.utcnow().isoformat()
-            }
-
-            logging.info(f"Saving GIF for history {history_id}")
-            gif_response = supabase.table(GIF_TABLE).insert(gif_data).execute()
-
-            if not gif_response.data:
-                logging.error("Failed to save GIF content")
-            else:
-                logging.info("Successfully saved GIF content")
-        else:
-            logging.warning("No GIF content provided to save")
-
-        # If there's a document, save it
-        if document_content:
-            logging.info(f"Document content length: {len(document_content)}")
-            document_data = {
-                'history_id': history_id,
-                'document_content': document_content,
-                'created_at': datetime.utcnow().isoformat()
-            }
-
-            logging.info(f"Saving document for history {history_id}")
-            document_response = supabase.table(
-                DOCUMENT_TABLE).insert(document_data).execute()
-
-            if not document_response.data:
-                logging.error("Failed to save document content")
-            else:
-                logging.info("Successfully saved document content")
-        else:
-            logging.warning("No document content provided to save")
 
-        return history_id
+async def save_history_records(
+    records: List[Dict[str, Optional[Dict]]],
+    auth_tokens: Optional[AuthTokens] = None,
+    client: Optional[Client] = None
+) -> None:
+    """Save records from build_history_record in one upsert per table.
+
+    Rows are upserted on their keys (run_history.id, and history_id for
+    GIFs and documents), so saving a record that was already saved, e.g.
+    when retrying after a timeout, leaves a single copy of each row.
+    `client` replaces the shared client, e.g. with the service-role one.
+    """
+    db = client or supabase
+    history_rows = [r['history'] for r in records]
+    gif_rows = [r['gif'] for r in records if r.get('gif')]
+    document_rows = [r['document'] for r in records if r.get('document')]
+
+    logging.info(f"Saving {len(history_rows)} run histories")
+    history_response = await execute(
+        db.table(HISTORY_TABLE).upsert(history_rows, on_conflict='id'),
+        auth_tokens=auth_tokens
+    )
+    if not history_response.data:
+        raise Exception("No data returned from history upsert")
+
+    if gif_rows:
+        gif_response = await execute(
+            db.table(GIF_TABLE).upsert(gif_rows, on_conflict='history_id'),
+            auth_tokens=auth_tokens
+        )
+        if not gif_response.data:
+            raise Exception("No data returned from GIF upsert")
+
+    if document_rows:
+        document_response = await execute(
+            db.table(DOCUMENT_TABLE).upsert(document_rows, on_conflict='history_id'),
+            auth_tokens=auth_tokens
+        )
+        if not document_response.data:
+            raise Exception("No data returned from document upsert")
+
+
+async def save_run_history(
+    user_id: str,
+    task: str,
+    progress_events: List[Dict],
+    result: Optional[str] = None,
+    error: Optional[str] = None,
+    gif_content: Optional[str] = None,
+    document_content: Optional[str] = None,
+    auth_tokens: Optional[AuthTokens] = None,
+    run_id: Optional[str] = None,
+    live_view_url: Optional[str] = None,
+    gif_object: Optional[StoredObject] = None,
+    events_persisted: bool = False
+) -> str:
+    """Save run history and associated GIF content right away.
+
+    Runs are normally saved through history_writer, which journals the
+    record first and retries; this writes directly. `events_persisted`
+    marks runs whose progress events were already written to run_events
+    during the run (see event_store).
+    """
+    record = build_history_record(
+        user_id, task, progress_events, result=result, error=error,
+        gif_content=gif_content, document_content=document_content,
+        run_id=run_id, live_view_url=live_view_url, gif_object=gif_object,
+        events_persisted=events_persisted
+    )
+    try:
+        await save_history_records([record], auth_tokens=auth_tokens)
+        return record['history']['id']
 
     except Exception as e:
         logging.error(f"Error saving run history: {str(e)}")
@@ -107,45 +153,94 @@ async def save_run_history(
         raise Exception(f"Failed to save run history: {str(e)}")
 
 
+# Columns returned by the lightweight (summary) history listing; notably
+# excludes the `progress` blob holding every streamed event
+SUMMARY_FIELDS = ('id', 'task', 'result', 'error', 'created_at', 'live_view_url')
+
+# Supported total-count modes for history listings: PostgREST's exact,
+# planned and estimated counts, or "none" to skip counting altogether
+COUNT_MODES = ('exact', 'planned', 'estimated', 'none')
+
+# created_at as PostgREST returns it (ISO 8601); cursor values are
+# interpolated into a filter, so nothing else is accepted
+_TIMESTAMP_RE = re.compile(
+    r'\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(\.\d{1,6})?(Z|[+-]\d{2}(:?\d{2})?)?')
+
+
+def encode_history_cursor(row: Dict) -> str:
+    """Encode the keyset position (created_at, id) of a history row."""
+    payload = json.dumps([row['created_at'], row['id']]).encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode('ascii')
+
+
+def decode_history_cursor(cursor: str) -> Tuple[str, str]:
+    """Decode a cursor from encode_history_cursor; raises ValueError if invalid."""
+    try:
+        created_at, history_id = json.loads(
+            base64.urlsafe_b64decode(cursor.encode('ascii')))
+        if not _TIMESTAMP_RE.fullmatch(created_at):
+            raise ValueError
+        return created_at, str(uuid.UUID(history_id))
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
 async def get_run_history(
     user_id: str,
     limit: int = 10,
     offset: int = 0,
-    auth_tokens: Optional[AuthTokens] = None
+    auth_tokens: Optional[AuthTokens] = None,
+    summary: bool = False,
+    cursor: Optional[str] = None,
+    count: str = 'exact'
 ) -> Dict:
-    """Get paginated run history for a specific user."""
+    """Get paginated run history for a specific user.
+
+    Rows are ordered newest first by (created_at, id). When `cursor` (the
+    `next_cursor` of a previous page) is given, the page starts right after
+    that row using a keyset filter and `offset` is ignored, so deep pages
+    cost the same as the first one. `summary` returns only SUMMARY_FIELDS.
+    `count` selects how `total` is computed (see COUNT_MODES); it is sent
+    with the page query itself rather than as a separate request, and
+    `total` is None for "none".
+    """
+    if count not in COUNT_MODES:
+        raise ValueError(f"Invalid count mode: {count}")
+    position = decode_history_cursor(cursor) if cursor else None
+
     try:
-        # Set auth context if tokens are provided
-        if auth_tokens:
-            try:
-                supabase.auth.set_session(
-                    access_token=auth_tokens.access_token,
-                    refresh_token=auth_tokens.refresh_token
-                )
-            except Exception as e:
-                logging.error(f"Error setting session: {str(e)}")
-                raise
-
-        # Get total count
-        count_response = supabase.table(HISTORY_TABLE)\
-            .select('id', count='exact')\
-            .eq('user_id', user_id)\
-            .execute()
-
-        total = count_response.count if hasattr(count_response, 'count') else 0
-
-        # Get paginated data
-        data_response = supabase.table(HISTORY_TABLE)\
-            .select('*')\
-            .eq('user_id', user_id)\
+        columns = ','.join(SUMMARY_FIELDS) if summary else '*'
+        query = supabase.table(HISTORY_TABLE)\
+            .select(columns, count=None if count == 'none' else count)\
+            .eq('user_id', user_id)
+
+        if position:
+            created_at, history_id = position
+            query = query.or_(
+                f'created_at.lt."{created_at}",'
+                f'and(created_at.eq."{created_at}",id.lt.{history_id})'
+            )
+
+        query = query\
             .order('created_at', desc=True)\
-            .limit(limit)\
-            .offset(offset)\
-            .execute()
+            .order('id', desc=True)
+
+        # Fetch one extra row to know whether there is a next page
+        if position:
+            query = query.limit(limit + 1)
+        else:
+            query = query.range(offset, offset + limit)
+
+        data_response = await execute(query, auth_tokens=auth_tokens)
+
+        rows = data_response.data or []
+        has_more = len(rows) > limit
+        rows = rows[:limit]
 
         return {
-            "data": data_response.data,
-            "total": total
+            "data": rows,
+            "total": data_response.count if count != 'none' else None,
+            "next_cursor": encode_history_cursor(rows[-1]) if has_more and rows else None
         }
 
     except Exception as e:
@@ -153,89 +248,104 @@ async def get_run_history(
         raise Exception(f"Failed to get run history: {str(e)}")
 
 
+# Columns of run_history that detail callers may select
+DETAIL_FIELDS = (
+    'id', 'user_id', 'task', 'result', 'error',
+    'progress', 'created_at', 'live_view_url', 'events_persisted'
+)
+
+# Related payloads that can be embedded in a detail response,
+# mapped to the (table, columns) they come from
+DETAIL_INCLUDES = {
+    'gif': (GIF_TABLE, ('gif_content', 'gif_path', 'gif_size', 'gif_etag')),
+    'document': (DOCUMENT_TABLE, ('document_content',)),
+}
+
+
+def build_detail_select(
+    fields: Optional[Sequence[str]] = None,
+    include: Optional[Sequence[str]] = None
+) -> str:
+    """Build the PostgREST select string for a run detail query.
+
+    Raises ValueError for unknown field or include names.
+    """
+    fields = list(DETAIL_FIELDS) if fields is None else list(fields)
+    include = list(DETAIL_INCLUDES) if include is None else list(include)
+
+    unknown = [f for f in fields if f not in DETAIL_FIELDS] + \
+        [i for i in include if i not in DETAIL_INCLUDES]
+    if unknown:
+        raise ValueError(f"Unknown detail fields: {', '.join(unknown)}")
+
+    # The id is always returned so callers can correlate responses
+    if 'id' not in fields:
+        fields.insert(0, 'id')
+
+    columns = list(dict.fromkeys(fields))
+    for name in dict.fromkeys(include):
+        table, embedded = DETAIL_INCLUDES[name]
+        columns.append(f"{table}({','.join(embedded)})")
+    return ",".join(columns)
+
+
 async def get_run_details(
     user_id: str,
     history_id: str,
-    auth_tokens: Optional[AuthTokens] = None
+    auth_tokens: Optional[AuthTokens] = None,
+    fields: Optional[Sequence[str]] = None,
+    include: Optional[Sequence[str]] = None
 ) -> Optional[Dict]:
-    """Get detailed run information including GIF for a specific user."""
+    """Get detailed run information including GIF for a specific user.
+
+    The history row and its GIF and document are fetched in one PostgREST
+    request using embedded resources. `fields` limits the run_history
+    columns returned (default: all) and `include` limits the embedded
+    payloads (default: all of DETAIL_INCLUDES), so callers that don't need
+    the GIF, document or progress never transfer them.
+    """
     try:
-        # Set auth context if tokens are provided
-        if auth_tokens:
-            try:
-                supabase.auth.set_session(
-                    access_token=auth_tokens.access_token,
-                    refresh_token=auth_tokens.refresh_token
-                )
-            except Exception as e:
-                logging.error(f"Error setting session: {str(e)}")
-                raise
-
-        # Get the run history
-        try:
-            logging.info(f"Fetching history for ID: {history_id}")
-            history_response = supabase.table(HISTORY_TABLE)\
-                .select('*')\
-                .eq('id', history_id)\
-                .eq('user_id', user_id)\
-                .single()\
-                .execute()
-
-            if not history_response.data:
-                logging.warning(f"No history found for ID: {history_id}")
-                return None
-
-            history = history_response.data
-
-            # Get the associated GIF if it exists
-            try:
-                logging.info(f"Fetching GIF for history ID: {history_id}")
-                gif_response = supabase.table(GIF_TABLE)\
-                    .select('gif_content')\
-                    .eq('history_id', history_id)\
-                    .single()\
-                    .execute()
-
-                if gif_response.data:
-                    logging.info(
-                        f"Found GIF content of length: {len(gif_response.data['gif_content'])}")
-                    history['gif_content'] = gif_response.data['gif_content']
-                else:
-                    logging.warning(
-                        f"No GIF content found for history ID: {history_id}")
-                    history['gif_content'] = None
-            except Exception as e:
-                logging.error(f"Error fetching GIF content: {str(e)}")
-                history['gif_content'] = None
-
-            # Get the associated document if it exists
-            try:
-                logging.info(f"Fetching document for history ID: {history_id}")
-                document_response = supabase.table(DOCUMENT_TABLE)\
-                    .select('document_content')\
-                    .eq('history_id', history_id)\
-                    .single()\
-                    .execute()
-
-                if document_response.data:
-                    logging.info(
-                        f"Found document content of length: {len(document_response.data['document_content'])}")
-                    history['document_content'] = document_response.data['document_content']
-                else:
-                    logging.warning(
-                        f"No document content found for history ID: {history_id}")
-                    history['document_content'] = None
-            except Exception as e:
-                logging.error(f"Error fetching document content: {str(e)}")
-                history['document_content'] = None
-
-            return history
-
-        except Exception as e:
-            if 'no rows' in str(e).lower():
-                return None
-            raise
+        select = build_detail_select(fields, include)
+
+        logging.info(f"Fetching history for ID: {history_id}")
+        history_response = await execute(
+            supabase.table(HISTORY_TABLE)
+            .select(select)
+            .eq('id', history_id)
+            .eq('user_id', user_id)
+            .limit(1),
+            auth_tokens=auth_tokens
+        )
 
+        if not history_response.data:
+            logging.warning(f"No history found for ID: {history_id}")
+            return None
+
+        history = history_response.data[0]
+
+        # Flatten embedded rows into the flat shape callers expect
+        for name in dict.fromkeys(include if include is not None else DETAIL_INCLUDES):
+            table, embedded = DETAIL_INCLUDES[name]
+            rows = history.pop(table, None) or []
+            if isinstance(rows, dict):
+                rows = [rows]
+            for column in embedded:
+                history[column] = rows[0].get(column) if rows else None
+
+            if name == 'gif':
+                # GIFs in the object store are returned as a reference;
+                # gif_content is only set for legacy inline base64 rows
+                path = history.pop('gif_path')
+                size = history.pop('gif_size')
+                etag = history.pop('gif_etag')
+                history['gif_object'] = {
+                    'key': path, 'size': size, 'etag': etag
+                } if path else None
+
+        return history
+
+    except ValueError:
+        raise
     except Exception as e:
         logging.error(f"Error getting run details: {str(e)}")
         if hasattr(e, 'response'):
@@ -244,6 +354,21 @@ async def get_run_details(
         raise Exception(f"Failed to get run details: {str(e)}")
 
 
+async def get_run_fields(
+    user_id: str,
+    history_id: str,
+    fields: Sequence[str],
+    auth_tokens: Optional[AuthTokens] = None
+) -> Optional[Dict]:
+    """Get just the given run_history columns of a run, or None if not found.
+
+    Nothing is embedded, so the GIF, document and (unless asked for)
+    progress never leave the database.
+    """
+    return await get_run_details(
+        user_id, history_id, auth_tokens=auth_tokens, fields=fields, include=())
+
+
 async def delete_run_history(
     user_id: str,
     history_id: str,
@@ -251,23 +376,21 @@ async def delete_run_history(
 ) -> bool:
     """Delete a run history entry and its associated GIF."""
     try:
-        # Set auth context if tokens are provided
-        if auth_tokens:
-            try:
-                supabase.auth.set_session(
-                    access_token=auth_tokens.access_token,
-                    refresh_token=auth_tokens.refresh_token
-                )
-            except Exception as e:
-                logging.error(f"Error setting session: {str(e)}")
-                raise
-
         # The GIF and document will be automatically deleted due to the ON DELETE CASCADE
-        response = supabase.table(HISTORY_TABLE)\
-            .delete()\
-            .eq('id', history_id)\
-            .eq('user_id', user_id)\
-            .execute()
+        response = await execute(
+            supabase.table(HISTORY_TABLE)
+            .delete()
+            .eq('id', history_id)
+            .eq('user_id', user_id),
+            auth_tokens=auth_tokens
+        )
+
+        # run_events has no foreign key (chunks are written before the
+        # history row exists), so its rows are removed separately
+        try:
+            await delete_run_events(user_id, history_id, auth_tokens)
+        except Exception as e:
+            logging.warning(f"Failed to delete progress events of run {history_id}: {str(e)}")
 
         return bool(response.data)
 
@@ -283,69 +406,24 @@ async def update_history_with_document(
     auth_tokens: Optional[AuthTokens] = None,
     result: Optional[str] = None
 ) -> bool:
-    """Update an existing history entry with document content."""
-    try:
-        # Set auth context if tokens are provided
-        if auth_tokens:
-            try:
-                supabase.auth.set_session(
-                    access_token=auth_tokens.access_token,
-                    refresh_token=auth_tokens.refresh_token
-                )
-            except Exception as e:
-                logging.error(f"Error setting session: {str(e)}")
-                raise
-
-        # Create update data with document content
-        update_data = {}
-
-        # Save document to document table
-        document_data = {
-            'history_id': history_id,
-            'document_content': document_content,
-            'created_at': datetime.utcnow().isoformat()
-        }
+    """Upsert a run's document and, if given, replace its result.
 
-        # First check if document exists
-        try:
-            existing_doc = supabase.table(DOCUMENT_TABLE)\
-                .select('id')\
-                .eq('history_id', history_id)\
-                .single()\
-                .execute()
-
-            if existing_doc.data:
-                # Update existing document
-                doc_response = supabase.table(DOCUMENT_TABLE)\
-                    .update({'document_content': document_content})\
-                    .eq('history_id', history_id)\
-                    .execute()
-            else:
-                # Create new document
-                doc_response = supabase.table(DOCUMENT_TABLE)\
-                    .insert(document_data)\
-                    .execute()
-        except Exception as doc_error:
-            # Document doesn't exist, create it
-            if 'no rows' in str(doc_error).lower():
-                doc_response = supabase.table(DOCUMENT_TABLE)\
-                    .insert(document_data)\
-                    .execute()
-            else:
-                raise doc_error
-
-        # If result is provided, update the history entry
-        if result:
-            history_response = supabase.table(HISTORY_TABLE)\
-                .update({'result': result})\
-                .eq('id', history_id)\
-                .eq('user_id', user_id)\
-                .execute()
-
-            if not history_response.data:
-                return False
-
-        return True
+    Both happen in one transaction in the save_run_document function (a
+    single round trip), so overlapping generations for the same run never
+    leave two documents or a result from one and a document from the other.
+    Returns False if the run isn't found or the save fails.
+    """
+    try:
+        response = await execute(
+            supabase.rpc('save_run_document', {
+                'p_history_id': history_id,
+                'p_user_id': user_id,
+                'p_document_content': document_content,
+                'p_result': result
+            }),
+            auth_tokens=auth_tokens
+        )
+        return bool(response.data)
     except Exception as e:
         logging.error(f"Error updating history with document: {str(e)}")
         return False
@@ -0,0 +1,303 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import orjson
+
+from app.config.supabase import service_supabase
+from app.services.cache_service import response_cache, LIST_TAG
+from app.services.history_service import save_history_records
+from app.utils.auth import AuthTokens, token_expires_at
+from app.utils.metrics import counter, gauge, histogram
+from app.utils.retry import backoff_delay
+
+# Keep this on persistent storage (docker-compose mounts a volume at
+# /code/data); a journal lost with its container loses the saves it holds
+HISTORY_JOURNAL_PATH = os.getenv("HISTORY_JOURNAL_PATH", "data/history_journal.sqlite3")
+# Runs saved per database round trip
+HISTORY_WRITE_BATCH_SIZE = int(os.getenv("HISTORY_WRITE_BATCH_SIZE", "20"))
+# Retry backoff (full jitter) between failed attempts, in seconds
+HISTORY_WRITE_RETRY_BASE_DELAY = float(os.getenv("HISTORY_WRITE_RETRY_BASE_DELAY", "1"))
+HISTORY_WRITE_RETRY_MAX_DELAY = float(os.getenv("HISTORY_WRITE_RETRY_MAX_DELAY", "300"))
+# Attempts before a save is given up on (it stays in the journal, marked failed)
+HISTORY_WRITE_MAX_ATTEMPTS = int(os.getenv("HISTORY_WRITE_MAX_ATTEMPTS", "20"))
+# Seconds pending saves get to land on shutdown; the rest wait for the next start
+HISTORY_WRITE_DRAIN_TIMEOUT = float(os.getenv("HISTORY_WRITE_DRAIN_TIMEOUT", "30"))
+
+# A claimed save is owned by one process for this long; if that process dies
+# another one picks it up afterwards
+_LEASE_SECONDS = 60
+# How often the journal is checked for saves journaled by other processes
+_IDLE_POLL_INTERVAL = 5.0
+# A caller's token this close to expiry is no longer used for a save
+_TOKEN_EXPIRY_MARGIN = 60
+
+
+class HistoryWriteQueue:
+    """Write-behind queue for run history saves, journaled in SQLite.
+
+    `enqueue` returns once the save is on local disk; a background task
+    then writes pending saves to Supabase in batches (one upsert per table
+    for all the runs sharing a caller's token), retrying failures with
+    backoff. A failed batch is retried one save at a time, so one bad row
+    can't hold back the others. Saves are upserts keyed on the run id, so a
+    save that is retried after it actually landed does no harm. On
+    shutdown pending saves get HISTORY_WRITE_DRAIN_TIMEOUT seconds;
+    whatever is left is picked up from the journal when the service starts
+    again.
+
+    The journal is shared by the worker processes on a host; each save is
+    leased to one process at a time. Saves run with the caller's access
+    token while it is valid, then with the service-role client (the rows
+    carry their user_id), so a save outlasting its token still lands.
+    Without SUPABASE_SERVICE_ROLE_KEY such saves are given up on.
+    """
+
+    def __init__(self, path: str = HISTORY_JOURNAL_PATH, batch_size: int = HISTORY_WRITE_BATCH_SIZE):
+        self.path = path
+        self.batch_size = max(1, batch_size)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._draining = False
+
+        conn = self._connect()
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS pending_writes (
+                run_id TEXT PRIMARY KEY,
+                user_id TEXT NOT NULL,
+                access_token TEXT,
+                refresh_token TEXT,
+                record TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                lease_until REAL NOT NULL DEFAULT 0,
+                failed INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_pending_writes_due
+                ON pending_writes(failed, next_attempt_at);
+        """)
+        # The journal holds access tokens
+        os.chmod(self.path, 0o600)
+
+        self.backlog = gauge("history_write_backlog", "Run saves journaled and not yet written")
+        self.oldest_seconds = gauge("history_write_oldest_seconds", "Age of the oldest pending run save")
+        self.failed_saves = gauge("history_write_failed", "Run saves given up on after HISTORY_WRITE_MAX_ATTEMPTS")
+        self.written = counter("history_writes_total", "Run saves written to the database")
+        self.attempt_failures = counter("history_write_attempt_failures_total", "Failed attempts to write run saves")
+        self.batch_sizes = histogram(
+            "history_write_batch_size", "Run saves per database batch",
+            buckets=(1, 2, 5, 10, 20, 50, 100))
+        self.write_seconds = histogram("history_write_seconds", "Time to write a batch of run saves")
+
+    def _connect(self) -> sqlite3.Connection:
+        # sqlite3 connections must not be shared between threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # A save is only acknowledged once it survives a power loss
+            conn.execute("PRAGMA synchronous=FULL")
+            self._local.conn = conn
+        return conn
+
+    async def start(self) -> None:
+        if service_supabase is None:
+            logging.warning(
+                "SUPABASE_SERVICE_ROLE_KEY is not set; run saves still pending when "
+                "their caller's token expires will be given up on")
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._draining = False
+            self._task = asyncio.create_task(self._run())
+
+    async def enqueue(self, record: Dict, auth_tokens: Optional[AuthTokens] = None) -> str:
+        """Journal a record from build_history_record; returns its run id."""
+        history = record['history']
+        await asyncio.to_thread(self._journal, history['id'], history['user_id'], record, auth_tokens)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        else:
+            logging.warning(f"History writer not started; run {history['id']} stays journaled")
+        await self._update_gauges()
+        return history['id']
+
+    async def drain(self, timeout: float = HISTORY_WRITE_DRAIN_TIMEOUT) -> None:
+        """Write pending saves (ignoring backoff) for up to `timeout` seconds."""
+        if self._task is None:
+            return
+        self._draining = True
+        # Skip the remaining backoff once; saves failing again are left for later
+        await asyncio.to_thread(self._make_due)
+        self._wakeup.set()
+        try:
+            await asyncio.wait_for(asyncio.shield(self._task), timeout)
+        except asyncio.TimeoutError:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+        remaining = await asyncio.to_thread(self._counts)
+        if remaining[0]:
+            logging.warning(
+                f"{remaining[0]} run saves still pending at shutdown; they stay in {self.path}")
+
+    async def _run(self) -> None:
+        while True:
+            # Cleared before looking, so an enqueue from now on wakes the wait
+            self._wakeup.clear()
+            try:
+                jobs = await asyncio.to_thread(self._claim)
+            except sqlite3.Error as e:
+                logging.error(f"History journal read failed: {str(e)}")
+                jobs = []
+
+            if jobs:
+                await self._write(jobs)
+                await self._update_gauges()
+                continue
+            if self._draining:
+                return
+
+            delay = await asyncio.to_thread(self._next_due_in)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), min(delay, _IDLE_POLL_INTERVAL))
+            except asyncio.TimeoutError:
+                pass
+
+    async def _write(self, jobs: List[Tuple]) -> None:
+        # One batch per caller token (every row must pass that caller's RLS)
+        # or for the service-role client; retried saves go alone
+        groups: Dict[Tuple, List[Tuple]] = defaultdict(list)
+        for job in jobs:
+            access_token = job[2] if self._token_valid(job[2]) else None
+            if access_token is None and service_supabase is None:
+                await self._failed(job, RuntimeError(
+                    "access token expired and SUPABASE_SERVICE_ROLE_KEY is not set"), give_up=True)
+                continue
+            key = (access_token, job[3] if access_token else None)
+            groups[key + ((job[0],) if job[5] else ())].append(job)
+
+        for (access_token, refresh_token, *_), group in groups.items():
+            tokens = AuthTokens(access_token, refresh_token) if access_token else None
+            try:
+                await self._save(group, tokens)
+            except Exception as e:
+                for job in group:
+                    await self._failed(job, e)
+
+    @staticmethod
+    def _token_valid(access_token: Optional[str]) -> bool:
+        expires_at = token_expires_at(access_token) if access_token else None
+        return expires_at is not None and expires_at - _TOKEN_EXPIRY_MARGIN > time.time()
+
+    async def _save(self, jobs: List[Tuple], tokens: Optional[AuthTokens]) -> None:
+        start = time.monotonic()
+        records = [orjson.loads(job[4]) for job in jobs]
+        if tokens is None:
+            # Bypasses RLS: only write rows of the user that journaled them
+            for job, record in zip(jobs, records):
+                if record['history']['user_id'] != job[1]:
+                    raise ValueError(f"Run {job[0]} does not belong to user {job[1]}")
+        await save_history_records(
+            records, auth_tokens=tokens, client=None if tokens else service_supabase)
+        self.write_seconds.observe(time.monotonic() - start)
+        self.batch_sizes.observe(len(jobs))
+        self.written.inc(len(jobs))
+
+        await asyncio.to_thread(self._remove, [job[0] for job in jobs])
+        for user_id in {job[1] for job in jobs}:
+            await response_cache.invalidate(user_id, LIST_TAG)
+
+    async def _failed(self, job: Tuple, error: Exception, give_up: bool = False) -> None:
+        run_id, attempts = job[0], job[5] + 1
+        self.attempt_failures.inc()
+        give_up = give_up or attempts >= HISTORY_WRITE_MAX_ATTEMPTS
+        delay = backoff_delay(
+            attempts - 1, HISTORY_WRITE_RETRY_BASE_DELAY, HISTORY_WRITE_RETRY_MAX_DELAY)
+        if give_up:
+            logging.error(
+                f"Giving up saving run {run_id} after {attempts} attempts: {str(error)}")
+        else:
+            logging.warning(
+                f"Saving run {run_id} failed (attempt {attempts}), retrying in {delay:.1f}s: {str(error)}")
+        await asyncio.to_thread(self._reschedule, run_id, attempts, time.time() + delay, give_up, str(error))
+
+    async def _update_gauges(self) -> None:
+        try:
+            pending, failed, oldest = await asyncio.to_thread(self._counts)
+        except sqlite3.Error:
+            return
+        self.backlog.set(pending)
+        self.failed_saves.set(failed)
+        self.oldest_seconds.set(time.time() - oldest if oldest else 0)
+
+    def _journal(self, run_id: str, user_id: str, record: Dict, auth_tokens: Optional[AuthTokens]) -> None:
+        now = time.time()
+        self._connect().execute(
+            "INSERT OR REPLACE INTO pending_writes (run_id, user_id, access_token, refresh_token, "
+            "record, next_attempt_at, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (run_id, user_id,
+             auth_tokens.access_token if auth_tokens else None,
+             auth_tokens.refresh_token if auth_tokens else None,
+             orjson.dumps(record).decode('utf-8'), now, now)
+        )
+
+    def _claim(self) -> List[Tuple]:
+        """Lease up to batch_size due saves to this process."""
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        with conn:
+            jobs = conn.execute(
+                "SELECT run_id, user_id, access_token, refresh_token, record, attempts "
+                "FROM pending_writes WHERE failed = 0 AND next_attempt_at <= ? AND lease_until <= ? "
+                "ORDER BY next_attempt_at LIMIT ?", (now, now, self.batch_size)
+            ).fetchall()
+            conn.executemany(
+                "UPDATE pending_writes SET lease_until = ? WHERE run_id = ?",
+                [(now + _LEASE_SECONDS, job[0]) for job in jobs])
+        return jobs
+
+    def _make_due(self) -> None:
+        self._connect().execute(
+            "UPDATE pending_writes SET next_attempt_at = ? WHERE failed = 0 AND next_attempt_at > ?",
+            (time.time(), time.time()))
+
+    def _remove(self, run_ids: List[str]) -> None:
+        self._connect().executemany(
+            "DELETE FROM pending_writes WHERE run_id = ?", [(run_id,) for run_id in run_ids])
+
+    def _reschedule(self, run_id: str, attempts: int, next_attempt_at: float, failed: bool, error: str) -> None:
+        self._connect().execute(
+            "UPDATE pending_writes SET attempts = ?, next_attempt_at = ?, lease_until = 0, "
+            "failed = ?, last_error = ? WHERE run_id = ?",
+            (attempts, next_attempt_at, int(failed), error, run_id))
+
+    def _next_due_in(self) -> float:
+        row = self._connect().execute(
+            "SELECT MIN(MAX(next_attempt_at, lease_until)) FROM pending_writes WHERE failed = 0"
+        ).fetchone()
+        if row[0] is None:
+            return _IDLE_POLL_INTERVAL
+        return max(0.0, row[0] - time.time())
+
+    def _counts(self) -> Tuple[int, int, Optional[float]]:
+        row = self._connect().execute(
+            "SELECT COALESCE(SUM(failed = 0), 0), COALESCE(SUM(failed), 0), "
+            "MIN(CASE WHEN failed = 0 THEN created_at END) FROM pending_writes"
+        ).fetchone()
+        return int(row[0]), int(row[1]), row[2]
+
+
+history_writer = HistoryWriteQueue()
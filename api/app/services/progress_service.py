@@ -0,0 +1,243 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from browser_use import Agent
+from browser_use.agent.views import AgentHistory, AgentHistoryList
+
+from app.utils.metrics import histogram
+
+# Flush buffered progress events once this many are pending...
+PROGRESS_FLUSH_MAX_EVENTS = int(os.getenv("PROGRESS_FLUSH_MAX_EVENTS", "10"))
+# ...or once the oldest pending event has waited this long, whichever is first
+PROGRESS_FLUSH_MAX_LATENCY_MS = int(
+    os.getenv("PROGRESS_FLUSH_MAX_LATENCY_MS", "500"))
+
+# Number of item digests remembered per stream for deduplication
+PROGRESS_DEDUP_MAX_ITEMS = int(os.getenv("PROGRESS_DEDUP_MAX_ITEMS", "4096"))
+
+time_to_first_event = histogram(
+    "progress_time_to_first_event_seconds",
+    "Time from agent start until the first progress event is sent")
+event_delivery_lag = histogram(
+    "progress_event_delivery_lag_seconds",
+    "Time a progress event waits between the agent producing it and it being sent")
+
+
+# Order in which per-step updates are emitted, matching the event types the
+# frontend already understands ("url", "action", "thought", ...).
+PROGRESS_KEYS = ("urls", "actions", "thoughts", "errors", "results", "content")
+
+# What a finished step adds; its thoughts and actions were already sent from
+# the model output, before the actions ran
+HISTORY_KEYS = ("urls", "errors", "results", "content")
+
+
+def _step_updates(item: AgentHistory, keys=HISTORY_KEYS):
+    """Yield (key, value) pairs for a single history item.
+
+    The item is wrapped in a one-element AgentHistoryList so we reuse the
+    library's own accessors instead of re-implementing their field logic.
+    """
+    step = AgentHistoryList.model_construct(history=[item])
+    accessors = {
+        "urls": step.urls,
+        "actions": step.action_names,
+        "thoughts": step.model_thoughts,
+        "errors": step.errors,
+        "results": step.action_results,
+        "content": step.extracted_content,
+    }
+    for key in PROGRESS_KEYS:
+        if key not in keys:
+            continue
+        for value in accessors[key]():
+            if value is None:
+                continue
+            yield key, value
+
+
+def _model_output_updates(model_output):
+    """Yield ("thoughts" / "actions", value) pairs for a step's model output."""
+    if model_output is None:
+        return
+    if model_output.current_state is not None:
+        yield "thoughts", model_output.current_state
+    for action in model_output.action or []:
+        if action is None:
+            continue
+        names = list(action.model_dump(exclude_none=True))
+        if names:
+            yield "actions", names[0]
+
+
+class AgentProgressTracker:
+    """Push agent progress onto an asyncio.Queue from browser-use hooks.
+
+    Pass `on_step` / `on_done` as the Agent's `register_new_step_callback` /
+    `register_done_callback`, then `bind()` the agent. browser-use calls the
+    step hook as soon as the model has decided a step, so its thoughts and
+    actions are sent right away; the step's URL, results, extracted content
+    and errors are sent the moment its history item is appended. Work is
+    linear in the number of steps and nothing runs while the agent is idle.
+    Updates are queued as (key, value, produced_at) with a monotonic
+    timestamp; a `None` sentinel is queued once the run is over.
+    """
+
+    def __init__(self):
+        self.queue: "asyncio.Queue[Optional[Tuple[str, Any, float]]]" = asyncio.Queue()
+        self._agent: Optional[Agent] = None
+        self._cursor = 0
+        self._closed = False
+
+    def bind(self, agent: Agent) -> None:
+        self._agent = agent
+        # browser-use appends each step's history item here, at the end of
+        # the step; wrap it so the item is reported right then
+        make_history_item = agent._make_history_item
+
+        def reporting_make_history_item(*args, **kwargs):
+            try:
+                return make_history_item(*args, **kwargs)
+            finally:
+                self._drain()
+
+        agent._make_history_item = reporting_make_history_item
+
+    def on_step(self, state, model_output, step_number: int) -> None:
+        """New-step hook: the model has chosen this step's actions."""
+        if self._closed:
+            return
+        try:
+            now = time.monotonic()
+            for key, value in _model_output_updates(model_output):
+                self.queue.put_nowait((key, value, now))
+        except Exception as e:
+            # Never let progress reporting break the agent run itself
+            logging.error(f"Error collecting agent progress: {str(e)}")
+
+    def on_done(self, history: AgentHistoryList) -> None:
+        self._drain()
+
+    def close(self, *_) -> None:
+        """Flush any remaining history and wake the consumer.
+
+        Accepts and ignores extra arguments so it can be used directly as an
+        `asyncio.Task.add_done_callback` callback.
+        """
+        if self._closed:
+            return
+        self._drain()
+        self._closed = True
+        self.queue.put_nowait(None)
+
+    def _drain(self) -> None:
+        if self._agent is None or self._closed:
+            return
+        try:
+            items = self._agent.history.history
+            now = time.monotonic()
+            for item in items[self._cursor:]:
+                for key, value in _step_updates(item):
+                    self.queue.put_nowait((key, value, now))
+            self._cursor = len(items)
+        except Exception as e:
+            # Never let progress reporting break the agent run itself
+            logging.error(f"Error collecting agent progress: {str(e)}")
+
+
+class ProgressDeduplicator:
+    """Remember which progress items were already sent, in bounded memory.
+
+    Only a 16-byte BLAKE2b digest of each item is kept (never the item text,
+    which can be tens of KB of extracted page content), and at most
+    `max_items` digests are retained, oldest first out.
+    """
+
+    def __init__(self, max_items: int = PROGRESS_DEDUP_MAX_ITEMS):
+        self.max_items = max(1, max_items)
+        self._seen: "OrderedDict[bytes, None]" = OrderedDict()
+
+    def is_new(self, key: str, serialized: str) -> bool:
+        """Record the item and return True if it was not seen before."""
+        digest = hashlib.blake2b(
+            serialized.encode('utf-8', 'surrogatepass'),
+            digest_size=16,
+            person=key.encode('utf-8')[:16]
+        ).digest()
+
+        if digest in self._seen:
+            self._seen.move_to_end(digest)
+            return False
+
+        self._seen[digest] = None
+        if len(self._seen) > self.max_items:
+            self._seen.popitem(last=False)
+        return True
+
+
+class ProgressBatcher:
+    """Buffer progress events and decide when to flush them.
+
+    A batch is flushed as soon as it holds `max_events` events or its oldest
+    event is `max_latency` seconds old, which keeps the number of writes low
+    without leaving a slow agent's UI empty for long stretches.
+    """
+
+    def __init__(
+        self,
+        max_events: int = PROGRESS_FLUSH_MAX_EVENTS,
+        max_latency: float = PROGRESS_FLUSH_MAX_LATENCY_MS / 1000
+    ):
+        self.max_events = max(1, max_events)
+        self.max_latency = max(0.0, max_latency)
+        self._pending: List[Tuple[Dict, float]] = []
+        self._started_at = time.monotonic()
+        self._first_sent = False
+
+    def add(self, event: Dict, produced_at: Optional[float] = None) -> bool:
+        """Buffer an event; returns True when the batch should be flushed now."""
+        self._pending.append((event, produced_at or time.monotonic()))
+        return len(self._pending) >= self.max_events
+
+    def timeout(self) -> Optional[float]:
+        """Seconds until the pending batch is due, or None if nothing is pending."""
+        if not self._pending:
+            return None
+        deadline = self._pending[0][1] + self.max_latency
+        return max(0.0, deadline - time.monotonic())
+
+    def flush(self) -> List[Dict]:
+        """Return the pending events and record delivery metrics for them."""
+        if not self._pending:
+            return []
+
+        now = time.monotonic()
+        if not self._first_sent:
+            time_to_first_event.observe(now - self._started_at)
+            self._first_sent = True
+        for _, produced_at in self._pending:
+            event_delivery_lag.observe(now - produced_at)
+
+        events = [event for event, _ in self._pending]
+        self._pending = []
+        return events
+
+
+async def next_update(tracker: AgentProgressTracker, get_task: Optional[asyncio.Task], timeout: Optional[float]):
+    """Wait up to `timeout` seconds for the tracker's next update.
+
+    Returns (done, update, pending_get). The pending `queue.get()` task is
+    handed back on timeout and reused by the next call, so an update that
+    arrives exactly at the deadline is never dropped by a cancellation.
+    """
+    if get_task is None:
+        get_task = asyncio.ensure_future(tracker.queue.get())
+    done, _ = await asyncio.wait({get_task}, timeout=timeout)
+    if not done:
+        return False, None, get_task
+    return True, get_task.result(), None
@@ -0,0 +1,16 @@
+from browser_use import Agent
+from browser_use.agent.views import AgentHistoryList
+
+
+def render_history_gif(task: str, history: AgentHistoryList, output_path: str) -> None:
+    """Render a run's recording GIF from its task and history alone.
+
+    A live Agent holds the browser and LLM clients and can't be pickled, so
+    this rebuilds just what `Agent.create_history_gif` reads (the task and
+    the history). That lets GIF encoding run in a worker process as well as
+    a thread.
+    """
+    shell = Agent.__new__(Agent)
+    shell.task = task
+    shell.history = history
+    shell.create_history_gif(output_path=output_path)
@@ -0,0 +1,167 @@
+import asyncio
+import bisect
+import logging
+import os
+import time
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import orjson
+
+from app.utils.metrics import counter, gauge
+
+# Seconds a finished run's event log stays attachable
+RUN_LOG_RETENTION = float(os.getenv("RUN_LOG_RETENTION", "600"))
+
+# Events streamed to viewers but not saved to run_events: queue position
+# updates and document deltas
+TRANSIENT_EVENT_TYPES = frozenset({"queued", "document_delta", "document_reset"})
+# Marks other events that are not saved (failures reported from outside the
+# run, like a crashed worker), so they are numbered as transient too
+UNSAVED_KEY = "_unsaved"
+
+# (index of the last saved event, transient events since it)
+EventId = Tuple[int, int]
+
+
+def unsaved(event: Dict) -> Dict:
+    """Copy of `event` marked as not saved to run_events."""
+    return {**event, UNSAVED_KEY: True}
+
+
+def format_event_id(event_id: EventId) -> str:
+    index, transient = event_id
+    return f"{index}:{transient}" if transient else str(index)
+
+
+def parse_event_id(value: str) -> EventId:
+    """Parse an id from format_event_id; raises ValueError."""
+    index, _, transient = value.partition(":")
+    return int(index), int(transient or 0)
+
+
+class RunEventLog:
+    """Append-only event log of one run, readable by any number of viewers.
+
+    Events are serialized once on append. Each is identified by its index
+    among the run's saved events, the same index it has in run_events, so
+    a viewer can resume from the id of the last event it saw on any worker;
+    transient events (document deltas) are numbered after the saved event
+    they follow. A viewer attaching gets everything after its id, then
+    follows the log live until the run closes it.
+    """
+
+    def __init__(self, run_id: str, user_id: str):
+        self.run_id = run_id
+        self.user_id = user_id
+        self.created_at = time.monotonic()
+        self.closed = False
+        self._ids: List[EventId] = []
+        self._events: List[bytes] = []
+        self._changed = asyncio.Condition()
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+    async def append(self, event: Dict) -> EventId:
+        async with self._changed:
+            index, transient = self._ids[-1] if self._ids else (-1, 0)
+            if event.pop(UNSAVED_KEY, False) or event.get("type") in TRANSIENT_EVENT_TYPES:
+                event_id = (index, transient + 1)
+            else:
+                event_id = (index + 1, 0)
+            self._ids.append(event_id)
+            self._events.append(orjson.dumps(event))
+            self._changed.notify_all()
+            return event_id
+
+    async def close(self) -> None:
+        async with self._changed:
+            self.closed = True
+            self._changed.notify_all()
+
+    async def follow(self, after: EventId = (-1, 0)) -> AsyncIterator[Tuple[EventId, bytes]]:
+        """Yield (id, serialized event) for every event after `after`, live."""
+        cursor = bisect.bisect_right(self._ids, after)
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(
+                    lambda: cursor < len(self._events) or self.closed)
+                batch = self._events[cursor:]
+                closed = self.closed
+            for data in batch:
+                yield self._ids[cursor], data
+                cursor += 1
+            if closed and cursor >= len(self._events):
+                return
+
+
+class RunLogRegistry:
+    """Event logs of the runs executing (or recently finished) in this worker.
+
+    Also holds the background task executing each run, so runs keep going
+    when the client that started them disconnects. Runs of other workers
+    are followed through run_events instead (see follow_run_events).
+    """
+
+    def __init__(self, retention: float = RUN_LOG_RETENTION):
+        self.retention = retention
+        self._logs: Dict[str, RunEventLog] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+        self.runs_started = counter("runs_started_total", "Background runs started")
+        self.background_runs = gauge("runs_background", "Background runs executing")
+        self.viewers = gauge("run_log_viewers", "Clients following run event logs")
+
+    def create(self, run_id: str, user_id: str) -> RunEventLog:
+        run_log = RunEventLog(run_id, user_id)
+        self._logs[run_id] = run_log
+        return run_log
+
+    def get(self, run_id: str) -> Optional[RunEventLog]:
+        return self._logs.get(run_id)
+
+    def start(self, run_log: RunEventLog, events: AsyncIterator[Dict]) -> asyncio.Task:
+        """Execute a run in the background, appending its events to its log."""
+        task = asyncio.create_task(self._execute(run_log, events))
+        self._tasks[run_log.run_id] = task
+        self.runs_started.inc()
+        self.background_runs.set(len(self._tasks))
+        return task
+
+    async def drain(self, timeout: float) -> None:
+        """Wait up to `timeout` seconds for background runs to finish."""
+        tasks = list(self._tasks.values())
+        if not tasks:
+            return
+        logging.info(f"Waiting for {len(tasks)} background runs to finish")
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            logging.warning(f"Cancelled {len(pending)} runs that did not finish in time")
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    async def follow(self, run_log: RunEventLog, after: EventId = (-1, 0)) -> AsyncIterator[Tuple[EventId, bytes]]:
+        self.viewers.inc()
+        try:
+            async for item in run_log.follow(after):
+                yield item
+        finally:
+            self.viewers.dec()
+
+    async def _execute(self, run_log: RunEventLog, events: AsyncIterator[Dict]) -> None:
+        try:
+            async for event in events:
+                await run_log.append(event)
+        except Exception as e:
+            logging.error(f"Background run {run_log.run_id} failed: {str(e)}")
+            await run_log.append(unsaved({"type": "error", "message": f"Error: {str(e)}"}))
+        finally:
+            await run_log.close()
+            self._tasks.pop(run_log.run_id, None)
+            self.background_runs.set(len(self._tasks))
+            asyncio.get_running_loop().call_later(
+                self.retention, self._logs.pop, run_log.run_id, None)
+
+
+run_logs = RunLogRegistry()
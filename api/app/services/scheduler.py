@@ -0,0 +1,186 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Optional
+
+from app.utils.metrics import counter, gauge, histogram
+
+# Agent runs executing at once in this worker, and per user. The limits are
+# per API process: with N uvicorn workers up to N times as many runs execute
+RUN_MAX_CONCURRENCY = int(os.getenv("RUN_MAX_CONCURRENCY", "4"))
+RUN_MAX_PER_USER = int(os.getenv("RUN_MAX_PER_USER", "1"))
+# Runs allowed to wait for a slot; beyond this /api/browse answers 429
+RUN_QUEUE_MAX_SIZE = int(os.getenv("RUN_QUEUE_MAX_SIZE", "50"))
+# Seconds between repeated position events while a run waits
+RUN_QUEUE_KEEPALIVE = float(os.getenv("RUN_QUEUE_KEEPALIVE", "15"))
+# Retry-After sent with a 429 when the queue is full
+RUN_QUEUE_RETRY_AFTER = int(os.getenv("RUN_QUEUE_RETRY_AFTER", "10"))
+
+
+class QueueFullError(Exception):
+    """The run queue is full; the caller should retry later."""
+
+
+class RunTicket:
+    """A run's place in the scheduler, from submission until release."""
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.enqueued_at = time.monotonic()
+        self.started_at: Optional[float] = None
+        self.granted = False
+        self.released = False
+        self._changed = asyncio.Event()
+
+    async def wait_for_change(self, timeout: Optional[float] = None) -> None:
+        """Wait until the ticket is granted or its queue position may have moved."""
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._changed.clear()
+
+    def _notify(self) -> None:
+        self._changed.set()
+
+
+class RunScheduler:
+    """Admission control for agent runs.
+
+    At most `max_concurrency` runs execute at once and at most
+    `max_per_user` of them belong to the same user. Waiting runs are kept in
+    one FIFO per user and slots are handed out round-robin across users, so
+    a user submitting a burst cannot starve everyone queued behind them.
+
+    State is kept in memory, so every API worker process has its own
+    scheduler: the limits and the queue bound apply per process and
+    multiply with the number of workers. Size them for one worker (e.g.
+    RUN_MAX_CONCURRENCY divided by the worker count), or run one worker.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = RUN_MAX_CONCURRENCY,
+        max_per_user: int = RUN_MAX_PER_USER,
+        max_queue: int = RUN_QUEUE_MAX_SIZE
+    ):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_per_user = max(1, max_per_user)
+        self.max_queue = max(0, max_queue)
+
+        # Users with waiting runs, in round-robin order
+        self._waiting: "OrderedDict[str, Deque[RunTicket]]" = OrderedDict()
+        self._queued = 0
+        self._running: Dict[str, int] = {}
+        self._active = 0
+
+        self.admitted = counter("runs_admitted_total", "Agent runs admitted")
+        self.rejected = counter("runs_rejected_total", "Agent runs rejected because the queue was full")
+        self.active_runs = gauge("runs_active", "Agent runs executing")
+        self.queue_depth = gauge("run_queue_depth", "Agent runs waiting for a slot")
+        self.queue_wait_seconds = histogram("run_queue_wait_seconds", "Time an agent run waited for a slot")
+        self.run_seconds = histogram("run_seconds", "Time an agent run held its slot")
+
+    def submit(self, user_id: str) -> RunTicket:
+        """Queue a run for `user_id`; it may be granted a slot right away.
+
+        Raises QueueFullError when the run can't start now and the queue
+        already holds `max_queue` runs.
+        """
+        ticket = RunTicket(user_id)
+        self._waiting.setdefault(user_id, deque()).append(ticket)
+        self._queued += 1
+        self._dispatch()
+
+        if not ticket.granted and self._queued > self.max_queue:
+            self._remove_waiting(ticket)
+            self.rejected.inc()
+            self._update_gauges()
+            raise QueueFullError("Too many queued runs")
+
+        self.admitted.inc()
+        return ticket
+
+    def release(self, ticket: RunTicket) -> None:
+        """Free the ticket's slot, or drop it from the queue if still waiting."""
+        if ticket.released:
+            return
+        ticket.released = True
+
+        if ticket.granted:
+            self._active -= 1
+            self._running[ticket.user_id] -= 1
+            if not self._running[ticket.user_id]:
+                del self._running[ticket.user_id]
+            self.run_seconds.observe(time.monotonic() - ticket.started_at)
+        else:
+            self._remove_waiting(ticket)
+
+        self._dispatch()
+
+    def position(self, ticket: RunTicket) -> int:
+        """1-based place of a waiting ticket in round-robin order (0 once granted)."""
+        if ticket.granted or ticket.released:
+            return 0
+        users = list(self._waiting)
+        own = self._waiting[ticket.user_id]
+        index = own.index(ticket)
+        own_turn = users.index(ticket.user_id)
+
+        ahead = 0
+        for turn, user in enumerate(users):
+            queued = len(self._waiting[user])
+            # Every user gets `index` turns before ours, plus one more if
+            # they come earlier in the rotation
+            ahead += min(queued, index + (1 if turn < own_turn else 0))
+        return ahead + 1
+
+    def stats(self) -> Dict[str, int]:
+        return {"active": self._active, "queued": self._queued, "users_waiting": len(self._waiting)}
+
+    def _dispatch(self) -> None:
+        while self._active < self.max_concurrency:
+            user = next(
+                (u for u in self._waiting if self._running.get(u, 0) < self.max_per_user),
+                None)
+            if user is None:
+                break
+
+            queue = self._waiting[user]
+            ticket = queue.popleft()
+            self._queued -= 1
+            if queue:
+                # Back of the rotation after being served
+                self._waiting.move_to_end(user)
+            else:
+                del self._waiting[user]
+
+            ticket.granted = True
+            ticket.started_at = time.monotonic()
+            self._active += 1
+            self._running[user] = self._running.get(user, 0) + 1
+            self.queue_wait_seconds.observe(ticket.started_at - ticket.enqueued_at)
+            ticket._notify()
+
+        # Positions may have moved for everyone still waiting
+        for queue in self._waiting.values():
+            for waiting in queue:
+                waiting._notify()
+        self._update_gauges()
+
+    def _remove_waiting(self, ticket: RunTicket) -> None:
+        queue = self._waiting.get(ticket.user_id)
+        if queue is None or ticket not in queue:
+            return
+        queue.remove(ticket)
+        self._queued -= 1
+        if not queue:
+            del self._waiting[ticket.user_id]
+
+    def _update_gauges(self) -> None:
+        self.active_runs.set(self._active)
+        self.queue_depth.set(self._queued)
+
+
+run_scheduler = RunScheduler()
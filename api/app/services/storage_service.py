@@ -0,0 +1,252 @@
+import asyncio
+import hashlib
+import logging
+import os
+import shutil
+from pathlib import Path
+from typing import AsyncIterator, ByteString, NamedTuple, Optional
+
+import httpx
+
+from app.config.supabase import supabase, service_supabase, SUPABASE_URL, SUPABASE_KEY, SUPABASE_SERVICE_ROLE_KEY
+
+# "supabase" (Supabase Storage, the default), "s3" (any S3-compatible
+# service) or "local" (filesystem; only for dev/test, as objects are lost
+# with the container and not shared between hosts)
+OBJECT_STORE_BACKEND = os.getenv("OBJECT_STORE_BACKEND", "supabase")
+OBJECT_STORE_PATH = os.getenv("OBJECT_STORE_PATH", "/tmp/digest_ai_objects")
+OBJECT_STORE_BUCKET = os.getenv("OBJECT_STORE_BUCKET", "run-gifs")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL")
+
+READ_CHUNK_SIZE = 256 * 1024
+
+
+class StoredObject(NamedTuple):
+    key: str
+    size: int
+    etag: str
+    content_type: str
+
+
+def gif_key(history_id: str) -> str:
+    """Object key of the recording of a run."""
+    return f"gifs/{history_id}.gif"
+
+
+def _file_digest(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(READ_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ObjectStore:
+    """Binary blob storage for run artifacts such as GIF recordings.
+
+    Ranges are inclusive byte offsets, as in an HTTP Range header.
+    """
+
+    async def put_file(self, key: str, path: Path, content_type: str) -> StoredObject:
+        """Store the file at `path` under `key`; the file may be moved."""
+        raise NotImplementedError
+
+    def iter_range(self, key: str, start: int, end: int, chunk_size: int = READ_CHUNK_SIZE) -> AsyncIterator[ByteString]:
+        """Yield the bytes of [start, end] of the object as bytes-like chunks."""
+        raise NotImplementedError
+
+    async def read(self, key: str) -> bytes:
+        raise NotImplementedError
+
+    async def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+
+class LocalObjectStore(ObjectStore):
+    """Objects as files under a local directory."""
+
+    def __init__(self, root: str = OBJECT_STORE_PATH):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key: str) -> Path:
+        path = (self.root / key).resolve()
+        if self.root.resolve() not in path.parents:
+            raise ValueError(f"Invalid object key: {key}")
+        return path
+
+    async def put_file(self, key: str, path: Path, content_type: str) -> StoredObject:
+        destination = self._path(key)
+
+        def store():
+            etag = _file_digest(path)
+            destination.parent.mkdir(parents=True, exist_ok=True)
+            # A rename when on the same filesystem, so the bytes are never copied
+            shutil.move(str(path), str(destination))
+            return StoredObject(key, destination.stat().st_size, etag, content_type)
+
+        return await asyncio.to_thread(store)
+
+    async def iter_range(self, key: str, start: int, end: int, chunk_size: int = READ_CHUNK_SIZE) -> AsyncIterator[ByteString]:
+        f = await asyncio.to_thread(open, self._path(key), 'rb')
+        try:
+            await asyncio.to_thread(f.seek, start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = await asyncio.to_thread(f.read, min(chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+        finally:
+            f.close()
+
+    async def read(self, key: str) -> bytes:
+        return await asyncio.to_thread(self._path(key).read_bytes)
+
+    async def delete(self, key: str) -> None:
+        await asyncio.to_thread(self._path(key).unlink, True)
+
+
+class SupabaseObjectStore(ObjectStore):
+    """Objects in a Supabase Storage bucket.
+
+    Access control is enforced by the API (objects are only served after
+    the owning run_gifs row was read with the caller's JWT), so the bucket
+    is private and the API reads and writes it with
+    SUPABASE_SERVICE_ROLE_KEY, which bypasses storage policies. Without
+    that key the API's default key is used, and the bucket then needs
+    storage policies granting it select, insert, update and delete.
+    Uploads are streamed from the file and reads are ranged HTTP GETs, so
+    neither holds a whole object in memory.
+    """
+
+    def __init__(self, bucket: str = OBJECT_STORE_BUCKET):
+        self.bucket = bucket
+        self.key = SUPABASE_SERVICE_ROLE_KEY or SUPABASE_KEY
+        if service_supabase is not None:
+            self.client = service_supabase
+        else:
+            logging.warning(
+                "SUPABASE_SERVICE_ROLE_KEY is not set; run GIFs are stored with the "
+                "default key and need storage policies on the bucket")
+            self.client = supabase
+        self._http: Optional[httpx.AsyncClient] = None
+
+    @property
+    def http(self) -> httpx.AsyncClient:
+        if self._http is None:
+            self._http = httpx.AsyncClient(
+                base_url=f"{SUPABASE_URL}/storage/v1/object/authenticated/{self.bucket}/",
+                headers={"Authorization": f"Bearer {self.key}", "apikey": self.key},
+                timeout=httpx.Timeout(30.0, connect=5.0))
+        return self._http
+
+    async def put_file(self, key: str, path: Path, content_type: str) -> StoredObject:
+        size = (await asyncio.to_thread(path.stat)).st_size
+        digest = hashlib.sha256()
+        f = await asyncio.to_thread(open, path, 'rb')
+
+        async def body():
+            # Streamed from the file, so the upload never holds the whole GIF
+            while chunk := await asyncio.to_thread(f.read, READ_CHUNK_SIZE):
+                digest.update(chunk)
+                yield chunk
+
+        try:
+            response = await self.http.post(
+                f"{SUPABASE_URL}/storage/v1/object/{self.bucket}/{key}",
+                content=body(),
+                headers={"Content-Type": content_type, "Content-Length": str(size), "x-upsert": "true"})
+            response.raise_for_status()
+        finally:
+            f.close()
+
+        await asyncio.to_thread(path.unlink, True)
+        return StoredObject(key, size, digest.hexdigest(), content_type)
+
+    async def iter_range(self, key: str, start: int, end: int, chunk_size: int = READ_CHUNK_SIZE) -> AsyncIterator[ByteString]:
+        headers = {"Range": f"bytes={start}-{end}"}
+        async with self.http.stream("GET", key, headers=headers) as response:
+            response.raise_for_status()
+            if response.status_code == 206:
+                async for chunk in response.aiter_bytes(chunk_size):
+                    yield chunk
+                return
+            # The range was ignored (200): skip to it and stop after it
+            offset = 0
+            async for chunk in response.aiter_bytes(chunk_size):
+                chunk_end = offset + len(chunk)
+                if chunk_end > start:
+                    yield memoryview(chunk)[max(0, start - offset):end + 1 - offset]
+                if chunk_end > end:
+                    return
+                offset = chunk_end
+
+    async def read(self, key: str) -> bytes:
+        response = await self.http.get(key)
+        response.raise_for_status()
+        return response.content
+
+    async def delete(self, key: str) -> None:
+        await asyncio.to_thread(self.client.storage.from_(self.bucket).remove, [key])
+
+
+class S3ObjectStore(ObjectStore):
+    """Objects in an S3-compatible bucket (requires boto3)."""
+
+    def __init__(self, bucket: str = OBJECT_STORE_BUCKET, endpoint_url: Optional[str] = S3_ENDPOINT_URL):
+        try:
+            import boto3
+        except ImportError:
+            raise RuntimeError(
+                "OBJECT_STORE_BACKEND=s3 requires boto3 (pip install boto3)")
+        self.bucket = bucket
+        self.client = boto3.client("s3", endpoint_url=endpoint_url)
+
+    async def put_file(self, key: str, path: Path, content_type: str) -> StoredObject:
+        def store():
+            etag = _file_digest(path)
+            size = path.stat().st_size
+            self.client.upload_file(
+                str(path), self.bucket, key, ExtraArgs={"ContentType": content_type})
+            return StoredObject(key, size, etag, content_type)
+
+        stored = await asyncio.to_thread(store)
+        await asyncio.to_thread(path.unlink, True)
+        return stored
+
+    async def iter_range(self, key: str, start: int, end: int, chunk_size: int = READ_CHUNK_SIZE) -> AsyncIterator[ByteString]:
+        response = await asyncio.to_thread(
+            self.client.get_object, Bucket=self.bucket, Key=key, Range=f"bytes={start}-{end}")
+        body = response["Body"]
+        try:
+            while True:
+                chunk = await asyncio.to_thread(body.read, chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            body.close()
+
+    async def read(self, key: str) -> bytes:
+        response = await asyncio.to_thread(
+            self.client.get_object, Bucket=self.bucket, Key=key)
+        return await asyncio.to_thread(response["Body"].read)
+
+    async def delete(self, key: str) -> None:
+        await asyncio.to_thread(self.client.delete_object, Bucket=self.bucket, Key=key)
+
+
+def create_object_store(kind: str = OBJECT_STORE_BACKEND) -> ObjectStore:
+    """Build the configured object store."""
+    if kind == "supabase":
+        return SupabaseObjectStore()
+    if kind == "s3":
+        return S3ObjectStore()
+    if kind != "local":
+        logging.warning(f"Unknown object store '{kind}', using local filesystem")
+    return LocalObjectStore()
+
+
+object_store = create_object_store()
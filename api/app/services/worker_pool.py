@@ -0,0 +1,262 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+from multiprocessing.connection import Connection
+from typing import AsyncIterator, Callable, Dict, List, Set
+
+from app.services.run_log import unsaved
+from app.utils.metrics import counter, gauge
+
+# "inline" runs agents in the API process; "process" dispatches them to a
+# pool of worker processes and the API process only relays their events
+RUN_WORKER_MODE = os.getenv("RUN_WORKER_MODE", "inline")
+RUN_WORKER_PROCESSES = int(os.getenv("RUN_WORKER_PROCESSES", "2"))
+# Seconds runs get to finish on shutdown before their workers are killed
+RUN_WORKER_DRAIN_TIMEOUT = float(os.getenv("RUN_WORKER_DRAIN_TIMEOUT", "120"))
+
+# IPC messages are tuples over a multiprocessing Pipe:
+#   API -> worker: ("run", run_id, user_id, auth_tokens, browser_task), ("drain",)
+#   worker -> API: ("event", run_id, event), ("done", run_id),
+#                  ("invalidate", user_id, tags)
+# Each end reads its pipe in a thread, so unpickling a large message never
+# blocks an event loop.
+
+
+class WorkerUnavailableError(Exception):
+    """No live worker process can take a run."""
+
+
+class _Worker:
+    def __init__(self, process: multiprocessing.Process, conn: Connection):
+        self.process = process
+        self.conn = conn
+        self.runs: Dict[str, asyncio.Queue] = {}
+        self.alive = True
+
+
+class WorkerPool:
+    """Pool of worker processes executing agent runs.
+
+    Each worker has its own interpreter (and GIL), event loop, browser
+    session pool and database executor, so CPU-heavy steps like DOM
+    processing or GIF encoding in one run no longer stall every other
+    stream. Runs go to the least loaded worker and their events come back
+    over the worker's pipe, as do the workers' response cache
+    invalidations so the API process never serves a stale history list. A
+    worker that dies only fails its own runs and is replaced; on shutdown
+    workers stop taking runs and get RUN_WORKER_DRAIN_TIMEOUT seconds to
+    finish the ones they have.
+    """
+
+    def __init__(self, processes: int = RUN_WORKER_PROCESSES, mode: str = RUN_WORKER_MODE):
+        self.enabled = mode == "process"
+        if mode not in ("inline", "process"):
+            logging.warning(f"Unknown run worker mode '{mode}', running inline")
+        self.processes = max(1, processes)
+        self._workers: List[_Worker] = []
+        self._draining = False
+        self._background: Set[asyncio.Task] = set()
+        # Spawn, not fork: the parent has running threads and an event loop
+        self._context = multiprocessing.get_context("spawn")
+
+        self.crashes = counter("run_worker_crashes_total", "Worker processes that exited unexpectedly")
+        self.live_workers = gauge("run_workers", "Live worker processes")
+        self.remote_runs = gauge("run_worker_runs", "Runs executing in worker processes")
+
+    async def start(self) -> None:
+        if not self.enabled:
+            return
+        for _ in range(self.processes):
+            self._spawn()
+
+    async def run(self, run_id: str, user_id: str, auth_tokens, browser_task) -> AsyncIterator[Dict]:
+        """Execute an admitted run on a worker, yielding its events."""
+        worker = self._pick()
+        events: asyncio.Queue = asyncio.Queue()
+        worker.runs[run_id] = events
+        self._update_gauges()
+        try:
+            worker.conn.send(("run", run_id, user_id, auth_tokens, browser_task))
+            while True:
+                event = await events.get()
+                if event is None:
+                    return
+                yield event
+        finally:
+            worker.runs.pop(run_id, None)
+            self._update_gauges()
+
+    async def drain(self, timeout: float = RUN_WORKER_DRAIN_TIMEOUT) -> None:
+        """Let workers finish their runs, then stop them."""
+        self._draining = True
+        for worker in self._workers:
+            if worker.alive:
+                try:
+                    worker.conn.send(("drain",))
+                except (BrokenPipeError, OSError):
+                    pass
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        for worker in self._workers:
+            remaining = max(0.0, deadline - loop.time())
+            await asyncio.to_thread(worker.process.join, remaining)
+            if worker.process.is_alive():
+                logging.warning(
+                    f"Run worker {worker.process.pid} did not drain in time, terminating")
+                worker.process.terminate()
+                await asyncio.to_thread(worker.process.join, 5)
+        self._workers = []
+        self._update_gauges()
+
+    def _spawn(self) -> _Worker:
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(
+            target=worker_main, args=(child_conn,), name="run-worker")
+        process.start()
+        # Only the child keeps its end, so the parent sees EOF if it dies
+        child_conn.close()
+
+        worker = _Worker(process, parent_conn)
+        self._workers.append(worker)
+        start_reader(
+            parent_conn,
+            lambda message: self._on_message(worker, message),
+            lambda: self._on_exit(worker))
+        self._update_gauges()
+        logging.info(f"Started run worker {process.pid}")
+        return worker
+
+    def _pick(self) -> _Worker:
+        live = [w for w in self._workers if w.alive]
+        if self._draining or not live:
+            raise WorkerUnavailableError("No run worker available")
+        return min(live, key=lambda w: len(w.runs))
+
+    def _on_message(self, worker: _Worker, message) -> None:
+        if message[0] == "invalidate":
+            from app.services.cache_service import response_cache
+            task = asyncio.create_task(response_cache.invalidate(message[1], *message[2]))
+            self._background.add(task)
+            task.add_done_callback(self._background.discard)
+            return
+        events = worker.runs.get(message[1])
+        if events is None:
+            return
+        if message[0] == "event":
+            events.put_nowait(message[2])
+        elif message[0] == "done":
+            events.put_nowait(None)
+
+    def _on_exit(self, worker: _Worker) -> None:
+        worker.alive = False
+        worker.conn.close()
+
+        if worker.runs:
+            logging.error(
+                f"Run worker {worker.process.pid} exited with {len(worker.runs)} runs in flight")
+        for events in worker.runs.values():
+            events.put_nowait(unsaved({"type": "error", "message": "Error: the worker running this task stopped"}))
+            events.put_nowait(None)
+        if self._draining:
+            return
+
+        self.crashes.inc()
+        logging.error(f"Run worker {worker.process.pid} exited unexpectedly, replacing it")
+        self._workers.remove(worker)
+        self._spawn()
+
+    def _update_gauges(self) -> None:
+        self.live_workers.set(sum(1 for w in self._workers if w.alive))
+        self.remote_runs.set(sum(len(w.runs) for w in self._workers))
+
+
+def start_reader(conn: Connection, on_message: Callable, on_eof: Callable[[], None]) -> None:
+    """Receive from `conn` in a thread, handing messages to the running loop.
+
+    `on_message` and `on_eof` run on the loop; `on_eof` once the other end
+    has closed the pipe.
+    """
+    loop = asyncio.get_running_loop()
+
+    def read():
+        try:
+            while True:
+                loop.call_soon_threadsafe(on_message, conn.recv())
+        except (EOFError, OSError):
+            pass
+        except RuntimeError:
+            # The loop closed first
+            return
+        try:
+            loop.call_soon_threadsafe(on_eof)
+        except RuntimeError:
+            pass
+
+    threading.Thread(target=read, name="run-worker-pipe", daemon=True).start()
+
+
+def worker_main(conn: Connection) -> None:
+    """Entry point of a worker process."""
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_serve(conn))
+
+
+async def _serve(conn: Connection) -> None:
+    # Imported here: the worker runs the same run code as the inline mode
+    from app.main import execute_run, browser_configuration
+    from app.services.anchor_client import anchor_client
+    from app.services.browser_pool import browser_pool
+    from app.services.cache_service import response_cache
+    from app.services.history_writer import history_writer
+    from app.utils.db import shutdown_db_executor
+
+    inbox: asyncio.Queue = asyncio.Queue()
+    runs = set()
+
+    def on_eof():
+        # The API process is gone; finish what we have and exit
+        inbox.put_nowait(("drain",))
+
+    def send(message):
+        try:
+            conn.send(message)
+        except (BrokenPipeError, OSError):
+            # Nobody is listening any more, but the run still completes and
+            # saves its history
+            pass
+
+    async def relay(run_id, user_id, auth_tokens, browser_task):
+        try:
+            async for event in execute_run(user_id, auth_tokens, browser_task, run_id):
+                send(("event", run_id, event))
+        except Exception as e:
+            logging.error(f"Run {run_id} failed in worker: {str(e)}")
+            send(("event", run_id, unsaved({"type": "error", "message": f"Error: {str(e)}"})))
+        finally:
+            send(("done", run_id))
+
+    start_reader(conn, inbox.put_nowait, on_eof)
+    # The API process serves the history lists; keep its cache in step
+    response_cache.on_invalidate = lambda user_id, tags: send(("invalidate", user_id, tags))
+    await history_writer.start()
+    await browser_pool.start([browser_configuration])
+
+    while True:
+        message = await inbox.get()
+        if message[0] == "drain":
+            break
+        task = asyncio.create_task(relay(*message[1:]))
+        runs.add(task)
+        task.add_done_callback(runs.discard)
+
+    await asyncio.gather(*runs, return_exceptions=True)
+    await browser_pool.stop()
+    await history_writer.drain()
+    await anchor_client.close()
+    shutdown_db_executor()
+
+
+worker_pool = WorkerPool()
@@ -1,14 +1,226 @@
 from fastapi import HTTPException, Request
 from supabase.client import Client
 import jwt as PyJWT  # Import as PyJWT to be explicit
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from collections import OrderedDict
 from typing import Optional, Tuple, Dict
-from app.config.supabase import supabase
+import httpx
+from app.config.supabase import supabase, SUPABASE_URL
+from app.utils.metrics import counter, histogram
+
+# Secret of the project's HS256 (legacy) JWTs; tokens signed with
+# asymmetric keys are verified against the project's JWKS instead
+SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET")
+SUPABASE_JWKS_URL = os.getenv(
+    "SUPABASE_JWKS_URL", f"{SUPABASE_URL}/auth/v1/.well-known/jwks.json")
+SUPABASE_JWT_AUDIENCE = os.getenv("SUPABASE_JWT_AUDIENCE", "authenticated")
+# Signing keys are refetched after this many seconds, or sooner when a
+# token names a key id we don't have (key rotation)
+AUTH_JWKS_CACHE_TTL = float(os.getenv("AUTH_JWKS_CACHE_TTL", "600"))
+# Recently verified tokens remembered per process
+AUTH_TOKEN_CACHE_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "1024"))
+# Seconds a verified token is trusted before its session is checked with
+# Supabase Auth again, which is how signed-out or revoked sessions are
+# noticed; 0 trusts tokens until they expire
+AUTH_SESSION_CHECK_INTERVAL = float(os.getenv("AUTH_SESSION_CHECK_INTERVAL", "300"))
+
+# Minimum seconds between JWKS fetches triggered by unknown key ids
+_JWKS_MIN_REFRESH_INTERVAL = 30.0
+_ASYMMETRIC_ALGORITHMS = ("RS256", "ES256", "EdDSA")
 
 class AuthTokens:
     def __init__(self, access_token: str, refresh_token: Optional[str] = None):
         self.access_token = access_token
         self.refresh_token = refresh_token or access_token  # fallback to access_token if no refresh_token
 
+
+class TokenVerifier:
+    """Verify Supabase access tokens, caching signing keys and results.
+
+    HS256 tokens are checked with SUPABASE_JWT_SECRET and asymmetric ones
+    with the key named by their `kid` from the project's JWKS, which is
+    fetched once and refreshed on expiry or when an unknown key id shows
+    up. Verified tokens are kept in a small LRU keyed by their SHA-256 and
+    dropped at their `exp`, so a client polling with the same token pays
+    for one verification.
+
+    A signature check can't tell that a session was signed out or revoked,
+    so a token's session is also checked with Supabase Auth (one
+    `get_user` call) when it is first seen and again every
+    `session_check_interval` seconds; revoked sessions are rejected within
+    that interval rather than at `exp`.
+    """
+
+    def __init__(
+        self,
+        secret: Optional[str] = SUPABASE_JWT_SECRET,
+        jwks_url: str = SUPABASE_JWKS_URL,
+        audience: str = SUPABASE_JWT_AUDIENCE,
+        cache_size: int = AUTH_TOKEN_CACHE_SIZE,
+        jwks_ttl: float = AUTH_JWKS_CACHE_TTL,
+        session_check_interval: float = AUTH_SESSION_CHECK_INTERVAL,
+        transport: Optional[httpx.AsyncBaseTransport] = None
+    ):
+        self.secret = secret
+        self.jwks_url = jwks_url
+        self.audience = audience
+        self.cache_size = max(0, cache_size)
+        self.jwks_ttl = jwks_ttl
+        self.session_check_interval = session_check_interval
+        self.transport = transport
+
+        # sha256(token) -> (user_id, trusted until)
+        self._tokens: "OrderedDict[bytes, Tuple[str, float]]" = OrderedDict()
+        self._keys: Dict[str, PyJWT.PyJWK] = {}
+        self._keys_fetched_at = float("-inf")
+        self._keys_lock = asyncio.Lock()
+
+        self.cache_hits = counter("auth_token_cache_hits_total", "Requests authenticated from the verified-token cache")
+        self.cache_misses = counter("auth_token_cache_misses_total", "Requests whose token had to be verified")
+        self.jwks_fetches = counter("auth_jwks_fetches_total", "Fetches of the signing keys")
+        self.session_checks = counter("auth_session_checks_total", "Sessions checked with Supabase Auth")
+        self.verify_seconds = histogram(
+            "auth_verify_seconds", "Time to verify a token not in the cache",
+            buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0))
+
+    async def user_id(self, token: str) -> str:
+        """Return the user id (`sub`) of a valid token.
+
+        Raises PyJWT.InvalidTokenError for invalid or expired tokens.
+        """
+        digest = hashlib.sha256(token.encode("utf-8")).digest()
+        cached = self._tokens.get(digest)
+        if cached is not None:
+            if cached[1] > time.time():
+                self._tokens.move_to_end(digest)
+                self.cache_hits.inc()
+                return cached[0]
+            del self._tokens[digest]
+        self.cache_misses.inc()
+
+        start = time.monotonic()
+        claims = await self._verify(token)
+        self.verify_seconds.observe(time.monotonic() - start)
+
+        user_id = claims.get("sub")
+        if not user_id:
+            raise PyJWT.InvalidTokenError("missing user ID")
+        trusted_until = float(claims["exp"])
+        if self.session_check_interval > 0:
+            await self._check_session(token, user_id)
+            trusted_until = min(trusted_until, time.time() + self.session_check_interval)
+        if self.cache_size:
+            self._tokens[digest] = (user_id, trusted_until)
+            if len(self._tokens) > self.cache_size:
+                self._tokens.popitem(last=False)
+        return user_id
+
+    async def check_configuration(self) -> None:
+        """Log an error at startup if tokens can't be verified at all."""
+        if self.secret:
+            return
+        try:
+            async with self._keys_lock:
+                await self._fetch_keys()
+        except Exception as e:
+            logging.error(
+                f"SUPABASE_JWT_SECRET is not set and the signing keys at {self.jwks_url} "
+                f"could not be loaded ({str(e)}); every request will be rejected")
+            return
+        if not self._keys:
+            logging.error(
+                f"SUPABASE_JWT_SECRET is not set and {self.jwks_url} has no signing keys; "
+                "HS256 tokens (the Supabase default) will be rejected")
+
+    async def _check_session(self, token: str, user_id: str) -> None:
+        self.session_checks.inc()
+        try:
+            response = await asyncio.to_thread(supabase.auth.get_user, token)
+        except Exception as e:
+            raise PyJWT.InvalidTokenError(f"session check failed: {str(e)}")
+        if not response or not response.user or response.user.id != user_id:
+            raise PyJWT.InvalidTokenError("session is no longer valid")
+
+    async def _verify(self, token: str) -> Dict:
+        header = PyJWT.get_unverified_header(token)
+        algorithm = header.get("alg")
+        if algorithm == "HS256":
+            if not self.secret:
+                raise PyJWT.InvalidTokenError("HS256 tokens are not accepted (SUPABASE_JWT_SECRET unset)")
+            key = self.secret
+        elif algorithm in _ASYMMETRIC_ALGORITHMS:
+            key = (await self._signing_key(header.get("kid"))).key
+        else:
+            raise PyJWT.InvalidAlgorithmError(f"Unsupported token algorithm: {algorithm}")
+
+        return PyJWT.decode(
+            token,
+            key,
+            algorithms=[algorithm],
+            audience=self.audience,
+            options={"require": ["exp", "sub"]}
+        )
+
+    async def _signing_key(self, kid: Optional[str]) -> PyJWT.PyJWK:
+        key = self._keys.get(kid) if self._fresh() else None
+        if key is not None:
+            return key
+
+        async with self._keys_lock:
+            # Another request may have refreshed the keys while we waited
+            key = self._keys.get(kid)
+            stale = not self._fresh()
+            may_refresh = time.monotonic() - self._keys_fetched_at >= _JWKS_MIN_REFRESH_INTERVAL
+            if stale or (key is None and may_refresh):
+                try:
+                    await self._fetch_keys()
+                except Exception as e:
+                    # Keep using the keys we have until the JWKS is reachable
+                    # again, retrying at most every _JWKS_MIN_REFRESH_INTERVAL
+                    logging.error(f"Failed to fetch signing keys: {str(e)}")
+                    if not self._keys:
+                        raise PyJWT.InvalidTokenError("Signing keys unavailable")
+                    self._keys_fetched_at = time.monotonic() - self.jwks_ttl + _JWKS_MIN_REFRESH_INTERVAL
+                key = self._keys.get(kid)
+
+        if key is None:
+            raise PyJWT.InvalidTokenError(f"Unknown signing key: {kid}")
+        return key
+
+    def _fresh(self) -> bool:
+        return time.monotonic() - self._keys_fetched_at < self.jwks_ttl
+
+    async def _fetch_keys(self) -> None:
+        async with httpx.AsyncClient(timeout=5.0, transport=self.transport) as client:
+            response = await client.get(self.jwks_url)
+            response.raise_for_status()
+        keys = {}
+        for jwk in response.json().get("keys", []):
+            try:
+                keys[jwk.get("kid")] = PyJWT.PyJWK(jwk)
+            except PyJWT.PyJWTError as e:
+                logging.warning(f"Skipping unusable signing key {jwk.get('kid')}: {str(e)}")
+        self._keys = keys
+        self._keys_fetched_at = time.monotonic()
+        self.jwks_fetches.inc()
+        logging.info(f"Loaded {len(keys)} signing keys from {self.jwks_url}")
+
+
+token_verifier = TokenVerifier()
+
+
+def token_expires_at(token: str) -> Optional[float]:
+    """`exp` of an already verified token, or None if it can't be read."""
+    try:
+        return float(PyJWT.decode(token, options={"verify_signature": False})["exp"])
+    except (PyJWT.PyJWTError, KeyError, TypeError, ValueError):
+        return None
+
+
 async def get_user_id_and_tokens(request: Request) -> Tuple[str, AuthTokens]:
     """
     Extract and verify the JWT tokens from the request header.
@@ -18,30 +230,21 @@ async def get_user_id_and_tokens(request: Request) -> Tuple[str, AuthTokens]:
     auth_header = request.headers.get('Authorization')
     if not auth_header or not auth_header.startswith('Bearer '):
         raise HTTPException(status_code=401, detail="Missing or invalid authorization header")
-    
+
     access_token = auth_header.split(' ')[1]
     # Get refresh token from cookie or header
     refresh_token = request.cookies.get('sb-refresh-token') or access_token
-    
+
     try:
-        # Verify the JWT token using Supabase's JWT secret
-        decoded = PyJWT.decode(
-            access_token,
-            algorithms=["HS256"],
-            options={"verify_signature": False}  # We trust Supabase's token
-        )
-        
-        # The sub claim contains the user ID in Supabase JWTs
-        user_id = decoded.get('sub')
-        if not user_id:
-            raise HTTPException(status_code=401, detail="Invalid token: missing user ID")
-        
+        # Signature, expiry and audience are checked; the result is cached
+        # until the token expires
+        user_id = await token_verifier.user_id(access_token)
         return user_id, AuthTokens(access_token, refresh_token)
-        
+
     except Exception as e:
         raise HTTPException(status_code=401, detail=f"Authentication error: {str(e)}")
 
 async def get_user_id(request: Request) -> str:
     """Convenience function to get just the user ID."""
     user_id, _ = await get_user_id_and_tokens(request)
-    return user_id 
\ No newline at end of file
+    return user_id
@@ -0,0 +1,64 @@
+import asyncio
+import functools
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from app.utils.auth import AuthTokens
+from app.utils.metrics import gauge, histogram
+
+# Maximum number of Supabase calls in flight per process; further calls wait
+# in the executor queue instead of opening more connections
+SUPABASE_MAX_CONCURRENCY = int(os.getenv("SUPABASE_MAX_CONCURRENCY", "8"))
+
+# Dedicated pool so slow database round trips never starve the default executor
+_db_executor = ThreadPoolExecutor(
+    max_workers=SUPABASE_MAX_CONCURRENCY,
+    thread_name_prefix="supabase"
+)
+
+db_call_seconds = histogram(
+    "supabase_call_seconds", "Supabase call time including executor queueing")
+db_calls_in_flight = gauge(
+    "supabase_calls_in_flight", "Supabase calls submitted and not yet finished")
+
+
+async def run_blocking(func: Callable, *args, **kwargs) -> Any:
+    """Run a blocking supabase-py call on the database executor.
+
+    The supabase-py client is synchronous, so calling it directly from an
+    `async def` blocks the event loop (and every open SSE stream) for a full
+    network round trip. The client's HTTP connection pool is thread-safe and
+    shared by all executor threads.
+    """
+    loop = asyncio.get_running_loop()
+    start = time.monotonic()
+    db_calls_in_flight.inc()
+    try:
+        return await loop.run_in_executor(_db_executor, functools.partial(func, *args, **kwargs))
+    finally:
+        db_calls_in_flight.dec()
+        db_call_seconds.observe(time.monotonic() - start)
+
+
+def scoped(query, auth_tokens: Optional[AuthTokens] = None):
+    """Attach the caller's JWT to a single PostgREST query.
+
+    The header is set on this request builder only, so the shared client
+    (and its pooled connections) is never mutated and concurrent requests
+    from different users cannot run under each other's session. Without
+    tokens the query runs with the client's default API key.
+    """
+    if auth_tokens:
+        query.headers["Authorization"] = f"Bearer {auth_tokens.access_token}"
+    return query
+
+
+async def execute(query, auth_tokens: Optional[AuthTokens] = None) -> Any:
+    """Execute a PostgREST query as the caller without blocking the event loop."""
+    return await run_blocking(scoped(query, auth_tokens).execute)
+
+
+def shutdown_db_executor() -> None:
+    _db_executor.shutdown(wait=True)
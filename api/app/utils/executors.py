@@ -0,0 +1,178 @@
+import asyncio
+import functools
+import itertools
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from app.utils.metrics import counter, gauge, histogram
+
+# GIF rendering is CPU-bound image work: "thread" or "process" (sidesteps the GIL)
+GIF_EXECUTOR_KIND = os.getenv("GIF_EXECUTOR_KIND", "thread")
+GIF_EXECUTOR_WORKERS = int(os.getenv("GIF_EXECUTOR_WORKERS", "2"))
+
+# Set in each worker process by the pool initializer; jobs put their id on
+# it when they start
+_start_queue = None
+
+
+def _init_process_worker(start_queue) -> None:
+    global _start_queue
+    _start_queue = start_queue
+
+
+def _process_job(job_id: int, func: Callable, args: Tuple, kwargs: Dict) -> Any:
+    _start_queue.put(job_id)
+    return func(*args, **kwargs)
+
+
+class InstrumentedExecutor:
+    """A named, sized executor that tells queueing apart from execution.
+
+    `run` reports how long each job waited for a worker and how long it
+    ran, tracks queue depth and utilization, and applies its timeout to the
+    execution only, so a job is never failed just for waiting its turn.
+    Jobs signal when they start themselves (a process pool's futures count
+    as running as soon as they are queued for a worker, not when one picks
+    them up).
+    """
+
+    def __init__(self, name: str, workers: int, kind: str = "thread"):
+        self.name = name
+        self.workers = max(1, workers)
+        self.kind = kind
+        self._executor: Optional[Executor] = None
+        self._ids = itertools.count()
+        # job id -> (loop, future set when the job starts)
+        self._starting: Dict[int, Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = {}
+        self._start_queue = None
+
+        self.queued = gauge(f"{name}_executor_queued", f"{name} jobs waiting for a worker")
+        self.busy = gauge(f"{name}_executor_busy", f"{name} jobs executing")
+        self.utilization = gauge(f"{name}_executor_utilization", f"Share of {name} workers busy")
+        self.wait_seconds = histogram(f"{name}_executor_wait_seconds", f"Time {name} jobs waited for a worker")
+        self.run_seconds = histogram(f"{name}_executor_run_seconds", f"Time {name} jobs executed")
+        self.timeouts = counter(f"{name}_executor_timeouts_total", f"{name} jobs that exceeded their timeout")
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            if self.kind == "process":
+                # Spawn, not fork: the parent has running threads and an event loop
+                context = multiprocessing.get_context("spawn")
+                self._start_queue = context.SimpleQueue()
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=context,
+                    initializer=_init_process_worker, initargs=(self._start_queue,))
+                threading.Thread(
+                    target=self._read_starts, args=(self._start_queue,),
+                    name=f"{self.name}-starts", daemon=True).start()
+            else:
+                if self.kind != "thread":
+                    logging.warning(f"Unknown executor kind '{self.kind}' for {self.name}, using threads")
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix=self.name)
+        return self._executor
+
+    async def run(
+        self,
+        func: Callable,
+        *args,
+        timeout: Optional[float] = None,
+        abandoned_cleanup: Optional[Callable[[], None]] = None,
+        **kwargs
+    ) -> Any:
+        """Run `func` on the executor; `timeout` counts from when it starts.
+
+        Raises asyncio.TimeoutError when the job runs longer than `timeout`.
+        The job itself can't be interrupted and finishes in the background;
+        `abandoned_cleanup` is then called once it has, so whatever it
+        leaves behind (such as an output file) can be removed.
+        """
+        loop = asyncio.get_running_loop()
+        job_id = next(self._ids)
+        start = loop.create_future()
+        self._starting[job_id] = (loop, start)
+
+        submitted = time.monotonic()
+        future: Future = self.executor.submit(self._job(loop, job_id, func, args, kwargs))
+        result = asyncio.wrap_future(future)
+        self.queued.inc()
+        try:
+            await asyncio.wait({start, result}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            self.queued.dec()
+            self._starting.pop(job_id, None)
+            if not (start.done() or future.done()):
+                # Cancelled while still queued
+                future.cancel()
+                if not future.cancelled() and abandoned_cleanup is not None:
+                    future.add_done_callback(lambda _: abandoned_cleanup())
+
+        started = start.result() if start.done() else time.monotonic()
+        self.wait_seconds.observe(started - submitted)
+        self._set_busy(1)
+        # Runs when the job really ends, even if we stopped waiting for it
+        future.add_done_callback(lambda _: self._finished(started))
+
+        try:
+            return await asyncio.wait_for(asyncio.shield(result), timeout=timeout)
+        except asyncio.TimeoutError:
+            self.timeouts.inc()
+            logging.warning(f"{self.name} job timed out after {timeout}s of execution")
+            raise
+        finally:
+            if not future.done() and abandoned_cleanup is not None:
+                future.add_done_callback(lambda _: abandoned_cleanup())
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+        if self._start_queue is not None:
+            # Stops the reader thread
+            self._start_queue.put(None)
+            self._start_queue = None
+
+    def _job(self, loop: asyncio.AbstractEventLoop, job_id: int, func: Callable, args: Tuple, kwargs: Dict) -> Callable:
+        if self.kind == "process":
+            return functools.partial(_process_job, job_id, func, args, kwargs)
+
+        def job():
+            loop.call_soon_threadsafe(self._started, job_id)
+            return func(*args, **kwargs)
+
+        return job
+
+    def _read_starts(self, start_queue) -> None:
+        while True:
+            job_id = start_queue.get()
+            if job_id is None:
+                return
+            entry = self._starting.get(job_id)
+            if entry is not None:
+                try:
+                    entry[0].call_soon_threadsafe(self._started, job_id)
+                except RuntimeError:
+                    # That loop has closed
+                    pass
+
+    def _started(self, job_id: int) -> None:
+        entry = self._starting.get(job_id)
+        if entry is not None and not entry[1].done():
+            entry[1].set_result(time.monotonic())
+
+    def _finished(self, started: float) -> None:
+        self.run_seconds.observe(time.monotonic() - started)
+        self._set_busy(-1)
+
+    def _set_busy(self, delta: int) -> None:
+        self.busy.inc(delta)
+        self.utilization.set(min(1.0, self.busy.value / self.workers))
+
+
+gif_executor = InstrumentedExecutor("gif", GIF_EXECUTOR_WORKERS, GIF_EXECUTOR_KIND)
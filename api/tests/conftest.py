@@ -0,0 +1,7 @@
+import os
+
+# app.config.supabase needs credentials at import; the offline tests never
+# reach Supabase, so placeholders are enough
+os.environ.setdefault("SUPABASE_URL", "https://test.supabase.co")
+os.environ.setdefault("SUPABASE_KEY", "test.test.test")
+os.environ.setdefault("ANONYMIZED_TELEMETRY", "false")
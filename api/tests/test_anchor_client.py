@@ -0,0 +1,96 @@
+import asyncio
+
+import httpx
+import pytest
+
+from app.services import anchor_client as anchor_module
+from app.services.anchor_client import AnchorClient, AnchorError, CircuitBreaker, CircuitOpenError
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(anchor_module, "backoff_delay", lambda attempt, *args: 0)
+
+
+def make_client(responses, attempts=3, breaker=None):
+    """AnchorClient answering from `responses` (status codes) in order."""
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        status = responses[min(len(requests), len(responses)) - 1]
+        return httpx.Response(status, json={"id": "session-1"})
+
+    client = AnchorClient(base_url="https://anchor.test", api_key="key", attempts=attempts, breaker=breaker)
+    client._client = httpx.AsyncClient(base_url="https://anchor.test", transport=httpx.MockTransport(handler))
+    return client, requests
+
+
+@pytest.mark.parametrize("status", [503, 429])
+def test_retries_transient_status(status):
+    client, requests = make_client([status, status, 200])
+
+    session = asyncio.run(client.create_session({}))
+
+    assert session == {"id": "session-1"}
+    assert len(requests) == 3
+    assert client.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_does_not_retry_client_errors():
+    client, requests = make_client([400])
+
+    with pytest.raises(AnchorError):
+        asyncio.run(client.create_session({}))
+
+    assert len(requests) == 1
+    assert client.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_gives_up_after_attempts():
+    client, requests = make_client([503], attempts=2)
+
+    with pytest.raises(AnchorError):
+        asyncio.run(client.end_session("session-1"))
+
+    assert len(requests) == 2
+
+
+def test_breaker_opens_after_threshold():
+    breaker = CircuitBreaker(threshold=2, reset_timeout=60)
+    client, requests = make_client([503], attempts=1, breaker=breaker)
+
+    for _ in range(2):
+        with pytest.raises(AnchorError):
+            asyncio.run(client.create_session({}))
+    assert breaker.state == CircuitBreaker.OPEN
+
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(client.create_session({}))
+    assert len(requests) == 2
+
+
+def test_half_open_trial_closes_circuit():
+    breaker = CircuitBreaker(threshold=1, reset_timeout=0)
+    client, requests = make_client([503, 200], attempts=1, breaker=breaker)
+
+    with pytest.raises(AnchorError):
+        asyncio.run(client.create_session({}))
+    assert breaker.state == CircuitBreaker.OPEN
+
+    # The reset timeout has passed, so one trial call goes through
+    assert asyncio.run(client.create_session({})) == {"id": "session-1"}
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert len(requests) == 2
+
+
+def test_half_open_allows_a_single_trial():
+    breaker = CircuitBreaker(threshold=1, reset_timeout=0)
+    breaker.record_failure()
+
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
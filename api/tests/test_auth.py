@@ -0,0 +1,149 @@
+import asyncio
+import json
+import logging
+import time
+
+import httpx
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import ec
+
+from app.utils.auth import TokenVerifier
+
+SECRET = "test-secret-with-at-least-32-bytes!"
+JWKS_URL = "https://auth.test/auth/v1/.well-known/jwks.json"
+
+
+def hs256(secret=SECRET, expires_in=3600, **claims):
+    payload = {"sub": "user-1", "aud": "authenticated", "exp": int(time.time() + expires_in), **claims}
+    return jwt.encode(payload, secret, algorithm="HS256")
+
+
+class SigningKey:
+    def __init__(self, kid):
+        self.kid = kid
+        self.private = ec.generate_private_key(ec.SECP256R1())
+        self.jwk = {**json.loads(jwt.algorithms.ECAlgorithm.to_jwk(self.private.public_key())),
+                    "kid": kid, "alg": "ES256", "use": "sig"}
+
+    def token(self):
+        payload = {"sub": "user-1", "aud": "authenticated", "exp": int(time.time() + 3600)}
+        return jwt.encode(payload, self.private, algorithm="ES256", headers={"kid": self.kid})
+
+
+class Jwks:
+    """JWKS endpoint whose keys can change between fetches."""
+
+    def __init__(self, keys=(), status=200):
+        self.keys = list(keys)
+        self.status = status
+        self.fetches = 0
+
+    def __call__(self, request):
+        self.fetches += 1
+        return httpx.Response(self.status, json={"keys": [k.jwk for k in self.keys]})
+
+
+def verifier(jwks=None, secret=SECRET, session_check_interval=0):
+    return TokenVerifier(
+        secret=secret, jwks_url=JWKS_URL, session_check_interval=session_check_interval,
+        transport=httpx.MockTransport(jwks or Jwks()))
+
+
+def test_valid_hs256_token():
+    assert asyncio.run(verifier().user_id(hs256())) == "user-1"
+
+
+@pytest.mark.parametrize("token, error", [
+    (hs256(secret="another-secret-with-at-least-32-bytes"), jwt.InvalidSignatureError),
+    (hs256(expires_in=-60), jwt.ExpiredSignatureError),
+    (hs256(aud="anon"), jwt.InvalidAudienceError),
+])
+def test_rejected_tokens(token, error):
+    with pytest.raises(error):
+        asyncio.run(verifier().user_id(token))
+
+
+def test_hs256_rejected_without_secret():
+    with pytest.raises(jwt.InvalidTokenError):
+        asyncio.run(verifier(secret=None).user_id(hs256()))
+
+
+def test_unknown_kid_refreshes_keys_once():
+    old, new = SigningKey("old"), SigningKey("new")
+    jwks = Jwks([old])
+    v = verifier(jwks)
+
+    async def run():
+        assert await v.user_id(old.token()) == "user-1"
+        assert jwks.fetches == 1
+
+        # The keys rotate; a token signed with the new key triggers a refresh
+        jwks.keys.append(new)
+        v._keys_fetched_at -= 60
+        assert await v.user_id(new.token()) == "user-1"
+        assert jwks.fetches == 2
+
+        # Another unknown key right after that doesn't refetch
+        with pytest.raises(jwt.InvalidTokenError):
+            await v.user_id(SigningKey("unknown").token())
+        assert jwks.fetches == 2
+
+    asyncio.run(run())
+
+
+def test_cache_hit_skips_verification():
+    v = verifier()
+    token = hs256()
+    hits = v.cache_hits.value
+
+    async def run():
+        await v.user_id(token)
+        v.secret = "rotated-secret-with-at-least-32-bytes"
+        # Still accepted: served from the cache, not verified again
+        return await v.user_id(token)
+
+    assert asyncio.run(run()) == "user-1"
+    assert v.cache_hits.value == hits + 1
+
+
+def test_revoked_session_is_rejected():
+    v = verifier(session_check_interval=300)
+
+    async def revoked(token, user_id):
+        raise jwt.InvalidTokenError("session is no longer valid")
+
+    v._check_session = revoked
+    with pytest.raises(jwt.InvalidTokenError):
+        asyncio.run(v.user_id(hs256()))
+
+
+def test_session_is_rechecked_after_interval():
+    v = verifier(session_check_interval=300)
+    checks = []
+
+    async def check(token, user_id):
+        checks.append(user_id)
+
+    v._check_session = check
+    token = hs256()
+
+    async def run():
+        await v.user_id(token)
+        await v.user_id(token)
+        # Expire the cached entry's trust window
+        digest = next(iter(v._tokens))
+        v._tokens[digest] = (v._tokens[digest][0], time.time() - 1)
+        await v.user_id(token)
+
+    asyncio.run(run())
+    assert checks == ["user-1", "user-1"]
+
+
+def test_missing_secret_and_jwks_is_reported(caplog):
+    v = verifier(Jwks(status=503), secret=None)
+
+    with caplog.at_level(logging.ERROR):
+        asyncio.run(v.check_configuration())
+
+    assert "SUPABASE_JWT_SECRET is not set" in caplog.text
@@ -0,0 +1,61 @@
+import asyncio
+
+from app.services.browser_pool import BrowserSessionPool, FakeSessionProvider
+
+
+class SlowProvider(FakeSessionProvider):
+    """Fake provider whose creates wait until `ready` is set."""
+
+    def __init__(self):
+        super().__init__()
+        self.ready = asyncio.Event()
+        self.started = asyncio.Event()
+
+    async def create(self, config):
+        self.started.set()
+        await self.ready.wait()
+        return await super().create(config)
+
+
+def test_stop_releases_sessions_still_being_provisioned():
+    async def scenario():
+        provider = SlowProvider()
+        pool = BrowserSessionPool(provider, min_size=2, max_size=2, check_interval=60)
+        await pool.start([{}])
+        pool._last_demand[next(iter(pool._configs))] = asyncio.get_running_loop().time()
+        pool._wakeup.set()
+        await asyncio.wait_for(provider.started.wait(), 1)
+
+        stopping = asyncio.create_task(pool.stop())
+        await asyncio.sleep(0.05)
+        provider.ready.set()
+        await asyncio.wait_for(stopping, 1)
+        # Anything still provisioning after stop() would land here
+        await asyncio.sleep(0.05)
+        return provider, pool
+
+    provider, pool = asyncio.run(scenario())
+    assert provider.created == 2
+    assert provider.released == 2
+    assert not pool._background
+    assert pool.stats() == {"{}": {"warm": 0, "creating": 0}}
+
+
+def test_stop_drains_warm_sessions():
+    async def scenario():
+        provider = FakeSessionProvider()
+        pool = BrowserSessionPool(provider, min_size=1, max_size=1, check_interval=60)
+        await pool.start()
+        session = await pool.acquire({})
+        await pool.release(session)
+        for _ in range(10):
+            if pool.stats()["{}"]["warm"]:
+                break
+            await asyncio.sleep(0)
+        await pool.stop()
+        return provider, pool
+
+    provider, pool = asyncio.run(scenario())
+    assert provider.created == 2
+    assert provider.released == 2
+    assert pool.stats()["{}"]["warm"] == 0
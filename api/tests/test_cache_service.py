@@ -0,0 +1,128 @@
+import asyncio
+
+import pytest
+
+from app.services.cache_service import (
+    EXPIRED,
+    HIT,
+    MISS,
+    MemoryCacheBackend,
+    ResponseCache,
+    SQLiteCacheBackend,
+)
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_backend(request, tmp_path):
+    def make(**kwargs):
+        if request.param == "memory":
+            return MemoryCacheBackend(**kwargs)
+        return SQLiteCacheBackend(path=str(tmp_path / "cache.sqlite3"), **kwargs)
+    return make
+
+
+def test_get_set_and_expiry(make_backend):
+    backend = make_backend()
+    assert backend.get("u1", "k") == (MISS, None)
+    backend.set("u1", "k", {"a": 1}, (), ttl=60)
+    assert backend.get("u1", "k") == (HIT, {"a": 1})
+    # Entries are per user
+    assert backend.get("u2", "k") == (MISS, None)
+
+    backend.set("u1", "old", {"a": 2}, (), ttl=-1)
+    assert backend.get("u1", "old") == (EXPIRED, None)
+    assert backend.stats()["items"] == 1
+
+
+def test_invalidate_drops_tagged_entries(make_backend):
+    backend = make_backend()
+    backend.set("u1", "detail", "d", ("h1",), ttl=60)
+    backend.set("u1", "list", "l", ("history_list",), ttl=60)
+    backend.set("u2", "list", "l", ("history_list",), ttl=60)
+
+    assert backend.invalidate("u1", ("history_list",)) == 1
+    assert backend.get("u1", "list") == (MISS, None)
+    assert backend.get("u1", "detail") == (HIT, "d")
+    assert backend.get("u2", "list") == (HIT, "l")
+
+
+def test_evicts_least_recently_used_past_item_limit(make_backend):
+    backend = make_backend(max_items=2)
+    backend.set("u1", "a", "1", (), ttl=60)
+    backend.set("u1", "b", "2", (), ttl=60)
+    assert backend.set("u1", "c", "3", (), ttl=60) == 1
+    assert backend.get("u1", "a") == (MISS, None)
+    assert backend.stats()["items"] == 2
+
+
+def test_set_skipped_after_invalidation(make_backend):
+    backend = make_backend()
+    generation = backend.generation("u1")
+    backend.invalidate("u1", ("history_list",))
+    assert backend.generation("u1") == generation + 1
+
+    backend.set("u1", "list", "stale", ("history_list",), ttl=60, generation=generation)
+    assert backend.get("u1", "list") == (MISS, None)
+    backend.set("u1", "list", "fresh", ("history_list",), ttl=60, generation=generation + 1)
+    assert backend.get("u1", "list") == (HIT, "fresh")
+
+
+def test_sqlite_hit_only_touches_stale_entries(tmp_path):
+    backend = SQLiteCacheBackend(path=str(tmp_path / "cache.sqlite3"), touch_interval=60)
+    backend.set("u1", "k", "v", (), ttl=60)
+    conn = backend._connect()
+    changes = conn.total_changes
+
+    assert backend.get("u1", "k") == (HIT, "v")
+    assert conn.total_changes == changes
+
+    conn.execute("UPDATE cache_entries SET accessed_at = accessed_at - 120")
+    changes = conn.total_changes
+    assert backend.get("u1", "k") == (HIT, "v")
+    assert conn.total_changes == changes + 1
+
+
+def test_sqlite_generation_is_shared_between_instances(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    one, other = SQLiteCacheBackend(path=path), SQLiteCacheBackend(path=path)
+    generation = one.generation("u1")
+    other.invalidate("u1", ("history_list",))
+    one.set("u1", "list", "stale", ("history_list",), ttl=60, generation=generation)
+    assert other.get("u1", "list") == (MISS, None)
+
+
+def test_load_racing_an_invalidation_in_another_worker_is_not_cached(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    worker_a = ResponseCache(SQLiteCacheBackend(path=path), name="cache_a")
+    worker_b = ResponseCache(SQLiteCacheBackend(path=path), name="cache_b")
+
+    async def scenario():
+        async def loader():
+            # Another worker saves a run while this one is loading
+            await worker_b.invalidate("u1", "history_list")
+            return ["stale"]
+
+        value = await worker_a.get_or_load("u1", "list", loader, tags=["history_list"])
+        return value, await worker_b.get("u1", "list")
+
+    assert asyncio.run(scenario()) == (["stale"], None)
+
+
+def test_get_or_load_caches_and_coalesces(make_backend):
+    cache = ResponseCache(make_backend(), name="cache_test")
+    loads = []
+
+    async def scenario():
+        async def loader():
+            loads.append(1)
+            await asyncio.sleep(0.01)
+            return {"items": [1]}
+
+        first = await asyncio.gather(*(cache.get_or_load("u1", "k", loader) for _ in range(3)))
+        again = await cache.get_or_load("u1", "k", loader)
+        return first, again
+
+    first, again = asyncio.run(scenario())
+    assert first == [{"items": [1]}] * 3
+    assert again == {"items": [1]}
+    assert len(loads) == 1
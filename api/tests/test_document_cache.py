@@ -0,0 +1,60 @@
+import asyncio
+
+from app.services.document_cache import CachedDocument, DocumentCache
+
+
+def document(size):
+    return CachedDocument("x" * size, input_tokens=10, output_tokens=20, generation_seconds=1.5)
+
+
+def meta_bytes(cache):
+    return cache._connect().execute("SELECT bytes FROM documents_meta WHERE id = 1").fetchone()[0]
+
+
+def test_put_and_get(tmp_path):
+    cache = DocumentCache(path=str(tmp_path / "documents.sqlite3"), max_bytes=1000)
+
+    async def scenario():
+        await cache.put("a", document(100))
+        return await cache.get("a"), await cache.get("missing")
+
+    hit, miss = asyncio.run(scenario())
+    assert hit == document(100)
+    assert miss is None
+
+
+def test_evicts_least_recently_used_past_size_limit(tmp_path):
+    cache = DocumentCache(path=str(tmp_path / "documents.sqlite3"), max_bytes=250)
+    conn = cache._connect()
+
+    cache._put("a", document(100))
+    cache._put("b", document(100))
+    conn.execute("UPDATE documents SET accessed_at = 1 WHERE key = 'b'")
+    conn.execute("UPDATE documents SET accessed_at = 2 WHERE key = 'a'")
+    cache._put("c", document(100))
+
+    keys = {key for (key,) in conn.execute("SELECT key FROM documents")}
+    assert keys == {"a", "c"}
+    assert meta_bytes(cache) == 200
+
+
+def test_running_total_tracks_replacements(tmp_path):
+    cache = DocumentCache(path=str(tmp_path / "documents.sqlite3"), max_bytes=1000)
+    cache._put("a", document(300))
+    cache._put("a", document(100))
+    cache._put("b", document(50))
+    assert meta_bytes(cache) == 150
+
+    # Documents larger than the whole cache are not stored
+    cache._put("huge", document(2000))
+    assert meta_bytes(cache) == 150
+
+
+def test_running_total_is_initialized_from_existing_documents(tmp_path):
+    path = str(tmp_path / "documents.sqlite3")
+    cache = DocumentCache(path=path, max_bytes=1000)
+    cache._put("a", document(120))
+    cache._connect().execute("DROP TABLE documents_meta")
+
+    reopened = DocumentCache(path=path, max_bytes=1000)
+    assert meta_bytes(reopened) == 120
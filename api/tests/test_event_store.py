@@ -0,0 +1,82 @@
+import asyncio
+
+from app.services import event_store
+from app.services.event_store import (
+    RunEventWriter, decode_chunk, encode_chunk, follow_run_events, ENCODING_ORJSON_ZLIB)
+
+
+def row(seq, first_event, events):
+    encoding, payload = encode_chunk(events)
+    return {'seq': seq, 'first_event': first_event, 'encoding': encoding, 'payload': payload}
+
+
+def fake_chunks(monkeypatch, rows):
+    async def read_chunks(user_id, run_id, auth_tokens, after_seq, page_size):
+        for r in sorted(rows, key=lambda r: r['seq']):
+            if r['seq'] > after_seq:
+                yield r
+
+    monkeypatch.setattr(event_store, "_read_chunks", read_chunks)
+
+
+def test_large_chunks_are_compressed():
+    events = [{"type": "url", "message": "Urls: https://example.com/" + "a" * 100}] * 50
+
+    encoding, payload = encode_chunk(events)
+
+    assert encoding == ENCODING_ORJSON_ZLIB
+    assert decode_chunk(encoding, payload) == events
+
+
+def test_writes_commit_in_seq_order():
+    committed = []
+
+    async def run():
+        writer = RunEventWriter("run-1", "user-1", chunk_events=1, flush_interval=60)
+
+        async def write(r):
+            # The first chunk is the slowest to commit
+            await asyncio.sleep(0.03 if r['seq'] == 0 else 0)
+            committed.append(r['seq'])
+
+        writer._write = write
+        for i in range(4):
+            writer.add({"type": "url", "message": str(i)})
+        return await writer.close()
+
+    assert asyncio.run(run())
+    assert committed == [0, 1, 2, 3]
+
+
+def test_follower_waits_for_a_chunk_committed_out_of_order(monkeypatch):
+    rows = [row(0, 0, [{"i": 0}, {"i": 1}]), row(2, 3, [{"i": 3}])]
+    fake_chunks(monkeypatch, rows)
+    polls = []
+
+    async def finished():
+        polls.append(len(polls))
+        if len(polls) == 1:
+            # seq 1 commits after seq 2 was already visible
+            rows.append(row(1, 2, [{"i": 2}]))
+            return False
+        return True
+
+    async def follow():
+        return [index async for index, _ in follow_run_events(
+            "user-1", "run-1", finished, poll_interval=0)]
+
+    assert asyncio.run(follow()) == [0, 1, 2, 3]
+
+
+def test_follower_reads_past_failed_chunks_once_finished(monkeypatch):
+    # seq 1 failed to write and never shows up
+    fake_chunks(monkeypatch, [row(0, 0, [{"i": 0}]), row(2, 2, [{"i": 2}])])
+
+    async def finished():
+        return True
+
+    async def follow():
+        return [index async for index, _ in follow_run_events(
+            "user-1", "run-1", finished, poll_interval=0)]
+
+    assert asyncio.run(follow()) == [0, 2]
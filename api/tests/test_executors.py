@@ -0,0 +1,69 @@
+import asyncio
+import time
+
+import pytest
+
+from app.utils.executors import InstrumentedExecutor
+
+
+def sleep_then(seconds, value=None, path=None):
+    time.sleep(seconds)
+    if path is not None:
+        with open(path, "w") as f:
+            f.write("gif")
+    return value
+
+
+@pytest.mark.parametrize("kind", ["thread", "process"])
+def test_timeout_counts_from_start_not_queueing(kind):
+    executor = InstrumentedExecutor(f"test_{kind}", workers=1, kind=kind)
+
+    async def run():
+        # Warm the pool so process start-up isn't part of the timings
+        await executor.run(sleep_then, 0)
+        first = asyncio.create_task(executor.run(sleep_then, 0.6, "first"))
+        await asyncio.sleep(0.05)
+        # Waits ~0.6s for the worker, then runs 0.1s: within its timeout
+        second = executor.run(sleep_then, 0.1, "second", timeout=0.4)
+        return await asyncio.gather(first, second)
+
+    try:
+        assert asyncio.run(run()) == ["first", "second"]
+    finally:
+        executor.shutdown()
+
+
+def test_abandoned_job_is_cleaned_up_when_it_ends(tmp_path):
+    executor = InstrumentedExecutor("test_cleanup", workers=1)
+    output = tmp_path / "render.gif"
+    cleaned = []
+
+    def cleanup():
+        cleaned.append(output.exists())
+        output.unlink()
+
+    async def run():
+        with pytest.raises(asyncio.TimeoutError):
+            await executor.run(sleep_then, 0.2, path=str(output), timeout=0.05, abandoned_cleanup=cleanup)
+        # The caller has moved on; the job is still writing its file
+        assert not output.exists()
+        await asyncio.sleep(0.4)
+
+    try:
+        asyncio.run(run())
+    finally:
+        executor.shutdown()
+    assert cleaned == [True]
+    assert not output.exists()
+
+
+def test_finished_job_is_not_cleaned_up(tmp_path):
+    executor = InstrumentedExecutor("test_no_cleanup", workers=1)
+    cleaned = []
+
+    try:
+        result = asyncio.run(executor.run(sleep_then, 0, "done", abandoned_cleanup=lambda: cleaned.append(1)))
+    finally:
+        executor.shutdown()
+    assert result == "done"
+    assert cleaned == []
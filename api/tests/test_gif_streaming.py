@@ -0,0 +1,165 @@
+import asyncio
+import base64
+import os
+
+import orjson
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+from app import main
+from app.main import base64_chunks, parse_byte_range, stream_chunked_response
+from app.services.cache_service import MemoryCacheBackend, ResponseCache
+from app.services.storage_service import LocalObjectStore, gif_key
+
+HISTORY_ID = "6f1c2d4e-8a9b-4c3d-9e8f-7a6b5c4d3e2f"
+# Spans several stream chunks and isn't a multiple of 3
+GIF = b"GIF89a" + os.urandom(main.GIF_STREAM_CHUNK_SIZE * 2 + 1001)
+
+
+async def collect(stream):
+    return [bytes(chunk) async for chunk in stream]
+
+
+async def from_list(chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+@pytest.fixture
+def stored_gif(tmp_path, monkeypatch):
+    store = LocalObjectStore(str(tmp_path / "objects"))
+    monkeypatch.setattr(main, "object_store", store)
+    path = tmp_path / "run.gif"
+    path.write_bytes(GIF)
+    stored = asyncio.run(store.put_file(gif_key(HISTORY_ID), path, "image/gif"))
+    return stored._asdict()
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-99", (0, 99)),
+    # Open-ended: from the offset to the end
+    ("bytes=900-", (900, 999)),
+    # Suffix: the last N bytes, clamped to the whole object
+    ("bytes=-100", (900, 999)),
+    ("bytes=-5000", (0, 999)),
+    # An end past EOF is clamped
+    ("bytes=990-5000", (990, 999)),
+    # Not handled: the whole object is served
+    (None, None),
+    ("bytes=0-1,5-9", None),
+    ("items=0-9", None),
+    ("bytes=a-b", None),
+])
+def test_parse_byte_range(header, expected):
+    assert parse_byte_range(header, 1000) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=1000-", "bytes=5000-6000", "bytes=-0", "bytes=500-100"])
+def test_parse_byte_range_unsatisfiable(header):
+    with pytest.raises(HTTPException) as excinfo:
+        parse_byte_range(header, 1000)
+    assert excinfo.value.status_code == 416
+    assert excinfo.value.headers == {"Content-Range": "bytes */1000"}
+
+
+@pytest.mark.parametrize("sizes", [[1], [2, 2], [1, 4, 7, 2], [5] * 7, [13, 1, 1]])
+def test_base64_chunks_are_independently_valid(sizes):
+    data = os.urandom(sum(sizes))
+    chunks, offset = [], 0
+    for size in sizes:
+        chunks.append(data[offset:offset + size])
+        offset += size
+
+    pieces = asyncio.run(collect(base64_chunks(from_list(chunks), chunk_size=6)))
+
+    assert b"".join(pieces) == base64.b64encode(data)
+    assert b"".join(base64.b64decode(piece) for piece in pieces) == data
+    # Only the last piece may carry padding
+    assert all(b"=" not in piece for piece in pieces[:-1])
+
+
+def parse_ndjson(body: bytes):
+    return [orjson.loads(line) for line in body.splitlines()]
+
+
+def test_stream_chunked_response_ndjson(stored_gif):
+    data = {"id": HISTORY_ID, "task": "t", "progress": ["stale"], "document_content": "# Doc"}
+    progress = from_list([[{"type": "url", "message": "a"}], [{"type": "complete"}]])
+
+    body = b"".join(asyncio.run(collect(stream_chunked_response(data, stored_gif, progress))))
+    lines = parse_ndjson(body)
+
+    assert lines[0] == {"id": HISTORY_ID, "task": "t"}
+    assert lines[1:4] == [
+        {"progress_events": [{"type": "url", "message": "a"}]},
+        {"progress_events": [{"type": "complete"}]},
+        {"progress_complete": True},
+    ]
+    gif_lines = [line for line in lines if "gif_content_chunk" in line]
+    assert len(gif_lines) == 3
+    assert [line["chunk_index"] for line in gif_lines] == [0, 1, 2]
+    assert base64.b64decode("".join(line["gif_content_chunk"] for line in gif_lines)) == GIF
+    assert lines[-2:] == [{"gif_content_complete": True}, {"document_content": "# Doc"}]
+
+
+def test_stream_chunked_response_legacy_inline_gif():
+    data = {"id": HISTORY_ID, "gif_content": base64.b64encode(GIF).decode("ascii")}
+
+    body = b"".join(asyncio.run(collect(stream_chunked_response(data))))
+    lines = parse_ndjson(body)
+
+    assert lines[0] == {"id": HISTORY_ID}
+    chunks = [line["gif_content_chunk"] for line in lines if "gif_content_chunk" in line]
+    assert len(chunks) == 3
+    assert base64.b64decode("".join(chunks)) == GIF
+    assert lines[-1] == {"gif_content_complete": True}
+
+
+@pytest.fixture
+def client(stored_gif, monkeypatch):
+    async def user(request):
+        return "user-1", None
+
+    async def details(user_id, history_id, auth_tokens=None, fields=None, include=None):
+        return {"id": history_id, "gif_object": stored_gif}
+
+    monkeypatch.setattr(main, "get_user_id_and_tokens", user)
+    monkeypatch.setattr(main, "get_run_details", details)
+    monkeypatch.setattr(main, "response_cache", ResponseCache(MemoryCacheBackend(), name="gif_test_cache"))
+    return TestClient(main.app)
+
+
+def test_binary_format_serves_the_whole_gif(client, stored_gif):
+    response = client.get(f"/api/history/{HISTORY_ID}", params={"format": "binary"})
+    assert response.status_code == 200
+    assert response.content == GIF
+    assert response.headers["content-type"] == "image/gif"
+    assert response.headers["etag"] == f'"{stored_gif["etag"]}"'
+
+    cached = client.get(f"/api/history/{HISTORY_ID}/gif", headers={"If-None-Match": response.headers["etag"]})
+    assert cached.status_code == 304
+
+
+@pytest.mark.parametrize("header, start, end", [
+    ("bytes=10-19", 10, 19),
+    ("bytes=-100", len(GIF) - 100, len(GIF) - 1),
+    ("bytes=400000-", 400000, len(GIF) - 1),
+])
+def test_binary_format_serves_ranges(client, header, start, end):
+    response = client.get(f"/api/history/{HISTORY_ID}/gif", headers={"Range": header})
+    assert response.status_code == 206
+    assert response.content == GIF[start:end + 1]
+    assert response.headers["content-range"] == f"bytes {start}-{end}/{len(GIF)}"
+
+
+def test_binary_format_range_past_eof(client):
+    response = client.get(f"/api/history/{HISTORY_ID}/gif", headers={"Range": f"bytes={len(GIF)}-"})
+    assert response.status_code == 416
+    assert response.headers["content-range"] == f"bytes */{len(GIF)}"
+
+
+def test_binary_format_ignores_multiple_ranges(client):
+    response = client.get(f"/api/history/{HISTORY_ID}/gif", headers={"Range": "bytes=0-1,5-9"})
+    assert response.status_code == 200
+    assert response.content == GIF
@@ -0,0 +1,67 @@
+import base64
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import main
+from app.services.history_service import decode_history_cursor, encode_history_cursor
+
+CREATED_AT = "2026-10-17T09:30:00.123456+00:00"
+HISTORY_ID = "6f1c2d4e-8a9b-4c3d-9e8f-7a6b5c4d3e2f"
+
+
+def raw_cursor(*values):
+    return base64.urlsafe_b64encode(json.dumps(list(values)).encode()).decode()
+
+
+@pytest.fixture
+def client(monkeypatch):
+    pages = []
+
+    async def user(request):
+        return "user-1", None
+
+    async def history(user_id, limit, offset, auth_tokens=None, summary=False, cursor=None, count="exact"):
+        pages.append(cursor)
+        return {"items": [], "next_cursor": None}
+
+    monkeypatch.setattr(main, "get_user_id_and_tokens", user)
+    monkeypatch.setattr(main, "get_run_history", history)
+    test_client = TestClient(main.app)
+    test_client.pages = pages
+    return test_client
+
+
+def test_cursor_round_trip():
+    cursor = encode_history_cursor({"created_at": CREATED_AT, "id": HISTORY_ID})
+    assert decode_history_cursor(cursor) == (CREATED_AT, HISTORY_ID)
+
+
+def test_valid_cursor_is_accepted(client):
+    cursor = encode_history_cursor({"created_at": CREATED_AT, "id": HISTORY_ID})
+    response = client.get("/api/history", params={"cursor": cursor})
+    assert response.status_code == 200
+    assert client.pages == [cursor]
+
+
+@pytest.mark.parametrize("cursor", [
+    # Malformed timestamp
+    raw_cursor("yesterday", HISTORY_ID),
+    raw_cursor("2026-10-17'; drop table run_history; --", HISTORY_ID),
+    # Not a UUID
+    raw_cursor(CREATED_AT, "not-a-uuid"),
+    raw_cursor(CREATED_AT, 42),
+    # Tampered or truncated base64, wrong shape, non-ASCII
+    encode_history_cursor({"created_at": CREATED_AT, "id": HISTORY_ID})[:-6] + "$$$$",
+    encode_history_cursor({"created_at": CREATED_AT, "id": HISTORY_ID})[5:],
+    base64.urlsafe_b64encode(b'{"created_at": 1}').decode(),
+    "é",
+])
+def test_invalid_cursor_is_rejected_with_400(client, cursor):
+    with pytest.raises(ValueError):
+        decode_history_cursor(cursor)
+    response = client.get("/api/history", params={"cursor": cursor})
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Invalid cursor"}
+    assert client.pages == []
@@ -0,0 +1,102 @@
+import asyncio
+import time
+
+import jwt
+import pytest
+
+from app.services import history_writer as writer_module
+from app.services.history_service import build_history_record
+from app.services.history_writer import HistoryWriteQueue
+from app.utils.auth import AuthTokens
+
+SERVICE_CLIENT = object()
+
+
+def token(expires_in: float) -> AuthTokens:
+    return AuthTokens(jwt.encode(
+        {"sub": "user-1", "exp": int(time.time() + expires_in)}, "secret", algorithm="HS256"))
+
+
+class SaveCalls(list):
+    """Calls to save_history_records as (run ids, auth tokens, client)."""
+
+    def __init__(self):
+        super().__init__()
+        # Run ids whose saves fail
+        self.failing = set()
+
+
+@pytest.fixture
+def saves(monkeypatch):
+    calls = SaveCalls()
+
+    async def save(records, auth_tokens=None, client=None):
+        run_ids = [r['history']['id'] for r in records]
+        calls.append((run_ids, auth_tokens, client))
+        if calls.failing & set(run_ids):
+            raise RuntimeError("save failed")
+
+    async def invalidate(*args):
+        return 0
+
+    monkeypatch.setattr(writer_module, "save_history_records", save)
+    monkeypatch.setattr(writer_module.response_cache, "invalidate", invalidate)
+    monkeypatch.setattr(writer_module, "service_supabase", SERVICE_CLIENT)
+    return calls
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return HistoryWriteQueue(path=str(tmp_path / "journal" / "history.sqlite3"))
+
+
+def record(run_id):
+    return build_history_record("user-1", "task", [], run_id=run_id)
+
+
+async def enqueue_and_write(queue, jobs):
+    for run_id, tokens in jobs:
+        await asyncio.to_thread(queue._journal, run_id, "user-1", record(run_id), tokens)
+    await queue._write(await asyncio.to_thread(queue._claim))
+
+
+def test_valid_tokens_are_batched(queue, saves):
+    tokens = token(3600)
+    asyncio.run(enqueue_and_write(queue, [("run-1", tokens), ("run-2", tokens)]))
+
+    assert len(saves) == 1
+    assert saves[0][0] == ["run-1", "run-2"]
+    assert saves[0][1].access_token == tokens.access_token
+    assert queue._counts()[0] == 0
+
+
+def test_expired_token_is_replayed_with_service_client(queue, saves):
+    asyncio.run(enqueue_and_write(queue, [("run-1", token(-10))]))
+
+    assert saves == [(["run-1"], None, SERVICE_CLIENT)]
+    assert queue._counts()[0] == 0
+
+
+def test_expired_token_without_service_key_is_given_up(queue, saves, monkeypatch):
+    monkeypatch.setattr(writer_module, "service_supabase", None)
+
+    asyncio.run(enqueue_and_write(queue, [("run-1", token(-10))]))
+
+    assert saves == []
+    assert queue._counts()[:2] == (0, 1)
+
+
+def test_failed_batch_backs_off_then_retries_alone(queue, saves):
+    saves.failing.add("run-2")
+    tokens = token(3600)
+    asyncio.run(enqueue_and_write(queue, [("run-1", tokens), ("run-2", tokens)]))
+
+    # The batch failed as a whole; nothing is retried until its backoff passes
+    assert len(saves) == 1
+    assert queue._counts()[0] == 2
+
+    queue._make_due()
+    asyncio.run(queue._write(queue._claim()))
+
+    assert sorted(call[0] for call in saves[1:]) == [["run-1"], ["run-2"]]
+    assert queue._counts()[0] == 1
@@ -0,0 +1,89 @@
+import asyncio
+import time
+
+from app.services.progress_service import (
+    AgentProgressTracker,
+    ProgressBatcher,
+    ProgressDeduplicator,
+    next_update,
+)
+
+
+def test_batcher_flushes_on_size():
+    batcher = ProgressBatcher(max_events=3, max_latency=60)
+    assert batcher.add({"type": "url", "message": "a"}) is False
+    assert batcher.add({"type": "url", "message": "b"}) is False
+    assert batcher.add({"type": "url", "message": "c"}) is True
+    assert [e["message"] for e in batcher.flush()] == ["a", "b", "c"]
+    assert batcher.flush() == []
+    assert batcher.timeout() is None
+
+
+def test_batcher_flushes_on_interval():
+    batcher = ProgressBatcher(max_events=100, max_latency=0.5)
+    assert batcher.timeout() is None
+
+    batcher.add({"type": "thought", "message": "fresh"})
+    assert 0 < batcher.timeout() <= 0.5
+
+    # Due once the oldest pending event has waited max_latency
+    stale = ProgressBatcher(max_events=100, max_latency=0.5)
+    stale.add({"type": "thought", "message": "old"}, produced_at=time.monotonic() - 1)
+    stale.add({"type": "thought", "message": "new"})
+    assert stale.timeout() == 0
+    assert len(stale.flush()) == 2
+
+
+def test_deduplicator_drops_repeats_within_bound():
+    dedup = ProgressDeduplicator(max_items=3)
+    assert dedup.is_new("urls", "https://example.com")
+    assert not dedup.is_new("urls", "https://example.com")
+    # The same text under another key is a different item
+    assert dedup.is_new("content", "https://example.com")
+
+
+def test_deduplicator_evicts_oldest_past_bound():
+    dedup = ProgressDeduplicator(max_items=2)
+    assert dedup.is_new("urls", "https://a.test")
+    assert dedup.is_new("urls", "https://b.test")
+    assert dedup.is_new("urls", "https://c.test")
+    assert len(dedup._seen) == 2
+    # a was evicted; b and c are still remembered
+    assert not dedup.is_new("urls", "https://c.test")
+    assert dedup.is_new("urls", "https://a.test")
+
+
+def test_deduplicator_repeat_refreshes_recency():
+    dedup = ProgressDeduplicator(max_items=2)
+    dedup.is_new("urls", "https://a.test")
+    dedup.is_new("urls", "https://b.test")
+    assert not dedup.is_new("urls", "https://a.test")
+    dedup.is_new("urls", "https://c.test")
+    # b was the least recently seen, so it went first
+    assert not dedup.is_new("urls", "https://a.test")
+    assert dedup.is_new("urls", "https://b.test")
+
+
+def test_next_update_returns_none_on_close():
+    async def scenario():
+        tracker = AgentProgressTracker()
+        tracker.close()
+        return await next_update(tracker, None, timeout=1)
+
+    assert asyncio.run(scenario()) == (True, None, None)
+
+
+def test_next_update_reuses_pending_get_after_timeout():
+    async def scenario():
+        tracker = AgentProgressTracker()
+        done, update, pending = await next_update(tracker, None, timeout=0.01)
+        assert (done, update) == (False, None)
+        assert pending is not None and not pending.done()
+
+        tracker.queue.put_nowait(("urls", "https://example.com", time.monotonic()))
+        done, update, pending_after = await next_update(tracker, pending, timeout=1)
+        assert done and pending_after is None
+        return update
+
+    key, value, _ = asyncio.run(scenario())
+    assert (key, value) == ("urls", "https://example.com")
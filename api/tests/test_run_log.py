@@ -0,0 +1,96 @@
+import asyncio
+
+from app.services import event_store
+from app.services.event_store import RunEventWriter, follow_run_events
+from app.services.run_log import RunEventLog, format_event_id, parse_event_id, unsaved
+
+# What a run that waited in the queue streams: only the events that go
+# through record() in stream_agent_progress are saved to run_events
+RUN_EVENTS = [
+    ({"type": "queued", "position": 2}, False),
+    ({"type": "queued", "position": 1}, False),
+    ({"type": "start", "message": "Starting task"}, True),
+    ({"type": "run_id", "message": "run-1"}, True),
+    ({"type": "url", "message": "Urls: a"}, True),
+    ({"type": "status", "message": "Generating document"}, True),
+    ({"type": "document_delta", "delta": "Hel"}, False),
+    ({"type": "document_delta", "delta": "lo"}, False),
+    ({"type": "document", "message": "Document generated"}, True),
+    ({"type": "complete", "message": "done"}, True),
+]
+
+
+async def run_saved(events, chunk_events=2):
+    """Rows a RunEventWriter writes for `events`, without a database."""
+    rows = []
+    writer = RunEventWriter("run-1", "user-1", chunk_events=chunk_events, flush_interval=60)
+
+    async def write(row):
+        rows.append(row)
+
+    writer._write = write
+    for event in events:
+        writer.add(event)
+    await writer.close()
+    return rows
+
+
+def fake_chunks(monkeypatch, rows):
+    async def read_chunks(user_id, run_id, auth_tokens, after_seq, page_size):
+        for row in sorted(rows, key=lambda r: r['seq']):
+            if row['seq'] > after_seq:
+                yield row
+
+    monkeypatch.setattr(event_store, "_read_chunks", read_chunks)
+
+
+async def fill_log(events):
+    log = RunEventLog("run-1", "user-1")
+    ids = [await log.append(dict(event)) for event in events]
+    await log.close()
+    return log, ids
+
+
+def test_saved_events_are_numbered_like_run_events():
+    events = [event for event, _ in RUN_EVENTS] + [unsaved({"type": "error", "message": "worker stopped"})]
+    _, ids = asyncio.run(fill_log(events))
+
+    saved_ids = [event_id for event_id, (_, saved) in zip(ids, RUN_EVENTS) if saved]
+    assert saved_ids == [(index, 0) for index in range(len(saved_ids))]
+    # Queue updates come before any saved event, deltas after the one they follow
+    assert [format_event_id(i) for i in ids[:2]] == ["-1:1", "-1:2"]
+    assert format_event_id(ids[6]) == "3:1"
+    # The unsaved error does not take an index a saved event could have
+    assert ids[-1] == (len(saved_ids) - 1, 1)
+
+
+def test_resume_on_another_worker_after_queued_phase(monkeypatch):
+    events = [event for event, _ in RUN_EVENTS]
+    saved = [event for event, is_saved in RUN_EVENTS if is_saved]
+    log, ids = asyncio.run(fill_log(events))
+    fake_chunks(monkeypatch, asyncio.run(run_saved(saved)))
+
+    # The client saw everything up to the "url" event, then reconnected
+    last_seen = ids[4]
+    expected = [event for event_id, event in zip(ids, events)
+                if event_id > last_seen and event["type"] not in ("queued", "document_delta")]
+
+    async def finished():
+        return True
+
+    async def follow():
+        return [event async for _, event in follow_run_events(
+            "user-1", "run-1", finished, after=parse_event_id(format_event_id(last_seen))[0],
+            poll_interval=0)]
+
+    assert asyncio.run(follow()) == expected
+
+
+def test_resume_on_same_worker_skips_seen_deltas():
+    events = [event for event, _ in RUN_EVENTS]
+    log, ids = asyncio.run(fill_log(events))
+
+    async def follow(after):
+        return [event_id async for event_id, _ in log.follow(after)]
+
+    assert asyncio.run(follow(parse_event_id("3:1"))) == ids[7:]
@@ -0,0 +1,58 @@
+"""Concurrency check of the save_run_document function (run_document_upsert.sql).
+
+Needs a Supabase project with the migrations applied, so it is skipped
+unless SUPABASE_URL, SUPABASE_KEY and SUPABASE_TEST_ACCESS_TOKEN (an access
+token of a test user) are set. The run it creates is deleted afterwards.
+"""
+import asyncio
+import os
+
+import pytest
+
+ACCESS_TOKEN = os.getenv("SUPABASE_TEST_ACCESS_TOKEN")
+PARALLEL_SAVES = 8
+
+pytestmark = pytest.mark.skipif(
+    not (ACCESS_TOKEN and os.getenv("SUPABASE_URL") and os.getenv("SUPABASE_KEY")),
+    reason="needs a Supabase project and SUPABASE_TEST_ACCESS_TOKEN"
+)
+
+
+def test_parallel_saves_leave_one_consistent_document():
+    jwt = pytest.importorskip("jwt")
+    from app.config.supabase import supabase, HISTORY_TABLE, DOCUMENT_TABLE
+    from app.services.history_service import (
+        build_history_record, save_history_records, update_history_with_document, delete_run_history)
+    from app.utils.auth import AuthTokens
+    from app.utils.db import execute
+
+    user_id = jwt.decode(ACCESS_TOKEN, options={"verify_signature": False})["sub"]
+    tokens = AuthTokens(ACCESS_TOKEN)
+
+    async def run():
+        record = build_history_record(user_id, "save_run_document concurrency test", [])
+        history_id = record['history']['id']
+        await save_history_records([record], auth_tokens=tokens)
+        try:
+            saved = await asyncio.gather(*(
+                update_history_with_document(
+                    user_id, history_id, f"document {i}", tokens, result=f"result {i}")
+                for i in range(PARALLEL_SAVES)
+            ))
+            documents = await execute(
+                supabase.table(DOCUMENT_TABLE).select('document_content').eq('history_id', history_id),
+                auth_tokens=tokens)
+            history = await execute(
+                supabase.table(HISTORY_TABLE).select('result').eq('id', history_id),
+                auth_tokens=tokens)
+            return saved, documents.data, history.data[0]['result']
+        finally:
+            await delete_run_history(user_id, history_id, tokens)
+
+    saved, documents, result = asyncio.run(run())
+
+    assert all(saved)
+    # One row however the saves interleaved, and the result and document
+    # come from the same save
+    assert len(documents) == 1
+    assert documents[0]['document_content'].split()[-1] == result.split()[-1]
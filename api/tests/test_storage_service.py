@@ -0,0 +1,36 @@
+import asyncio
+import hashlib
+
+import httpx
+
+from app.services import storage_service
+from app.services.storage_service import SupabaseObjectStore
+
+
+def test_supabase_put_file_streams_the_upload(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage_service, "READ_CHUNK_SIZE", 1024)
+    data = bytes(range(256)) * 20
+    path = tmp_path / "run.gif"
+    path.write_bytes(data)
+    uploads = []
+
+    def handler(request):
+        uploads.append((request.url.path, request.headers, request.read()))
+        return httpx.Response(200, json={"Key": "runs/gifs/r.gif"})
+
+    async def put():
+        store = SupabaseObjectStore(bucket="runs")
+        store._http = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        return await store.put_file("gifs/r.gif", path, "image/gif")
+
+    stored = asyncio.run(put())
+
+    [(url_path, headers, body)] = uploads
+    assert url_path == "/storage/v1/object/runs/gifs/r.gif"
+    assert headers["content-type"] == "image/gif"
+    assert headers["content-length"] == str(len(data))
+    assert headers["x-upsert"] == "true"
+    assert body == data
+    assert stored.size == len(data)
+    assert stored.etag == hashlib.sha256(data).hexdigest()
+    assert not path.exists()
@@ -22,9 +22,11 @@ import { useGifContent } from '@/hooks/useGifContent';
 import { useRouter, useParams } from 'next/navigation';
 
 interface ProgressEvent {
-  type: 'start' | 'url' | 'action' | 'thought' | 'error' | 'complete' | 'gif' | 'section' | 'run_id' | 'live_view_url';
+  type: 'start' | 'url' | 'action' | 'thought' | 'error' | 'complete' | 'gif' | 'section' | 'run_id' | 'live_view_url' | 'document_delta' | 'document_reset' | 'queued';
   message?: string;
-  content?: string;
+  position?: number; // For queued events
+  delta?: string; // For document_delta events
+  content?: string; // For document_reset events
   success?: boolean;
   title?: string;
   items?: string[];
@@ -52,6 +54,12 @@ export default function TaskChatPage() {
   const [gifContent, setGifContent] = useState<string | undefined>(undefined);
   const [currentRunId, setCurrentRunId] = useState<string | null>(null);
   const [shouldFetchGif, setShouldFetchGif] = useState(false);
+  // Document text streamed while it is generated, shown until the result arrives
+  const [documentDraft, setDocumentDraft] = useState<string | null>(null);
+  const documentDraftRef = useRef('');
+  // Place in the run queue while the task waits for a free slot
+  const [queuePosition, setQueuePosition] = useState<number | null>(null);
+  const draftFrameRef = useRef<number | null>(null);
   const resultsRef = useRef<HTMLDivElement>(null);
   const MAX_CHARS = 2000;
   const supabase = createClient();
@@ -130,6 +138,49 @@ export default function TaskChatPage() {
     }
   }, [progress, result]);
 
+  // Streamed document text is accumulated here instead of in the progress
+  // list; returns true when the event was part of the document stream
+  const handleDocumentStreamEvent = (event: ProgressEvent): boolean => {
+    if (event.type === 'document_delta') {
+      documentDraftRef.current += event.delta || '';
+      // Render at most once per frame, not once per token
+      if (draftFrameRef.current === null) {
+        draftFrameRef.current = requestAnimationFrame(() => {
+          draftFrameRef.current = null;
+          setDocumentDraft(documentDraftRef.current);
+        });
+      }
+      return true;
+    }
+    if (event.type === 'document_reset') {
+      // The finished document differs from what was streamed; replace it
+      documentDraftRef.current = event.content || '';
+      setDocumentDraft(documentDraftRef.current);
+      return true;
+    }
+    return false;
+  };
+
+  // Queue position updates replace each other instead of adding steps;
+  // returns true when the event was one
+  const handleQueueEvent = (event: ProgressEvent): boolean => {
+    if (event.type === 'queued') {
+      setQueuePosition(event.position ?? null);
+      return true;
+    }
+    setQueuePosition(null);
+    return false;
+  };
+
+  const resetDocumentDraft = () => {
+    if (draftFrameRef.current !== null) {
+      cancelAnimationFrame(draftFrameRef.current);
+      draftFrameRef.current = null;
+    }
+    documentDraftRef.current = '';
+    setDocumentDraft(null);
+  };
+
   const handleKeyDown = async (e: React.KeyboardEvent<HTMLTextAreaElement>) => {
     if (e.key === 'Enter' && !e.shiftKey) {
       e.preventDefault();
@@ -177,6 +228,8 @@ export default function TaskChatPage() {
     setGifContent(undefined);
     setCurrentRunId(null);
     setShouldFetchGif(false);
+    resetDocumentDraft();
+    setQueuePosition(null);
     
     // Always set these states regardless
     setLoading(true);
@@ -247,8 +300,10 @@ export default function TaskChatPage() {
               if (buffer.trim()) {
                 try {
                   const event = JSON.parse(buffer) as ProgressEvent;
-                  currentProgress = [...currentProgress, event];
-                  setProgress(currentProgress);
+                  if (!handleDocumentStreamEvent(event)) {
+                    currentProgress = [...currentProgress, event];
+                    setProgress(currentProgress);
+                  }
                 } catch (e) {
                   console.error('[Submit] Error parsing final buffer:', {
                     error: e instanceof Error ? {
@@ -279,6 +334,10 @@ export default function TaskChatPage() {
               if (line) {
                 try {
                   const event = JSON.parse(line) as ProgressEvent;
+                  if (handleQueueEvent(event) || handleDocumentStreamEvent(event)) {
+                    startIdx = endIdx + 1;
+                    continue;
+                  }
                   console.log('[Submit] Received event:', { type: event.type, hasMessage: !!event.message });
                   
                   if (event.type === 'run_id') {
@@ -290,6 +349,8 @@ export default function TaskChatPage() {
                   } else if (event.type === 'complete') {
                     console.log('[Submit] Task completed');
                     setResult(event.message || null);
+                    // The result includes the finished document
+                    resetDocumentDraft();
                     // Wait a moment to ensure GIF processing is complete before fetching
                     setTimeout(() => {
                       setShouldFetchGif(true);
@@ -375,6 +436,7 @@ export default function TaskChatPage() {
         console.log('[Submit] Task execution completed');
         setLoading(false);
         setIsStreaming(false);
+        setQueuePosition(null);
       }
     } catch (e) {
       // This outer catch block only handles session/authentication errors
@@ -483,8 +545,10 @@ export default function TaskChatPage() {
               if (buffer.trim()) {
                 try {
                   const event = JSON.parse(buffer) as ProgressEvent;
-                  currentProgress = [...currentProgress, event];
-                  setProgress(currentProgress);
+                  if (!handleDocumentStreamEvent(event)) {
+                    currentProgress = [...currentProgress, event];
+                    setProgress(currentProgress);
+                  }
                 } catch (e) {
                   console.error('[Initial] Error parsing final buffer:', e);
                 }
@@ -506,6 +570,10 @@ export default function TaskChatPage() {
               if (line) {
                 try {
                   const event = JSON.parse(line) as ProgressEvent;
+                  if (handleQueueEvent(event) || handleDocumentStreamEvent(event)) {
+                    startIdx = endIdx + 1;
+                    continue;
+                  }
                   
                   if (event.type === 'run_id') {
                     setCurrentRunId(event.message || null);
@@ -513,6 +581,7 @@ export default function TaskChatPage() {
                     setError(event.message || 'An error occurred');
                   } else if (event.type === 'complete') {
                     setResult(event.message || null);
+                    resetDocumentDraft();
                     setTimeout(() => {
                       setShouldFetchGif(true);
                     }, 2000);
@@ -540,6 +609,7 @@ export default function TaskChatPage() {
         } finally {
           setLoading(false);
           setIsStreaming(false);
+          setQueuePosition(null);
         }
       };
       
@@ -664,10 +734,22 @@ export default function TaskChatPage() {
 
             <AgentSteps progress={progress} isStreaming={isStreaming} />
 
+            {queuePosition !== null && (
+              <p className="text-sm text-muted-foreground">
+                Waiting for a free slot (position {queuePosition} in queue)
+              </p>
+            )}
+
             {loading && <LoadingAnimation />}
             
             {/* Error messages removed as per requirements */}
 
+            {!result && documentDraft && (
+              <div className="animate-in fade-in">
+                <MarkdownResult content={documentDraft} />
+              </div>
+            )}
+
             {result && (
               <div className="animate-in fade-in slide-in-from-bottom-2">
                 <MarkdownResult content={result} />
@@ -716,10 +798,22 @@ export default function TaskChatPage() {
 
             <AgentSteps progress={progress} isStreaming={isStreaming} />
 
+            {queuePosition !== null && (
+              <p className="text-sm text-muted-foreground">
+                Waiting for a free slot (position {queuePosition} in queue)
+              </p>
+            )}
+
             {loading && <LoadingAnimation />}
             
             {/* Error messages removed as per requirements */}
 
+            {!result && documentDraft && (
+              <div className="animate-in fade-in">
+                <MarkdownResult content={documentDraft} />
+              </div>
+            )}
+
             {result && (
               <div className="animate-in fade-in slide-in-from-bottom-2">
                 <MarkdownResult content={result} />
@@ -6,6 +6,8 @@ interface ChunkedResponse {
   chunk_index?: number;
   gif_content_complete?: boolean;
   document_content?: string;
+  progress_events?: unknown[];
+  progress_complete?: boolean;
   error?: string;
   [key: string]: unknown;
 }
@@ -113,6 +115,7 @@ export function useGifContent(runId: string | null, enabled = true) {
         const decoder = new TextDecoder();
         let result: GifContentResponse = {};
         const gifChunks: string[] = [];
+        const progressEvents: unknown[] = [];
         
         // Buffer for handling incomplete JSON chunks
         let buffer = '';
@@ -134,6 +137,19 @@ export function useGifContent(runId: string | null, enabled = true) {
               // Attempt to parse JSON
               const data = JSON.parse(line) as ChunkedResponse;
               
+              // Progress stored in chunks follows the metadata line
+              if (Array.isArray(data.progress_events)) {
+                // Queue position updates are not steps; older runs may have saved them
+                progressEvents.push(...data.progress_events.filter(
+                  (event) => (event as { type?: string } | null)?.type !== 'queued'
+                ));
+                continue;
+              }
+              if (data.progress_complete) {
+                result.progress = progressEvents;
+                continue;
+              }
+              
               // Handle metadata (first chunk)
               if (!result.gif_content && !data.gif_content_chunk) {
                 result = {...data as GifContentResponse};